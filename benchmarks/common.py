@@ -0,0 +1,23 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def emptyDirectory():
+    """
+    Runs the body in a new temporary working directory, so the app starts from an empty scene instead of
+    whatever scene is in the working directory, then goes back and deletes the directory with everything the
+    app wrote to it.
+    """
+    previous = os.getcwd()
+    # Worker threads of windows that are still alive may be writing thumbnails or assets while it is deleted
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(previous)
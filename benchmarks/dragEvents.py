@@ -0,0 +1,109 @@
+"""
+Measures how many mouse move events per second a drag can handle, applying every event versus once per frame.
+
+Run from the root directory:
+    python -m benchmarks.dragEvents [--events 5000] [--fps 60]
+
+Synthetic mouse events are sent to the 3D window of a MainWindow holding a single cube. The "immediate" mode
+reproduces the old pipeline, which moved the entity and reloaded the whole edit window on every event.
+In "coalesced" mode events only store the mouse position, and frames are simulated at --fps.
+"""
+import argparse
+import os
+import sys
+import time
+
+from benchmarks.common import emptyDirectory
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def mouseEvent(eventType, x, y, buttons):
+    from PySide6.QtCore import QPointF, Qt
+    from PySide6.QtGui import QMouseEvent
+    button = Qt.LeftButton if eventType != QMouseEvent.Type.MouseMove else Qt.NoButton
+    return QMouseEvent(eventType, QPointF(x, y), QPointF(x, y), button, buttons, Qt.NoModifier)
+
+
+def runDrag(window, entity, events, fps, immediate):
+    from PySide6.QtCore import QCoreApplication, QEvent, Qt
+
+    # Count the work done per drag
+    counts = {'panel': 0}
+    loadPosition = window.editWindow.loadPosition
+    loadEntity = window.editWindow.loadEntity
+
+    def countedLoadPosition(target):
+        counts['panel'] += 1
+        loadPosition(target)
+
+    def countedLoadEntity(target):
+        counts['panel'] += 1
+        loadEntity(target)
+
+    window.editWindow.loadPosition = countedLoadPosition
+    window.editWindow.loadEntity = countedLoadEntity
+
+    # Press on the center of the window, where the camera looks at the cube
+    centerX, centerY = window.view.width() / 2, window.view.height() / 2
+    QCoreApplication.sendEvent(window.view, mouseEvent(QEvent.MouseButtonPress, centerX, centerY, Qt.LeftButton))
+    stackBefore = window.commandStack.stats()
+    transformsBefore = window.sceneStore.transformVersion
+
+    frameInterval = 1 / fps
+    start = nextFrame = time.perf_counter()
+    for i in range(events):
+        x = centerX + 100 * ((i % 200) / 200 - 0.5)
+        QCoreApplication.sendEvent(window.view, mouseEvent(QEvent.MouseMove, x, centerY, Qt.LeftButton))
+        if immediate:
+            window.applyDrag()
+            window.editWindow.loadEntity(entity)
+        now = time.perf_counter()
+        if now >= nextFrame:
+            window.onFrame(frameInterval)
+            nextFrame = now + frameInterval
+    elapsed = time.perf_counter() - start
+
+    QCoreApplication.sendEvent(window.view, mouseEvent(QEvent.MouseButtonRelease, centerX, centerY, Qt.NoButton))
+    window.editWindow.loadPosition = loadPosition
+    window.editWindow.loadEntity = loadEntity
+    return {
+        'eventsPerSecond': events / elapsed,
+        'transformUpdates': window.sceneStore.transformVersion - transformsBefore,
+        'panelRefreshes': counts['panel'],
+        # Commands merged into the previous drag's command count too
+        'commands': sum(window.commandStack.stats()[key] - stackBefore[key] for key in ('entries', 'merged')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--fps', type=float, default=60)
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QVector3D
+    app = QApplication(sys.argv)
+
+    with emptyDirectory():
+        from src.constants import ShapeType
+        from src.mainWindow import MainWindow
+
+        window = MainWindow()
+        window.show()
+        app.processEvents()
+        entity = window.addEntity(ShapeType.CUBE)
+        entity.setPosition(QVector3D(0, 0, 0))
+
+        print(f"{'mode':>10} {'events/s':>10} {'transforms':>11} {'panel loads':>12} {'commands':>9}")
+        for immediate in (True, False):
+            entity.setPosition(QVector3D(0, 0, 0))
+            result = runDrag(window, entity, args.events, args.fps, immediate)
+            print(f"{'immediate' if immediate else 'coalesced':>10} {result['eventsPerSecond']:>10.0f} "
+                  f"{result['transformUpdates']:>11} {result['panelRefreshes']:>12} {result['commands']:>9}")
+        window.close()
+
+
+if __name__ == '__main__':
+    main()
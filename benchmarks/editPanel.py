@@ -0,0 +1,76 @@
+"""
+Counts the edit window widgets set per edit, undo and selection change, with and without the last-shown values.
+
+Run from the root directory:
+    python -m benchmarks.editPanel [--edits 500]
+
+A MainWindow holds a few cubes and spheres. Each edit steps one position or orientation spin box, like holding a
+spin box arrow, which creates a command. Undo and redo reload the panel, and selections alternate between the
+entities. The "uncached" mode forgets the shown values before every load, which sets every field like the panel
+did before it remembered them.
+"""
+import argparse
+import os
+import sys
+import time
+
+from benchmarks.common import emptyDirectory
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def runEdits(window, entities, edits, cached):
+    editWindow = window.editWindow
+    loadEntity = editWindow.loadEntity
+
+    def uncachedLoadEntity(entity):
+        editWindow.invalidate()
+        loadEntity(entity)
+
+    if not cached:
+        editWindow.loadEntity = uncachedLoadEntity
+    results = {}
+    spinBoxes = (editWindow.positionXEdit, editWindow.orientationYEdit)
+
+    def measure(name, count, action):
+        before = editWindow.widgetUpdates
+        start = time.perf_counter()
+        for i in range(count):
+            action(i)
+        results[name] = ((editWindow.widgetUpdates - before) / count, (time.perf_counter() - start) / count * 1e6)
+
+    window.uiWidget.selectEntity(entities[0])
+    measure('edit', edits, lambda i: spinBoxes[i % 2].stepBy(1 if i % 4 < 2 else -1))
+    measure('undo', edits // 2, lambda i: window.undo())
+    measure('redo', edits // 2, lambda i: window.redo())
+    measure('select', edits, lambda i: window.uiWidget.selectEntity(entities[i % len(entities)]))
+    editWindow.loadEntity = loadEntity
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--edits', type=int, default=500)
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv)
+
+    with emptyDirectory():
+        from src.constants import ShapeType
+        from src.mainWindow import MainWindow
+
+        window = MainWindow()
+        window.show()
+        app.processEvents()
+        entities = [window.addEntity(shape) for shape in (ShapeType.CUBE, ShapeType.SPHERE, ShapeType.CUBE)]
+
+        print(f"{'mode':>9} {'operation':>10} {'widgets/op':>11} {'us/op':>8}")
+        for cached in (False, True):
+            for name, (widgets, us) in runEdits(window, entities, args.edits, cached).items():
+                print(f"{'cached' if cached else 'uncached':>9} {name:>10} {widgets:>11.2f} {us:>8.0f}")
+        window.journal.close()
+
+
+if __name__ == '__main__':
+    main()
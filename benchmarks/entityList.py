@@ -0,0 +1,96 @@
+"""
+Measures adding, selecting and filtering entities in the object list, with the scene model versus a QListWidget.
+
+Run from the root directory:
+    python -m benchmarks.entityList [--count 100000] [--widget-count 2000] [--selections 200]
+
+The list holds lightweight stand-ins for Entity3D, so only the list itself is measured.
+The QListWidget rows reproduce the old list, which added items one by one and scanned the items to select one.
+It is quadratic in the number of entities, so it runs with --widget-count entities only.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+class ListEntity:
+    # Stands in for Entity3D, which the list only reads the name and shape of
+    __slots__ = ('name', 'shape', '__weakref__')
+
+    def __init__(self, name, shape):
+        self.name = name
+        self.shape = shape
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+def benchmarkWidget(app, entities, selected):
+    from PySide6.QtCore import Qt
+    from PySide6.QtWidgets import QListWidget, QListWidgetItem
+    widget = QListWidget()
+    widget.show()
+
+    def add():
+        for entity in entities:
+            item = QListWidgetItem(entity.name)
+            item.setData(Qt.UserRole, entity)
+            widget.addItem(item)
+            widget.setCurrentItem(item)
+
+    def select():
+        for entity in selected:
+            for i in range(widget.count()):
+                item = widget.item(i)
+                if item.data(Qt.UserRole) is entity:
+                    widget.setCurrentItem(item)
+                    break
+
+    addMs = timed(add)
+    app.processEvents()
+    return addMs, timed(select) / len(selected), None
+
+
+def benchmarkModel(app, entities, selected):
+    from src.userInterface import UIWidget
+    widget = UIWidget()
+    widget.show()
+    addMs = timed(lambda: widget.addEntitiesToList(entities))
+    app.processEvents()
+    selectMs = timed(lambda: [widget.selectEntity(entity) for entity in selected]) / len(selected)
+    filterMs = timed(lambda: widget.searchEdit.setText('sphere1'))
+    app.processEvents()
+    return addMs, selectMs, filterMs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--widget-count', type=int, default=2000)
+    parser.add_argument('--selections', type=int, default=200)
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    from src.constants import ShapeType
+    app = QApplication(sys.argv)
+
+    shapes = list(ShapeType)
+    print(f"{'list':>12} {'entities':>9} {'add ms':>9} {'select ms':>10} {'filter ms':>10}")
+    for name, benchmark, count in (('QListWidget', benchmarkWidget, min(args.widget_count, args.count)),
+                                   ('SceneModel', benchmarkModel, args.count)):
+        entities = [ListEntity(f"{shapes[i % 3].value}{i + 1}", shapes[i % 3]) for i in range(count)]
+        selected = random.Random(0).sample(entities, min(args.selections, len(entities)))
+        addMs, selectMs, filterMs = benchmark(app, entities, selected)
+        filterText = f"{filterMs:.1f}" if filterMs is not None else 'n/a'
+        print(f"{name:>12} {count:>9} {addMs:>9.1f} {selectMs:>10.3f} {filterText:>10}")
+
+
+if __name__ == '__main__':
+    main()
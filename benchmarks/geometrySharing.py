@@ -0,0 +1,109 @@
+"""
+Measures memory and frame time for scenes of identical entities, with and without shared geometry.
+
+Run from the root directory:
+    python -m benchmarks.geometrySharing [--counts 1000 10000 50000]
+
+Each configuration runs in its own process so the memory numbers do not leak into each other.
+Frame times are only reported when Qt3D can create a rendering context; under the offscreen
+platform without a GPU the frame column shows "n/a".
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import emptyDirectory
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def residentMemory():
+    # Resident set size in bytes, read from /proc where available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def runChild(count, shared, frames):
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QElapsedTimer
+    from PySide6.Qt3DLogic import Qt3DLogic
+
+    app = QApplication(sys.argv)
+
+    with emptyDirectory():
+        from src.constants import ShapeType
+        from src.entityObject import Entity3D
+        from src.geometryRegistry import GeometryRegistry
+        from src.mainWindow import MainWindow
+
+        window = MainWindow()
+        window.geometryRegistry = GeometryRegistry(window.rootEntity, shared=shared)
+        window.show()
+        app.processEvents()
+
+        before = residentMemory()
+        start = time.perf_counter()
+        for i in range(count):
+            # Bypass the object list so only the scene cost is measured
+            shape = ShapeType.CUBE if i % 2 else ShapeType.SPHERE
+            window.entities[Entity3D(window.rootEntity, shape, shape.value + str(i), window)] = None
+        createSeconds = time.perf_counter() - start
+        app.processEvents()
+        after = residentMemory()
+
+        # Time frames with a frame action, which Qt3D triggers once per simulated frame
+        frameTimes = []
+        frameAction = Qt3DLogic.QFrameAction(window.rootEntity)
+        window.rootEntity.addComponent(frameAction)
+        frameAction.triggered.connect(lambda dt: frameTimes.append(dt * 1000))
+        timer = QElapsedTimer()
+        timer.start()
+        while len(frameTimes) < frames and timer.elapsed() < 10000:
+            app.processEvents()
+
+        frameTimes = sorted(frameTimes[1:])
+        return {
+            'count': count,
+            'shared': shared,
+            'meshes': window.geometryRegistry.stats()['meshes'],
+            'createSeconds': createSeconds,
+            'memoryBytes': after - before,
+            'medianFrameMs': frameTimes[len(frameTimes) // 2] if frameTimes else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--unshared', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(runChild(args.counts[0], not args.unshared, args.frames)))
+        return
+
+    print(f"{'entities':>9} {'mode':>9} {'meshes':>7} {'create s':>9} {'memory MB':>10} {'frame ms':>9}")
+    for count in args.counts:
+        for shared in (True, False):
+            command = [sys.executable, '-m', 'benchmarks.geometrySharing', '--child',
+                       '--counts', str(count), '--frames', str(args.frames)]
+            if not shared:
+                command.append('--unshared')
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            frame = f"{result['medianFrameMs']:.2f}" if result['medianFrameMs'] is not None else 'n/a'
+            print(f"{count:>9} {'shared' if shared else 'unshared':>9} {result['meshes']:>7} "
+                  f"{result['createSeconds']:>9.2f} {result['memoryBytes'] / 2**20:>10.1f} {frame:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures moving a group of children through their parent against moving each child, and the world transform cache.
+
+Run from the root directory:
+    python -m benchmarks.hierarchy [--counts 10000 100000] [--children 5000] [--depth 1] [--repeat 20]
+
+The scene is built directly in a SceneStore, like benchmarks.pickLatency, so no Qt objects are created. The first
+--children rows are put under one parent, in a chain of --depth levels. "parent move" writes the parent's position
+and brings the world transforms up to date; "each child" writes the position of every child one by one, like
+calling setPosition on each entity, then updates. "other move" moves one entity outside the group, "idle" updates
+with nothing moved, and "all transforms" returns the world matrices of the whole scene.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.pickLatency import buildStore
+from src.sceneStore import DIRTY_TRANSFORM
+
+
+def timeMs(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--children', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    offset = np.array((0.01, 0, 0), np.float32)
+
+    print(f"{'entities':>9} {'children':>9} {'full ms':>8} {'parent move ms':>15} {'each child ms':>14} "
+          f"{'other move ms':>14} {'idle ms':>8} {'all transforms ms':>18}")
+    for count in args.counts:
+        store, _ = buildStore(count, rng)
+        children = min(args.children, count - args.depth)
+        # A chain of parents, the last of which holds the children
+        for level in range(1, args.depth):
+            store.setParent(level, level - 1)
+        parent = args.depth - 1
+        for row in range(args.depth, args.depth + children):
+            store.setParent(row, parent)
+        fullMs = timeMs(store.updateWorld, 1)
+
+        def moveParent():
+            store.translation[0] += offset
+            store.markDirty(0, DIRTY_TRANSFORM)
+            store.updateWorld()
+
+        def moveEachChild():
+            for row in range(args.depth, args.depth + children):
+                store.translation[row] += offset
+                store.markDirty(row, DIRTY_TRANSFORM)
+            store.updateWorld()
+
+        def moveOther():
+            store.translation[count - 1] += offset
+            store.markDirty(count - 1, DIRTY_TRANSFORM)
+            store.updateWorld()
+
+        parentMs = timeMs(moveParent, args.repeat)
+        eachMs = timeMs(moveEachChild, max(args.repeat // 4, 1))
+        otherMs = timeMs(moveOther, args.repeat)
+        idleMs = timeMs(store.updateWorld, args.repeat)
+        transformsMs = timeMs(store.worldTransforms, max(args.repeat // 4, 1))
+        print(f"{count:>9} {children:>9} {fullMs:>8.1f} {parentMs:>15.2f} {eachMs:>14.2f} "
+              f"{otherMs:>14.2f} {idleMs:>8.3f} {transformsMs:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares drawing entities with a Qt3D entity each against one instanced draw call per shared mesh.
+
+Run from the root directory:
+    python -m benchmarks.instancing [--counts 1000 10000] [--sizes 4]
+
+Cubes and spheres of --sizes different dimensions are created directly, bypassing the object list, so
+there are 2 * sizes shared meshes. "nodes" counts the Qt3D nodes in the scene and "draws" the entities
+with a renderer that Qt3D draws, one draw call each. "move all" is the time to push a move of every entity
+to Qt, and "move one" a move of a single entity, as while dragging. Frame times need a rendering context,
+which the offscreen platform without a GPU does not have, so they are not measured.
+"""
+import argparse
+import os
+import sys
+import time
+
+from benchmarks.common import emptyDirectory
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def runMode(count, sizes, instanced, windows):
+    from PySide6.Qt3DCore import Qt3DCore
+    from src.constants import ShapeType
+    from src.entityObject import Entity3D
+    from src.mainWindow import MainWindow
+
+    window = MainWindow()
+    window.setInstanced(instanced)
+    # Keep the window alive until the end; deleting it while its loader is queued fails
+    windows.append(window)
+    store = window.sceneStore
+
+    start = time.perf_counter()
+    for i in range(count):
+        shape = ShapeType.CUBE if i % 2 else ShapeType.SPHERE
+        size = 1 + (i // 2) % sizes
+        dimensions = (size,) if shape == ShapeType.SPHERE else (size, size, size)
+        window.entities[Entity3D(window.rootEntity, shape, shape.value + str(i), window, dimensions)] = None
+    createMs = (time.perf_counter() - start) * 1000
+
+    def push():
+        start = time.perf_counter()
+        store.flush()
+        window.instanceRenderer.flush()
+        return (time.perf_counter() - start) * 1000
+
+    # The first push writes every new entity
+    firstMs = push()
+    nodes = len(window.rootEntity.findChildren(Qt3DCore.QNode))
+    draws = len(window.instanceRenderer.batches) if instanced else count
+
+    store.translate(list(range(store.count)), (0.01, 0, 0))
+    moveAllMs = push()
+    moves = 200
+    moveOneMs = 0
+    for i in range(moves):
+        store.translate([i % store.count], (0.01, 0, 0))
+        moveOneMs += push()
+    window.journal.close()
+    return createMs, firstMs, nodes, draws, moveAllMs, moveOneMs / moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--sizes', type=int, default=4)
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv)
+
+    with emptyDirectory():
+        print(f"{'entities':>9} {'mode':>10} {'create ms':>10} {'first push ms':>14} {'nodes':>7} {'draws':>6} "
+              f"{'move all ms':>12} {'move one ms':>12}")
+        windows = []
+        for count in args.counts:
+            for instanced in (False, True):
+                createMs, firstMs, nodes, draws, moveAllMs, moveOneMs = runMode(count, args.sizes, instanced, windows)
+                mode = 'instanced' if instanced else 'entities'
+                print(f"{count:>9} {mode:>10} {createMs:>10.0f} {firstMs:>14.1f} {nodes:>7} {draws:>6} "
+                      f"{moveAllMs:>12.1f} {moveOneMs:>12.3f}")
+                app.processEvents()
+
+
+if __name__ == '__main__':
+    main()
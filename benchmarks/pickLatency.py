@@ -0,0 +1,114 @@
+"""
+Measures ray pick latency against scene size, with the BVH and with a brute-force test of every entity.
+
+Run from the root directory:
+    python -m benchmarks.pickLatency [--counts 1000 10000 100000] [--rays 200]
+
+The scene is built directly in a SceneStore, so no Qt objects are created and no display is needed.
+The last row times rays against the triangles of stl/vase.stl with and without the triangle BVH.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from src.constants import ShapeType
+from src.picking import PickingEngine, TriangleBvh, rayBoxDistances, rayTriangleDistances, safeInverse
+from src.sceneStore import SHAPES, SceneStore
+from src.stlLoader import loadStl
+
+
+class RowView:
+    # Stands in for Entity3D, which the store only needs for its row
+    __slots__ = ('row',)
+
+
+def buildStore(count, rng):
+    store = SceneStore()
+    extent = math.cbrt(count) * 4
+    for _ in range(count):
+        view = RowView()
+        view.row = store.allocate(view)
+    rows = slice(0, count)
+    shapes = rng.integers(0, 2, count)
+    store.shape[rows] = np.where(shapes, SHAPES.index(ShapeType.SPHERE), SHAPES.index(ShapeType.CUBE))
+    store.localMin[rows] = -0.5
+    store.localMax[rows] = 0.5
+    store.translation[rows] = rng.uniform(-extent, extent, (count, 3))
+    rotation = rng.normal(size=(count, 4))
+    store.rotation[rows] = rotation / np.linalg.norm(rotation, axis=1, keepdims=True)
+    store.scale[rows] = rng.uniform(0.5, 2, (count, 3))
+    return store, extent
+
+
+def randomRays(rng, count, extent):
+    # Rays from outside the scene aimed at random points inside it, like a camera looking at the scene
+    origins = rng.normal(size=(count, 3))
+    origins *= 3 * extent / np.linalg.norm(origins, axis=1, keepdims=True)
+    directions = rng.uniform(-extent, extent, (count, 3)) - origins
+    return origins, directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+def bruteForcePick(engine, origin, direction):
+    # Test the world bounds of every entity, then the exact shapes of the boxes that were hit
+    distances = rayBoxDistances(origin, safeInverse(direction), engine.mins, engine.maxs)
+    best, bestRow = math.inf, None
+    for row in np.flatnonzero(np.isfinite(distances)).tolist():
+        distance = engine.intersectRow(row, origin, direction)
+        if distance < best:
+            best, bestRow = distance, row
+    return None if bestRow is None else (bestRow, best)
+
+
+def timePicks(pick, origins, directions):
+    start = time.perf_counter()
+    results = [pick(origin, direction) for origin, direction in zip(origins, directions)]
+    return (time.perf_counter() - start) / len(origins) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--rays', type=int, default=200)
+    parser.add_argument('--stl', default='stl/vase.stl')
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'entities':>9} {'build ms':>9} {'refit ms':>9} {'bvh pick ms':>12} {'brute pick ms':>14} {'hits':>5}")
+    for count in args.counts:
+        store, extent = buildStore(count, rng)
+        engine = PickingEngine(store)
+
+        start = time.perf_counter()
+        engine.update()
+        buildMs = (time.perf_counter() - start) * 1000
+
+        # Move every entity, which refits the BVH on the next pick instead of rebuilding it
+        store.translate(slice(0, count), (0.1, 0, 0))
+        start = time.perf_counter()
+        engine.update()
+        refitMs = (time.perf_counter() - start) * 1000
+
+        origins, directions = randomRays(rng, args.rays, extent)
+        bvhMs, bvhResults = timePicks(engine.pick, origins, directions)
+        bruteMs, bruteResults = timePicks(lambda o, d: bruteForcePick(engine, o, d), origins, directions)
+        if [r and r[0] for r in bvhResults] != [r and r[0] for r in bruteResults]:
+            print("Warning: the BVH and brute-force picks disagree")
+        hits = sum(result is not None for result in bvhResults)
+        print(f"{count:>9} {buildMs:>9.1f} {refitMs:>9.1f} {bvhMs:>12.3f} {bruteMs:>14.3f} {hits:>5}")
+
+    data = loadStl(args.stl)
+    triangles = data.triangles().astype(np.float64)
+    start = time.perf_counter()
+    bvh = TriangleBvh(triangles)
+    buildMs = (time.perf_counter() - start) * 1000
+    low, high = data.bounds()
+    origins, directions = randomRays(rng, args.rays, float(np.abs([low, high]).max()))
+    bvhMs, _ = timePicks(bvh.intersect, origins, directions)
+    bruteMs, _ = timePicks(lambda o, d: rayTriangleDistances(o, d, triangles).min(), origins, directions)
+    print(f"{str(len(triangles)) + ' tri':>9} {buildMs:>9.1f} {'':>9} {bvhMs:>12.3f} {bruteMs:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
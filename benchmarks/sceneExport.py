@@ -0,0 +1,69 @@
+"""
+Measures exporting scenes to binary STL, OBJ and binary glTF: time, file size and peak memory.
+
+Run from the root directory:
+    python -m benchmarks.sceneExport [--counts 10000 30000] [--stl-fraction 0.002] [--formats stl obj glb]
+
+The scenes are the suite's synthetic scenes of cubes, spheres and copies of stl/vase.stl, each built in a new
+window in an empty directory. "peak MB" is the resident memory above the memory at the start of the export,
+sampled while it runs; exports are written a chunk of EXPORT_CHUNK_VERTICES vertices at a time, so it should
+stay about the same as the scenes grow.
+"""
+import argparse
+import os
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from benchmarks.common import emptyDirectory
+from benchmarks.suite import Measurement, syntheticScene
+
+
+def runScene(count, args, windows):
+    from src.mainWindow import MainWindow
+
+    with emptyDirectory():
+        window = MainWindow()
+        windows.append(window)
+        window.addEntities(syntheticScene(count, args.stl_fraction, 1, 0))
+        window.stlImporter.wait()
+        window.onFrame(0)
+
+        rows = []
+        for extension in args.formats:
+            results = {}
+            filename = f'scene.{extension}'
+            with Measurement(results, 'export'):
+                window.exportScene(filename)
+            rows.append((extension, window.uiWidget.statusLabel.text(), results['export']['ms'],
+                         os.path.getsize(filename) / 1e6, results['export']['peakMemoryBytes'] / 1e6))
+            os.remove(filename)
+        window.journal.close()
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 30000])
+    parser.add_argument('--stl-fraction', type=float, default=0.002)
+    parser.add_argument('--formats', nargs='+', default=['stl', 'obj', 'glb'])
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv)
+
+    # Windows stay alive after their scene's directory is deleted; anything they write later goes here
+    with emptyDirectory():
+        print(f"{'entities':>9} {'format':>7} {'triangles':>10} {'export ms':>10} {'file MB':>8} {'peak MB':>8}")
+        # Keep the windows alive until the end; deleting one while its loader is queued fails
+        windows = []
+        for count in args.counts:
+            for extension, status, ms, fileMb, peakMb in runScene(count, args, windows):
+                # The status reads "Exported <entities> objects, <triangles> triangles, to <file>"
+                triangles = status.split(', ')[1].split()[0]
+                print(f"{count:>9} {extension:>7} {triangles:>10} {ms:>10.0f} {fileMb:>8.1f} {peakMb:>8.1f}")
+            app.processEvents()
+
+
+if __name__ == '__main__':
+    main()
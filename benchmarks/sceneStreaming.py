@@ -0,0 +1,76 @@
+"""
+Measures the time and peak memory of saving and loading JSON scenes whole and streamed in chunks.
+
+Run from the root directory:
+    python -m benchmarks.sceneStreaming [--counts 100000 1000000] [--formats json json.gz]
+
+Each count, format and mode runs in its own process. The scene is generated as SceneColumns first, standing in
+for the SceneStore, and its memory is not counted. The "whole" mode builds the list of every dictionary and
+reads the file with json.load, like the application did before streaming; the "stream" mode serializes and
+writes one chunk of dictionaries at a time, like MainWindow.save_data, and reads records one at a time, like
+the scene loader. Peak memory is the resident memory above the memory at the start of the operation.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.suite import Measurement
+
+
+def runChild(count, extension, mode, chunkSize):
+    from src.sceneFormat import iterRecords, readScene, writeScene, writeSceneChunks
+    from src.sceneGenerators import scatterLayout
+
+    scene = scatterLayout(count, seed=0)
+    path = os.path.join(tempfile.mkdtemp(), 'scene.' + extension)
+    results = {}
+    if mode == 'whole':
+        with Measurement(results, 'save'):
+            writeScene(scene.records(), path)
+        with Measurement(results, 'load'):
+            loaded = len(readScene(path))
+    else:
+        with Measurement(results, 'save'):
+            writeSceneChunks((scene.records(start, start + chunkSize) for start in range(0, count, chunkSize)), path)
+        with Measurement(results, 'load'):
+            loaded = sum(1 for _ in iterRecords(path))
+    if loaded != count:
+        raise RuntimeError(f"Loaded {loaded} records instead of {count}")
+    results['fileBytes'] = os.path.getsize(path)
+    os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--formats', nargs='+', default=['json', 'json.gz'])
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        count, extension, mode = args.child
+        print(json.dumps(runChild(int(count), extension, mode, args.chunk_size)))
+        return
+
+    print(f"{'count':>8} {'format':>8} {'mode':>7} {'save s':>7} {'save MB':>8} {'load s':>7} {'load MB':>8} "
+          f"{'file MB':>8}")
+    for count in args.counts:
+        for extension in args.formats:
+            for mode in ('whole', 'stream'):
+                command = [sys.executable, '-m', 'benchmarks.sceneStreaming', '--child', str(count), extension, mode,
+                           '--chunk-size', str(args.chunk_size)]
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                save, load = result['save'], result['load']
+                print(f"{count:>8} {extension:>8} {mode:>7} {save['ms'] / 1000:>7.2f} "
+                      f"{save['peakMemoryBytes'] / 2**20:>8.1f} {load['ms'] / 1000:>7.2f} "
+                      f"{load['peakMemoryBytes'] / 2**20:>8.1f} {result['fileBytes'] / 2**20:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
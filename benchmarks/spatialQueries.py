@@ -0,0 +1,75 @@
+"""
+Measures spatial query latency against scene size, with the spatial hash and with a test of every entity's bounds.
+
+Run from the root directory:
+    python -m benchmarks.spatialQueries [--counts 1000 10000 100000] [--queries 200]
+
+The scene is built directly in a SceneStore at a constant density, like benchmarks.pickLatency, so no Qt objects
+are created. "move" is the incremental update after one entity moved, as while dragging. Box and radius queries
+cover about one entity size around random points in the scene; nearest finds the 4 closest entities. The brute
+force columns test the world bounds of every entity, read once up front, so they only measure the test itself.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.pickLatency import buildStore
+from src.spatialHash import SpatialHash, boxDistances
+
+
+def timeCalls(function, arguments):
+    start = time.perf_counter()
+    results = [function(*argument) for argument in arguments]
+    return (time.perf_counter() - start) / len(arguments) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'entities':>9} {'build ms':>9} {'move us':>8} {'box us':>7} {'brute us':>9} {'radius us':>10} "
+          f"{'nearest us':>11} {'brute us':>9} {'place us':>9}")
+    for count in args.counts:
+        store, extent = buildStore(count, rng)
+        spatialHash = SpatialHash(store)
+
+        start = time.perf_counter()
+        spatialHash.update()
+        buildMs = (time.perf_counter() - start) * 1000
+
+        moves = [(row,) for row in rng.integers(0, count, args.queries).tolist()]
+
+        def move(row):
+            store.translate([row], (0.01, 0, 0))
+            spatialHash.update()
+        moveUs, _ = timeCalls(move, moves)
+
+        points = rng.uniform(-extent, extent, (args.queries, 3))
+        boxes = [(point - 1, point + 1) for point in points]
+        boxUs, boxResults = timeCalls(spatialHash.queryBox, boxes)
+        mins, maxs = store.worldBounds()
+        bruteBoxUs, bruteResults = timeCalls(
+            lambda low, high: np.flatnonzero(np.all((mins <= high) & (maxs >= low), axis=1)), boxes)
+        if any(set(a.tolist()) != set(b.tolist()) for a, b in zip(boxResults, bruteResults)):
+            print("Warning: the spatial hash and brute-force box queries disagree")
+
+        radiusUs, _ = timeCalls(spatialHash.queryRadius, [(point, 1) for point in points])
+        nearestUs, nearestResults = timeCalls(spatialHash.nearest, [(point, 4) for point in points])
+        bruteNearestUs, bruteNearest = timeCalls(
+            lambda point: np.sort(boxDistances(point, mins, maxs))[:4], [(point,) for point in points])
+        if not all(np.allclose(a[1], b) for a, b in zip(nearestResults, bruteNearest)):
+            print("Warning: the spatial hash and brute-force nearest queries disagree")
+
+        # Place one entity in the plane through random points, like MainWindow.placeEntity
+        placeUs, _ = timeCalls(spatialHash.freePosition,
+                               [(0, point, ((1, 0, 0), (0, 1, 0)), 0.5) for point in points[:20]])
+        print(f"{count:>9} {buildMs:>9.1f} {moveUs:>8.0f} {boxUs:>7.0f} {bruteBoxUs:>9.0f} {radiusUs:>10.0f} "
+              f"{nearestUs:>11.0f} {bruteNearestUs:>9.0f} {placeUs:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
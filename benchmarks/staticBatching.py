@@ -0,0 +1,113 @@
+"""
+Measures freezing entities into static batches: draw calls, build and rebuild times, thawing and picking.
+
+Run from the root directory:
+    python -m benchmarks.staticBatching [--counts 1000 10000] [--picks 200]
+
+A grid of cubes and spheres is added with MainWindow.addEntities and every entity is frozen. "freeze ms" is the
+time the GUI thread spends gathering the meshes and transforms and "build ms" the time until the worker thread
+has built every batch and they are drawn. "draws" counts the entities with a renderer that Qt3D draws before and
+after freezing. "thaw ms" is the time the GUI thread takes to thaw one entity after an edit, and "rebuild ms" the
+time until its batch is drawn without it. Picks are cast at random entities before and after freezing. Frame
+times need a rendering context, which the offscreen platform without a GPU does not have, so they are not measured.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import emptyDirectory
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def settle(batcher):
+    # Wait for the worker, then deliver its results and the rebuilds they schedule
+    from PySide6.QtCore import QCoreApplication
+    while True:
+        batcher.pool.submit(lambda: None).result()
+        QCoreApplication.sendPostedEvents()
+        QCoreApplication.processEvents()
+        if not batcher.staleBatches and not any(batch.building for batch in batcher.batches):
+            return
+
+
+def timePicks(window, rng, picks):
+    # Rays straight down the Z axis at random entities
+    store = window.sceneStore
+    rows = rng.integers(0, store.count, picks)
+    start = time.perf_counter()
+    hits = 0
+    for row in rows.tolist():
+        origin = store.worldTranslation[row] + (0, 0, 1000)
+        hits += window.pickingEngine.pick(origin, np.array((0, 0, -1.0))) is not None
+    return (time.perf_counter() - start) / picks * 1000, hits
+
+
+def runScene(count, picks, windows):
+    from PySide6.QtGui import QColor
+    from src.constants import ShapeType
+    from src.mainWindow import MainWindow
+    from src.sceneGenerators import gridLayout
+
+    with emptyDirectory():
+        window = MainWindow()
+        windows.append(window)
+        side = math.ceil(math.sqrt(count / 2))
+        window.addEntities(gridLayout((side, side, 1), shape=ShapeType.CUBE))
+        window.addEntities(gridLayout((side, side, 1), shape=ShapeType.SPHERE, origin=(0, 0, 3)))
+        window.onFrame(0)
+        batcher = window.staticBatcher
+        rng = np.random.default_rng(0)
+        drawsBefore = sum(entity.entity is not None for entity in window.entities)
+        pickBefore, _ = timePicks(window, rng, picks)
+
+        start = time.perf_counter()
+        window.freezeEntities(list(window.entities))
+        freezeMs = (time.perf_counter() - start) * 1000
+        settle(batcher)
+        buildMs = (time.perf_counter() - start) * 1000
+        drawsAfter = sum(entity.entity is not None for entity in window.entities) + len(batcher.batches)
+        pickAfter, _ = timePicks(window, rng, picks)
+
+        # An edit thaws the entity on the next frame
+        entity = next(iter(window.entities))
+        start = time.perf_counter()
+        entity.setColor(QColor(255, 0, 0))
+        window.onFrame(0)
+        thawMs = (time.perf_counter() - start) * 1000
+        settle(batcher)
+        rebuildMs = (time.perf_counter() - start) * 1000
+        window.journal.close()
+        return (len(window.entities), drawsBefore, drawsAfter, batcher.stats()['triangles'], freezeMs, buildMs,
+                thawMs, rebuildMs, pickBefore, pickAfter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--picks', type=int, default=200)
+    args = parser.parse_args()
+
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv)
+
+    # Windows stay alive after their scene's directory is deleted; anything they write later goes here
+    with emptyDirectory():
+        print(f"{'entities':>9} {'draws':>6} {'frozen draws':>13} {'triangles':>10} {'freeze ms':>10} {'build ms':>9} "
+              f"{'thaw ms':>8} {'rebuild ms':>11} {'pick ms':>8} {'frozen pick ms':>15}")
+        # Keep the windows alive until the end; deleting one while its loader is queued fails
+        windows = []
+        for count in args.counts:
+            (entities, drawsBefore, drawsAfter, triangles, freezeMs, buildMs, thawMs, rebuildMs,
+             pickBefore, pickAfter) = runScene(count, args.picks, windows)
+            print(f"{entities:>9} {drawsBefore:>6} {drawsAfter:>13} {triangles:>10} {freezeMs:>10.0f} {buildMs:>9.0f} "
+                  f"{thawMs:>8.1f} {rebuildMs:>11.0f} {pickBefore:>8.2f} {pickAfter:>15.2f}")
+            app.processEvents()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Runs the scene hot paths on synthetic scenes and compares the timings against a stored baseline.
+
+Run from the root directory:
+    python -m benchmarks.suite [--sizes 1000 5000] [--repeat 3] [--output results.json]
+                               [--baseline benchmarks/baseline.json] [--tolerance 0.25] [--update-baseline]
+
+Each scene size runs --repeat times, each time in its own process in an empty directory. The scenes mix
+cubes, spheres and copies of stl/vase.stl. For every operation the suite records the wall time and the peak
+resident memory above the memory at the start of the operation, sampled in a background thread, so Qt
+allocations are included. The fastest of the repeats is kept, since noise only ever adds time.
+The results are written as JSON. Operations slower than the baseline by more than the tolerance, and by
+more than --min-ms, are reported as regressions and make the suite exit with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from benchmarks.common import emptyDirectory
+from benchmarks.geometrySharing import residentMemory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STL_SOURCE = os.path.join(ROOT, 'stl', 'vase.stl')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+class Measurement:
+    # Times a block and samples the resident memory while it runs
+    def __init__(self, results, name, interval=0.002):
+        self.results = results
+        self.name = name
+        self.interval = interval
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, residentMemory())
+
+    def __enter__(self):
+        self.done = threading.Event()
+        self.start = self.peak = residentMemory()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.done.set()
+        self.sampler.join()
+        self.peak = max(self.peak, residentMemory())
+        self.results[self.name] = {'ms': elapsed * 1000, 'peakMemoryBytes': self.peak - self.start}
+
+
+def syntheticScene(count, stlFraction, stlCopies, seed):
+    import numpy as np
+    from src.constants import ShapeType
+    from src.sceneFormat import SceneColumns
+    from src.sceneGenerators import scatterLayout
+    from src.sceneStore import SHAPES
+
+    # Keep the scene behind z = 0, so the entity dragged in front of the camera is the one picked
+    scene = scatterLayout(count, bounds=((-50, -50, -50), (50, 50, 0)), seed=seed)
+    columns = scene.columns
+    shapes = [SHAPES[index] for index in columns['shape'].tolist()]
+    sources = [None] * count
+
+    # Copies of the vase are separate files; the asset store finds they have the same content and parses one
+    copies = [shutil.copyfile(STL_SOURCE, f"vase{copy}.stl") for copy in range(stlCopies)]
+    stlRows = np.flatnonzero(np.random.default_rng(seed).random(count) < stlFraction).tolist()
+    for index, row in enumerate(stlRows):
+        shapes[row] = ShapeType.STL
+        sources[row] = copies[index % stlCopies]
+    return SceneColumns.fromArrays(shapes, columns['position'], columns['orientation'], columns['color'],
+                                   columns['dimensions'], sources=sources)
+
+
+def runChild(count, args):
+    import numpy as np
+    from PySide6.QtCore import QPointF
+    from PySide6.QtGui import QVector3D
+    from PySide6.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+
+    with emptyDirectory():
+        from benchmarks.dragEvents import runDrag
+        from src.command import Command
+        from src.constants import ShapeType
+        from src.mainWindow import MainWindow
+
+        window = MainWindow()
+        window.show()
+        app.processEvents()
+        scene = syntheticScene(count, args.stl_fraction, args.stl_copies, args.seed)
+        results = {}
+
+        # STL files load on worker threads, so wait for them to keep the measurement comparable
+        with Measurement(results, 'create'):
+            entities = window.addEntities(scene)
+            window.stlImporter.wait()
+        with Measurement(results, 'firstFrame'):
+            window.onFrame(0)
+
+        with Measurement(results, 'toDict'):
+            for entity in entities:
+                entity.toDict()
+        with Measurement(results, 'saveBinary'):
+            window.save_data(entities, 'saved.scene')
+        with Measurement(results, 'saveJson'):
+            window.save_data(entities, 'saved.json')
+
+        edited = entities[:args.edits]
+        with Measurement(results, 'updateProperties'):
+            for i, entity in enumerate(edited):
+                entity.updateProperties({'position': (i, 0, -10), 'color': (255, 0, 0, 255)})
+        commands = [Command(entity, {'position': (0, i, -10)}) for i, entity in enumerate(edited)]
+        with Measurement(results, 'commandExecute'):
+            for command in commands:
+                command.execute()
+        with Measurement(results, 'commandUndo'):
+            for command in reversed(commands):
+                command.undo()
+        window.onFrame(0)
+
+        # Rays through random points of the window; the first pick also builds the BVH
+        rng = np.random.default_rng(args.seed)
+        points = [QPointF(x, y) for x, y in rng.uniform(0, 1, (args.picks, 2)) * (window.view.width(),
+                                                                                 window.view.height())]
+        with Measurement(results, 'pickBuild'):
+            window.pickingEngine.update()
+        with Measurement(results, 'pick'):
+            for point in points:
+                window.pickingEngine.pick(*window.cameraRay(point))
+
+        # Drag a cube between the camera and the scene
+        target = window.addEntity(ShapeType.CUBE)
+        target.setPosition(QVector3D(0, 0, 5))
+        window.onFrame(0)
+        with Measurement(results, 'drag'):
+            runDrag(window, target, args.drag_events, 60, False)
+
+        # Fold the journal into a snapshot, then load it in a new window and build every entity
+        with Measurement(results, 'snapshot'):
+            window.journal.close()
+        with Measurement(results, 'load'):
+            loaded = MainWindow()
+            while loaded.sceneLoader.isLoading():
+                loaded.sceneLoader.loadSlice()
+            loaded.stlImporter.wait()
+        if len(loaded.entities) != len(window.entities):
+            raise RuntimeError(f"Loaded {len(loaded.entities)} entities instead of {len(window.entities)}")
+        loaded.journal.close()
+        return results
+
+
+def compare(results, baseline, tolerance, minMs):
+    # Returns the keys that are slower than the baseline by more than the tolerance and minMs
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if result['ms'] > reference['ms'] * (1 + tolerance) and result['ms'] - reference['ms'] > minMs:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stl-fraction', type=float, default=0.02)
+    parser.add_argument('--stl-copies', type=int, default=4)
+    parser.add_argument('--edits', type=int, default=1000)
+    parser.add_argument('--picks', type=int, default=200)
+    parser.add_argument('--drag-events', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-ms', type=float, default=2.0)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(runChild(args.sizes[0], args)))
+        return
+
+    results = {}
+    for size in args.sizes:
+        command = [sys.executable, '-m', 'benchmarks.suite', '--child', '--sizes', str(size)]
+        for option in ('stl_fraction', 'stl_copies', 'edits', 'picks', 'drag_events', 'seed'):
+            command += ['--' + option.replace('_', '-'), str(getattr(args, option))]
+        for _ in range(args.repeat):
+            output = subprocess.run(command, capture_output=True, text=True, check=True, cwd=ROOT).stdout
+            for name, result in json.loads(output.strip().splitlines()[-1]).items():
+                key = f"{name}/{size}"
+                if key not in results or result['ms'] < results[key]['ms']:
+                    results[key] = result
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+
+    print(f"{'operation':>24} {'ms':>10} {'baseline ms':>12} {'change':>8} {'peak MB':>8}")
+    for key, result in results.items():
+        reference = baseline.get(key)
+        change = f"{result['ms'] / reference['ms'] - 1:+.0%}" if reference and reference['ms'] else 'n/a'
+        referenceMs = f"{reference['ms']:.1f}" if reference else 'n/a'
+        flag = '  REGRESSION' if key in regressions else ''
+        print(f"{key:>24} {result['ms']:>10.1f} {referenceMs:>12} {change:>8} "
+              f"{result['peakMemoryBytes'] / 2**20:>8.1f}{flag}")
+
+    report = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'processor': platform.processor()},
+        'options': {key: value for key, value in vars(args).items()
+                    if key not in ('output', 'baseline', 'update_baseline', 'child')},
+        'results': results,
+        'regressions': regressions,
+    }
+    for path in [args.output] + ([args.baseline] if args.update_baseline else []):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if regressions:
+        print(f"{len(regressions)} operations are more than {args.tolerance:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
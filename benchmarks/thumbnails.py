@@ -0,0 +1,78 @@
+"""
+Measures rendering thumbnails: render and cache hit times per mesh and size, and files thumbnailed per second.
+
+Run from the root directory:
+    python -m benchmarks.thumbnails [--sizes 64 128] [--files 32] [--jobs 1 4]
+
+A cube, a sphere and stl/vase.stl are rendered at each size; "render ms" is the fastest of three renders
+and "cached ms" the time to hash the file and load its thumbnail once it is cached. For the throughput,
+--files copies of stl/vase.stl, each with a different header so none share a thumbnail, are thumbnailed by
+thumbnails.py with each number of worker processes into an empty cache.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STL_SOURCE = os.path.join(ROOT, 'stl', 'vase.stl')
+
+
+def fastest(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--files', type=int, default=32)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, os.cpu_count()])
+    args = parser.parse_args()
+
+    from src.stlLoader import parseTriangles
+    from src.tessellation import cuboidMesh, sphereMesh
+    from src.thumbnails import ThumbnailCache, fileThumbnail, renderThumbnail
+
+    with open(STL_SOURCE, 'rb') as f:
+        data = f.read()
+    meshes = {'cube': cuboidMesh((-1, -1, -1), (1, 1, 1)).triangles(), 'sphere': sphereMesh(1).triangles(),
+              'vase': parseTriangles(data)}
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'mesh':>7} {'triangles':>10} {'size':>5} {'render ms':>10} {'cached ms':>10}")
+        for size in args.sizes:
+            cache = ThumbnailCache(os.path.join(directory, f'cache{size}'))
+            fileThumbnail(STL_SOURCE, cache, size)
+            cachedMs = fastest(lambda: fileThumbnail(STL_SOURCE, cache, size))
+            for name, triangles in meshes.items():
+                renderMs = fastest(lambda: renderThumbnail(triangles, size=size))
+                cached = f"{cachedMs:>10.2f}" if name == 'vase' else f"{'':>10}"
+                print(f"{name:>7} {len(triangles):>10} {size:>5} {renderMs:>10.1f} {cached}")
+
+        files = os.path.join(directory, 'files')
+        os.makedirs(files)
+        for i in range(args.files):
+            with open(os.path.join(files, f'vase{i}.stl'), 'wb') as f:
+                f.write(f'{i:<80}'.encode('ascii') + data[80:])
+        print(f"\n{'jobs':>5} {'files':>6} {'seconds':>8} {'files/s':>8}")
+        for run, jobs in enumerate(args.jobs):
+            output = os.path.join(directory, f'cli{run}')
+            start = time.perf_counter()
+            subprocess.run([sys.executable, 'thumbnails.py', files, '--output', output, '--jobs', str(jobs)],
+                           cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            seconds = time.perf_counter() - start
+            print(f"{jobs:>5} {args.files:>6} {seconds:>8.2f} {args.files / seconds:>8.1f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import errno
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from src.constants import ASSET_DIR, ASSET_MEMORY_BUDGET, LOD_CELL_FRACTIONS
+from src.stlLoader import decodeStl, loadLods, readCache, writeCache
+
+
+def meshBytes(data, lods):
+    # The memory a decoded mesh and its levels of detail are charged in the cache
+    return sum(mesh.vertices.nbytes + mesh.indices.nbytes for mesh in [data] + lods)
+
+
+class AssetStore:
+    """
+    The AssetStore class keeps one processed copy of every imported STL mesh in a project asset directory.
+    Assets are named by the SHA-256 of the file they were imported from, so identical files at different
+    paths are parsed and stored once, and scenes refer to meshes by hash, so they still load when the
+    original file has moved. Decoded meshes are kept in a least recently used cache limited to a byte
+    budget; a mesh that was dropped is memory-mapped from the asset directory again when it is next used.
+    Worker threads of the STL importer and the GUI thread use the store at the same time.
+
+    Attributes
+    ----------
+    directory : str
+        The asset directory.
+    budget : int
+        The largest number of bytes of decoded meshes kept in memory.
+    cache : OrderedDict
+        A dictionary mapping asset hashes to their (StlData, lods), least recently used first.
+    bytes : int
+        The bytes of decoded meshes in the cache.
+    fileHashes : dict
+        A dictionary mapping (path, mtime, size) of imported files to their hashes, so an unchanged
+        file is not read again.
+    lock : threading.Lock
+        Guards the cache and the file hashes.
+    hits, misses, evictions : int
+        The number of cache hits, misses and meshes dropped to stay within the budget.
+
+    Methods
+    -------
+    fileKey(path):
+        Returns the (path, mtime, size) key of a file.
+    knownHash(path):
+        Returns the hash of a file imported earlier if it has not changed since, without reading it.
+    contains(assetHash):
+        Returns whether the asset directory holds an asset.
+    importFile(path, progress):
+        Stores the processed mesh of an STL file unless its content is stored already, and returns its hash.
+    load(assetHash):
+        Returns the decoded mesh and levels of detail of an asset.
+    insert(assetHash, mesh, lods):
+        Adds a decoded mesh to the cache, dropping the least recently used ones beyond the budget.
+    stats():
+        Returns the cache size, budget and hit, miss and eviction counts.
+    """
+
+    def __init__(self, directory=ASSET_DIR, budget=ASSET_MEMORY_BUDGET):
+        self.directory = directory
+        self.budget = budget
+        self.cache = OrderedDict()
+        self.bytes = 0
+        self.fileHashes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def fileKey(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def knownHash(self, path):
+        try:
+            key = self.fileKey(path)
+        except OSError:
+            return None
+        with self.lock:
+            return self.fileHashes.get(key)
+
+    def contains(self, assetHash):
+        # The vertices are written last, so they only exist once the asset is complete
+        return os.path.exists(os.path.join(self.directory, assetHash + '.vertices.npy'))
+
+    def importFile(self, path, progress=None):
+        """
+        Stores the processed mesh of an STL file in the asset directory and returns its hash.
+        progress is called like in loadStl; an unchanged file imported before is not read again,
+        and a file whose content is stored already is hashed but not parsed.
+        """
+        key = self.fileKey(path)
+        assetHash = self.knownHash(path)
+        if assetHash is not None and self.contains(assetHash):
+            return assetHash
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        assetHash = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.fileHashes[key] = assetHash
+        if progress is not None:
+            progress('read')
+        if self.contains(assetHash):
+            return assetHash
+
+        mesh = decodeStl(data, progress)
+        try:
+            writeCache(self.directory, assetHash, mesh)
+        except OSError as e:
+            print(f"Warning: could not store STL file {path} in {self.directory}: {e}")
+        # Keep the decoded mesh, so it is usable even when the asset directory cannot be written
+        self.insert(assetHash, mesh, loadLods(assetHash, mesh, LOD_CELL_FRACTIONS, self.directory))
+        return assetHash
+
+    def load(self, assetHash):
+        # Raises OSError if the asset is neither cached nor in the asset directory
+        with self.lock:
+            entry = self.cache.get(assetHash)
+            if entry is not None:
+                self.cache.move_to_end(assetHash)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        mesh = readCache(self.directory, assetHash)
+        if mesh is None:
+            raise FileNotFoundError(errno.ENOENT, "Mesh asset is missing",
+                                    os.path.join(self.directory, assetHash))
+        # Levels of detail missing from the directory, e.g. after LOD_CELL_FRACTIONS changed, are rebuilt
+        return self.insert(assetHash, mesh, loadLods(assetHash, mesh, LOD_CELL_FRACTIONS, self.directory))
+
+    def insert(self, assetHash, mesh, lods):
+        with self.lock:
+            # Another thread may have loaded the same asset meanwhile; keep the first copy
+            if assetHash in self.cache:
+                return self.cache[assetHash]
+            self.cache[assetHash] = (mesh, lods)
+            self.bytes += meshBytes(mesh, lods)
+            # Drop the least recently used meshes, but never the one just loaded
+            while self.bytes > self.budget and len(self.cache) > 1:
+                _, (evicted, evictedLods) = self.cache.popitem(last=False)
+                self.bytes -= meshBytes(evicted, evictedLods)
+                self.evictions += 1
+            return mesh, lods
+
+    def stats(self):
+        with self.lock:
+            return {'meshes': len(self.cache), 'bytes': self.bytes, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -1,10 +1,26 @@
-class Command:
-    """ 
-    Currently, this only supports undo-ing changes to the name, color, position, and orientation of an entity.
-    This also does not account for dragging the entity around.
-    In the future, it could possibly support undo-ing adding an object to the scene, deleting an object from the scene, etc.
+import sys
+import time
+
+from src.constants import HISTORY_MERGE_WINDOW_MS
+from src.profiler import profiled
+
 
-    A class used to represent a Command which supports undo-ing changes to the name, color, position, and orientation of an entity.
+def dataSize(data):
+    # Approximate memory use of a command's dictionary, its keys and its (possibly tuple) values
+    size = sys.getsizeof(data)
+    for key, value in data.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class Command:
+    """
+    A class used to represent a Command which supports undo-ing changes to the name, color, position, orientation and dimensions of an entity.
+    Only the changed fields are stored, not a snapshot of the whole entity.
+    A drag is recorded as a single command when the mouse is released, with the position before the drag as previousData.
+    Adding and deleting entities are recorded by the commands in commandStack.py.
     ...
 
     Attributes
@@ -12,27 +28,75 @@ class Command:
     entity : Entity3D
         an instance of the Entity3D class
     previousData : dict
-        a dictionary containing the previous state of the entity
+        a dictionary containing the previous values of the changed fields
     currentData : dict
-        a dictionary containing the current state of the entity
+        a dictionary containing the new values of the changed fields
+    timestamp : float
+        the time of the latest change recorded in the command, in seconds
+    size : int
+        the approximate memory used by the command's data, in bytes
 
     Methods
     -------
     execute():
-        Updates the entity with the current data
+        Updates the entity with the current data and records it in the scene journal
     undo():
-        Reverts the entity to its previous state
+        Reverts the entity to its previous state and records it in the scene journal
+    canMerge(other):
+        Checks whether a following command continues the same edit
+    merge(other):
+        Folds a following command into this one
+    dropEntities(test):
+        Forgets the entity if it passes the test and returns the entities forgotten
+    isEmpty():
+        Checks whether the command no longer changes anything
+    discard(undone):
+        Frees anything the command keeps alive once it leaves the history, undone or executed
     """
 
-    def __init__(self, entity, data):
+    def __init__(self, entity, data, previousData=None):
         self.entity = entity
-        self.previousData = entity.toDict()
+        # previousData is given when the change was already applied, e.g. at the end of a drag
+        if previousData is None:
+            # Read only the changed fields; serializing the whole entity on every spin box step adds up
+            previousData = entity.properties(data.keys())
+        self.previousData = previousData
         self.currentData = data
+        self.timestamp = time.monotonic()
+        self.size = dataSize(self.previousData) + dataSize(self.currentData)
 
+    @profiled('Command.execute', 'command')
     def execute(self):
-        if self.entity is not None and self.entity.entity is not None:
+        if self.entity is not None and self.entity.row is not None:
             self.entity.updateProperties(self.currentData)
+            self.entity.mainWindow.journal.recordUpdate(self.entity, self.currentData)
 
+    @profiled('Command.undo', 'command')
     def undo(self):
-        if self.entity is not None and self.entity.entity is not None:
+        if self.entity is not None and self.entity.row is not None:
             self.entity.updateProperties(self.previousData)
+            self.entity.mainWindow.journal.recordUpdate(self.entity, self.previousData)
+
+    def canMerge(self, other):
+        # Edits of the same fields of the same entity in quick succession, like holding a spin box arrow
+        return (isinstance(other, Command) and other.entity is self.entity
+                and other.currentData.keys() == self.currentData.keys()
+                and (other.timestamp - self.timestamp) * 1000 <= HISTORY_MERGE_WINDOW_MS)
+
+    def merge(self, other):
+        # Keep the oldest previous values and the newest current values
+        self.currentData = other.currentData
+        self.timestamp = other.timestamp
+        self.size = dataSize(self.previousData) + dataSize(self.currentData)
+
+    def dropEntities(self, test):
+        if self.entity is None or not test(self.entity):
+            return []
+        entity, self.entity = self.entity, None
+        return [entity]
+
+    def isEmpty(self):
+        return self.entity is None
+
+    def discard(self, undone):
+        pass
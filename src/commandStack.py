@@ -0,0 +1,287 @@
+import sys
+import time
+from collections import deque
+
+from src.command import dataSize
+from src.constants import HISTORY_MAX_BYTES, HISTORY_MAX_ENTRIES
+from src.profiler import profiled
+
+
+class EntitiesCommand:
+    """
+    A base class for commands that add entities to or remove entities from the scene.
+    Removed entities are detached rather than deleted, so bringing them back only reattaches their
+    Qt entities and store rows; each entity costs the same to undo or redo however large the scene is.
+    ...
+
+    Attributes
+    ----------
+    mainWindow : MainWindow
+        the main window that owns the scene
+    entities : list
+        the entities added or removed
+    timestamp : float
+        the time the command was recorded, in seconds
+    size : int
+        the approximate memory used by the command, in bytes
+
+    Methods
+    -------
+    attach():
+        Puts the entities back into the scene
+    detach():
+        Takes the entities out of the scene
+    canMerge(other):
+        Always False; adding and deleting are never merged
+    dropEntities(test):
+        Forgets the entities that pass the test and returns them
+    isEmpty():
+        Checks whether every entity has been forgotten
+    leavesDetached(undone):
+        Checks whether the command leaves its entities out of the scene when it is undone or executed
+    discard(undone):
+        Deletes the entities the command took out of the scene once it leaves the history
+    """
+
+    def __init__(self, mainWindow, entities):
+        self.mainWindow = mainWindow
+        self.entities = list(entities)
+        self.timestamp = time.monotonic()
+        # Every entity keeps the same kind of state, so estimate from the first one while it is in the scene
+        perEntity = sys.getsizeof(self.entities[0]) + dataSize(self.entities[0].toDict()) if self.entities else 0
+        self.size = sys.getsizeof(self.entities) + perEntity * len(self.entities)
+
+    @profiled('EntitiesCommand.attach', 'command')
+    def attach(self):
+        self.mainWindow.attachEntities(self.entities)
+
+    @profiled('EntitiesCommand.detach', 'command')
+    def detach(self):
+        self.mainWindow.detachEntities(self.entities)
+
+    def canMerge(self, other):
+        return False
+
+    def dropEntities(self, test):
+        dropped = [entity for entity in self.entities if test(entity)]
+        if dropped:
+            self.entities = [entity for entity in self.entities if not test(entity)]
+        return dropped
+
+    def isEmpty(self):
+        return not self.entities
+
+    def discard(self, undone):
+        # Only the command that took the entities out of the scene may delete them. An executed add command
+        # evicted from the history leaves them alone, since a later delete command can still bring them back.
+        if not self.leavesDetached(undone):
+            return
+        for entity in self.entities:
+            if entity.row is None and entity.mesh is not None:
+                entity.remove()
+
+
+class AddEntitiesCommand(EntitiesCommand):
+    """ A command recording entities added to the scene. Undo detaches them, redo attaches them again. """
+
+    def execute(self):
+        self.attach()
+
+    def undo(self):
+        self.detach()
+
+    def leavesDetached(self, undone):
+        return undone
+
+
+class DeleteEntitiesCommand(EntitiesCommand):
+    """ A command recording entities deleted from the scene. Undo attaches them again, redo detaches them. """
+
+    def execute(self):
+        self.detach()
+
+    def undo(self):
+        self.attach()
+
+    def leavesDetached(self, undone):
+        return not undone
+
+
+class CompoundCommand:
+    """
+    A class used to represent several commands that are undone and redone as one, such as the same edit
+    applied to many entities.
+    ...
+
+    Attributes
+    ----------
+    commands : list
+        the commands, in the order they were executed
+    timestamp : float
+        the time the command was recorded, in seconds
+    size : int
+        the approximate memory used by the commands, in bytes
+
+    Methods
+    -------
+    execute():
+        Executes every command in order
+    undo():
+        Undoes every command in reverse order
+    canMerge(other):
+        Always False
+    dropEntities(test):
+        Forgets the entities that pass the test in every command and returns them
+    isEmpty():
+        Checks whether every command is empty
+    discard(undone):
+        Discards every command
+    """
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self.timestamp = time.monotonic()
+        self.size = sys.getsizeof(self.commands) + sum(command.size for command in self.commands)
+
+    def execute(self):
+        for command in self.commands:
+            command.execute()
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def canMerge(self, other):
+        return False
+
+    def dropEntities(self, test):
+        dropped = [entity for command in self.commands for entity in command.dropEntities(test)]
+        self.commands = [command for command in self.commands if not command.isEmpty()]
+        return dropped
+
+    def isEmpty(self):
+        return not self.commands
+
+    def discard(self, undone):
+        for command in self.commands:
+            command.discard(undone)
+
+
+class CommandStack:
+    """
+    A class used to represent the scene-wide undo history as a list of executed commands with a cursor.
+    Commands are pushed after they have been applied. Consecutive commands that continue the same edit are
+    merged into one entry, and the oldest entries are evicted once the stack holds more than maxEntries
+    commands or maxBytes of data. Commands that are dropped are discarded, which deletes entities that
+    only the history still kept alive: undone commands cut off from the redo tail and executed commands
+    evicted from the front each delete the entities they left out of the scene.
+    ...
+
+    Attributes
+    ----------
+    commands : deque
+        the commands, oldest first
+    index : int
+        the index of the last executed command, or -1 if every command has been undone
+    maxEntries : int
+        the largest number of commands kept
+    maxBytes : int
+        the largest approximate memory kept for commands
+    bytes : int
+        the approximate memory used by all commands
+    merged, evicted : int
+        the number of commands merged into the previous one and the number of commands evicted
+
+    Methods
+    -------
+    push(command):
+        Adds an executed command, discarding the commands that could be redone
+    undo():
+        Undoes the last executed command and returns it, or None
+    redo():
+        Redoes the next undone command and returns it, or None
+    dropEntities(test):
+        Takes the entities that pass the test out of every command, drops the commands left empty and
+        returns the entities
+    stats():
+        Returns the number of entries, memory use and merge and eviction counts
+    """
+
+    def __init__(self, maxEntries=HISTORY_MAX_ENTRIES, maxBytes=HISTORY_MAX_BYTES):
+        self.commands = deque()
+        self.index = -1
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.merged = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.commands)
+
+    def push(self, command):
+        # A new command discards everything that could have been redone
+        while len(self.commands) > self.index + 1:
+            dropped = self.commands.pop()
+            self.bytes -= dropped.size
+            dropped.discard(undone=True)
+
+        if self.commands and self.commands[-1].canMerge(command):
+            last = self.commands[-1]
+            self.bytes -= last.size
+            last.merge(command)
+            self.bytes += last.size
+            self.merged += 1
+            return
+
+        self.commands.append(command)
+        self.bytes += command.size
+        self.index += 1
+
+        # Evict the oldest commands, always keeping the one just added
+        while len(self.commands) > 1 and (len(self.commands) > self.maxEntries or self.bytes > self.maxBytes):
+            evicted = self.commands.popleft()
+            self.bytes -= evicted.size
+            evicted.discard(undone=False)
+            self.index -= 1
+            self.evicted += 1
+
+    def undo(self):
+        if self.index < 0:
+            return None
+        command = self.commands[self.index]
+        command.undo()
+        self.index -= 1
+        return command
+
+    def redo(self):
+        if self.index >= len(self.commands) - 1:
+            return None
+        self.index += 1
+        command = self.commands[self.index]
+        command.execute()
+        return command
+
+    def dropEntities(self, test):
+        # Sizes are left as they were; they are only estimates and the history is bounded either way
+        dropped = []
+        kept = deque()
+        index = self.index
+        for position, command in enumerate(self.commands):
+            dropped.extend(command.dropEntities(test))
+            if command.isEmpty():
+                self.bytes -= command.size
+                if position <= self.index:
+                    index -= 1
+            else:
+                kept.append(command)
+        self.commands = kept
+        self.index = index
+        return dropped
+
+    def stats(self):
+        return {'entries': len(self.commands),
+                'bytes': self.bytes,
+                'undoable': self.index + 1,
+                'merged': self.merged,
+                'evicted': self.evicted}
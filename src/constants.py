@@ -1,20 +1,50 @@
 STL_SCALE = 0.01
 PERSPECTIVE_PROJECTION_VALUES = (45.0, 16.0 / 9.0, 0.1, 1000.0)
-STL_FILE_PATH = "stl/car.stl"
+STL_FILE_PATH = "stl/vase.stl"  # Added by "Add object" for the STL shape; also where the import dialog opens
+ASSET_DIR = "assets"  # Processed meshes of imported STL files, named by the SHA-256 of the file
+THUMBNAIL_DIR = "thumbnails"  # Rendered thumbnails of entities and STL files, named by their content and render settings
+ASSET_MEMORY_BUDGET = 512 << 20  # Bytes of decoded meshes kept in memory before the least recently used are dropped
+STL_IMPORT_WORKERS = 2  # Threads parsing STL files in the background
+STL_PLACEHOLDER_SIZE = 100  # Edge of the box drawn for an STL file before its bounds are known, 1 in the scene at STL_SCALE
+SCENE_FILE_PATH = "entities.scene"
+JSON_SCENE_FILE_PATH = "entities.json"  # Imported on startup when there is no binary scene yet
+SAVE_CHUNK_SIZE = 10000  # Entities serialized at a time when a scene is saved as JSON
+LOAD_SLICE_MS = 8  # Time spent building entities per event loop iteration while a scene loads
+JOURNAL_FLUSH_INTERVAL_MS = 200  # Longest time a change waits before it is fsynced to the journal
+JOURNAL_BATCH_SIZE = 64  # Number of pending journal records that forces an early flush
+JOURNAL_COMPACT_THRESHOLD = 1000  # Number of journal records that triggers a background snapshot
+HISTORY_MAX_ENTRIES = 500  # Undo history entries kept before the oldest are evicted
+HISTORY_MAX_BYTES = 1 << 20  # Approximate undo history memory kept before the oldest entries are evicted
+HISTORY_MERGE_WINDOW_MS = 500  # Edits of the same fields closer together than this are undone as one
+DRAG_PANEL_REFRESH_HZ = 15  # Most edit window refreshes per second while an entity is dragged
+SNAP_DISTANCE = 0.25  # Largest gap between a dragged entity and a neighbor that snapping closes
+PLACEMENT_GAP = 0.5  # Space left between a new entity and its neighbors
+LOD_CELL_FRACTIONS = (0.015, 0.04, 0.1)  # Vertex clustering cell size of each STL LOD, as a fraction of the mesh diagonal
+LOD_SCREEN_SIZES = (250, 100, 40)  # Projected size in pixels below which each STL LOD is used
+DEFAULT_COLOR = (179, 179, 179, 255)  # Diffuse color of a new entity, the Qt material default
+INSTANCED_RENDERING = False  # Whether entities sharing a mesh start out drawn with one instanced draw call
+THUMBNAIL_SIZE = 64  # Width and height of entity and STL file thumbnails in pixels
+THUMBNAIL_WORKERS = 2  # Threads rendering thumbnails in the background
+THUMBNAIL_MEMORY_ICONS = 1000  # Most recently used thumbnails kept in memory as icons
+STATIC_BATCH_TRIANGLES = 65536  # Triangles merged into one static batch; thawing an entity rebuilds one batch of this size
+PROFILER_HISTORY = 600  # Latest runs of each profiled section kept for percentiles, 10 s of frames at 60 fps
+PROFILER_TRACE_EVENTS = 200000  # Latest profiled sections kept for trace export
+PROFILER_OVERLAY_REFRESH_MS = 500  # Interval between refreshes of the profiler panel
+EXPORT_CHUNK_VERTICES = 1 << 16  # Vertices transformed and written at a time when a scene is exported
+VALIDATE_CHUNK_SIZE = 5000  # Records validated per task by validate.py
+QUATERNION_TOLERANCE = 1e-3  # Largest difference of an orientation's norm from 1 that validate.py accepts
 
 from enum import Enum
 
-from PySide6.Qt3DExtras import Qt3DExtras
-from PySide6.Qt3DRender import Qt3DRender
-
 class ShapeType(Enum):
     CUBE = "Cube"
     SPHERE = "Sphere"
     STL = "STL"
 
-# Mapping of shape names to their corresponding classes
-shapeClasses = {
-    ShapeType.CUBE: Qt3DExtras.QCuboidMesh,
-    ShapeType.SPHERE: Qt3DExtras.QSphereMesh,
-    ShapeType.STL: Qt3DRender.QMesh
-}
\ No newline at end of file
+
+# Dimensions used when an entity is created without any
+DEFAULT_DIMENSIONS = {
+    ShapeType.CUBE: (1, 1, 1),
+    ShapeType.SPHERE: (1,),
+    ShapeType.STL: (1, 1, 1)
+}
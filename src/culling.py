@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+from PySide6.Qt3DRender import Qt3DRender
+from src.constants import LOD_SCREEN_SIZES, ShapeType
+from src.profiler import profiled
+from src.sceneStore import SHAPES
+
+
+def matrixToArray(matrix):
+    # QMatrix4x4.data() is column-major
+    return np.array(matrix.data(), np.float64).reshape(4, 4).T
+
+
+def frustumPlanes(clipMatrix):
+    """ Returns the six (a, b, c, d) planes of a view-projection matrix, with normals pointing into the frustum. """
+    rows = matrixToArray(clipMatrix)
+    planes = np.array([rows[3] + rows[0], rows[3] - rows[0],
+                       rows[3] + rows[1], rows[3] - rows[1],
+                       rows[3] + rows[2], rows[3] - rows[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def boxesInFrustum(planes, mins, maxs):
+    """ Returns a bool array that is False for every box entirely outside one of the planes. """
+    center = (mins + maxs) * 0.5
+    extent = (maxs - mins) * 0.5
+    # The signed distance of the center, plus the box's half size projected onto the plane normal
+    distances = center @ planes[:, :3].T + planes[:, 3]
+    radii = extent @ np.abs(planes[:, :3]).T
+    return np.all(distances + radii >= 0, axis=1)
+
+
+class ViewCuller:
+    """
+    The ViewCuller class hides entities outside the camera's view frustum and picks the level of detail
+    of STL entities from their projected size on screen.
+    It runs once per frame from MainWindow.onFrame, but only does work when the camera moved or the
+    scene store changed since the last pass, and only touches the Qt objects of rows whose state changed.
+    Frozen rows are skipped; Qt3D culls their static batches as a whole.
+
+    Attributes
+    ----------
+    store : SceneStore
+        The store holding the entity bounds and the visible and lod columns.
+    view : Qt3DExtras.Qt3DWindow
+        The window whose camera and height define the frustum and the screen size.
+    cameraChanged : bool
+        Set by the camera's matrix signals, so the next pass runs even if the store did not change.
+
+    Methods
+    -------
+    invalidate():
+        Forces the next pass to run.
+    update():
+        Culls and picks the level of detail of every entity if anything changed.
+    levelsOfDetail(mins, maxs):
+        Returns the level of detail for world bounds from their projected size.
+    stats():
+        Returns the number of visible entities and the number drawn at each level of detail.
+    """
+
+    def __init__(self, store, view):
+        self.store = store
+        self.view = view
+        self.cameraChanged = True
+        self.structureVersion = None
+        self.transformVersion = None
+        camera = view.camera()
+        camera.viewMatrixChanged.connect(self.invalidate)
+        camera.projectionMatrixChanged.connect(self.invalidate)
+
+    def invalidate(self):
+        self.cameraChanged = True
+
+    @profiled('ViewCuller.update', 'frame')
+    def update(self):
+        store = self.store
+        if (not self.cameraChanged and self.structureVersion == store.structureVersion
+                and self.transformVersion == store.transformVersion):
+            return
+        self.cameraChanged = False
+        self.structureVersion = store.structureVersion
+        self.transformVersion = store.transformVersion
+        if store.count == 0:
+            return
+
+        camera = self.view.camera()
+        mins, maxs = store.worldBounds()
+        visible = boxesInFrustum(frustumPlanes(camera.projectionMatrix() * camera.viewMatrix()), mins, maxs)
+        thawed = ~store.frozen[:store.count]
+        for row in np.flatnonzero((visible != store.visible[:store.count]) & thawed).tolist():
+            store.views[row].setVisible(bool(visible[row]))
+
+        # Only visible STL entities have simplified meshes worth switching to
+        rows = np.flatnonzero(visible & thawed & (store.shape[:store.count] == SHAPES.index(ShapeType.STL)))
+        if len(rows) == 0:
+            return
+        levels = self.levelsOfDetail(mins[rows], maxs[rows])
+        changed = levels != store.lod[rows]
+        for row, level in zip(rows[changed].tolist(), levels[changed].tolist()):
+            view = store.views[row]
+            view.setLod(min(level, len(view.mesh.lods) - 1))
+
+    def levelsOfDetail(self, mins, maxs):
+        camera = self.view.camera()
+        lens = camera.lens()
+        diameters = np.linalg.norm(maxs - mins, axis=1)
+        if lens.projectionType() == Qt3DRender.QCameraLens.PerspectiveProjection:
+            # Pixels per world unit at distance 1 from the camera
+            position = camera.position()
+            distances = np.linalg.norm((mins + maxs) * 0.5 - (position.x(), position.y(), position.z()), axis=1)
+            focal = self.view.height() / (2 * math.tan(math.radians(lens.fieldOfView()) / 2))
+            sizes = diameters * focal / np.maximum(distances, lens.nearPlane())
+        else:
+            sizes = diameters * self.view.height() / max(lens.top() - lens.bottom(), 1e-9)
+        # Each threshold the projected size falls below moves the entity one level down
+        return (sizes[:, None] < np.array(LOD_SCREEN_SIZES)).sum(axis=1).astype(np.uint8)
+
+    def stats(self):
+        store = self.store
+        visible = store.visible[:store.count]
+        return {'visible': int(visible.sum()),
+                'culled': int(store.count - visible.sum()),
+                'lods': np.bincount(store.lod[:store.count][visible], minlength=len(LOD_SCREEN_SIZES) + 1).tolist()}
@@ -1,16 +1,30 @@
 
-from PySide6.QtWidgets import (QColorDialog, QDialog,
+from PySide6.QtGui import QColor, QQuaternion
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (QColorDialog, QCompleter, QDialog,
                                QFormLayout, QLineEdit, QLabel,
                                QHBoxLayout, QDoubleSpinBox)
-from PySide6.Qt3DExtras import Qt3DExtras
-from PySide6.Qt3DRender import Qt3DRender
 from src.command import Command
-from src.constants import STL_SCALE
+from src.constants import ShapeType
+from src.profiler import profiled
+
+# Largest difference between quaternion components that still counts as the orientation already shown
+ORIENTATION_TOLERANCE = 1e-5
+
+
+def sameOrientation(a, b):
+    # q and -q are the same rotation
+    return (all(abs(x - y) <= ORIENTATION_TOLERANCE for x, y in zip(a, b))
+            or all(abs(x + y) <= ORIENTATION_TOLERANCE for x, y in zip(a, b)))
 
 
 class EditWindow(QDialog):
     """ 
     A class used to represent an Edit Window which allows for editing the attributes of a selected object.
+    The orientation is edited as Euler angles in degrees and stored as the unit quaternion they describe.
+    The window remembers the values it last showed, so loading an entity only sets the fields that differ,
+    and edits made in the window only update that memory instead of reloading the panel.
+    The position and orientation are relative to the entity's parent, which is chosen by name.
     ...
 
     Attributes
@@ -21,12 +35,14 @@ class EditWindow(QDialog):
         an input field for the name attribute
     colorLabel : QLabel
         a label for the color attribute
+    parentEdit : QLineEdit
+        an input field for the name of the parent, completed from the object list; empty for no parent
     positionXEdit, positionYEdit, positionZEdit : QLineEdit
         input fields for each component of the position attribute
     positionLayout : QHBoxLayout
         a layout for the position fields
-    orientationWEdit, orientationXEdit, orientationYEdit, orientationZEdit : QLineEdit
-        input fields for each component of the orientation attribute
+    orientationXEdit, orientationYEdit, orientationZEdit : QDoubleSpinBox
+        input fields for the rotation about the x, y and z axes in degrees (pitch, yaw and roll)
     orientationLayout : QHBoxLayout
         a layout for the orientation fields
     dimensionXEdit, dimensionYEdit, dimensionZEdit : QLineEdit
@@ -35,19 +51,23 @@ class EditWindow(QDialog):
         a layout for the dimension fields
     selectedEntity : Entity3D
         an instance of the Entity3D class
-    history : list
-        a list to keep track of the changes
-    history_index : int
-        an index to keep track of the current state in the history
+    shown : dict
+        the values last shown in each group of fields, keyed by the entity dictionary key
+    loading : bool
+        set while fields are filled from an entity, so their change signals do not create commands
+    widgetUpdates : int
+        the number of widgets set so far, to measure how much work each edit causes
 
     Methods
     -------
     createSpinBox(min_val, max_val, step):
         Creates a spin box with the given parameters
-    executeCommand(data):
+    executeCommand(data, previousData):
         Executes a command to update the selected entity's data
     applyNameChange():
         Applies a change to the name of the selected entity
+    applyParentChange():
+        Makes the selected entity the child of the entity named in the parent field, keeping it in place
     applyPositionChange():
         Applies a change to the position of the selected entity
     applyOrientationChange():
@@ -58,20 +78,26 @@ class EditWindow(QDialog):
         Opens a color picker dialog
     updateColorLabel(color):
         Updates the color label with the given color
-    blockOrUnblockSignals(block):
-        Blocks or unblocks the signals of the input fields
+    showValues(key, spinBoxes, values):
+        Sets the spin boxes whose value differs from the one last shown
+    invalidate():
+        Forgets the values shown, so the next load sets every field
     loadEntity(entity):
-        Loads an entity into the edit window
-    undo():
-        Undoes the last change
-    redo():
-        Redoes the last undone change
+        Loads an entity into the edit window, setting only the fields that changed
+    loadPosition(entity):
+        Loads only the position of an entity into the edit window
+    loadOrientation(entity):
+        Loads only the orientation of an entity into the edit window
     """
 
     def __init__(self, mainWindow, parent=None):
         super().__init__(parent)
 
         self.mainWindow = mainWindow
+        self.selectedEntity = None
+        self.shown = {}
+        self.loading = False
+        self.widgetUpdates = 0
 
         self.setWindowTitle("Edit Object")
 
@@ -86,6 +112,14 @@ class EditWindow(QDialog):
         self.colorLabel.setAutoFillBackground(True)
         self.colorLabel.mousePressEvent = self.openColorPicker
 
+        # Create an input field for the parent, completing the names of the objects in the list
+        self.parentEdit = QLineEdit()
+        self.parentEdit.setPlaceholderText("None")
+        completer = QCompleter(mainWindow.uiWidget.sceneModel, self.parentEdit)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setFilterMode(Qt.MatchContains)
+        self.parentEdit.setCompleter(completer)
+
         # Create separate input fields for each component of the position
         self.positionXEdit = self.createSpinBox(-100.0, 100.0, 1)
         self.positionYEdit = self.createSpinBox(-100.0, 100.0, 1)
@@ -97,15 +131,16 @@ class EditWindow(QDialog):
         self.positionLayout.addWidget(self.positionYEdit)
         self.positionLayout.addWidget(self.positionZEdit)
 
-        # Create separate input fields for each component of the orientation
-        self.orientationWEdit = self.createSpinBox(-1.0, 1.0, 0.05)
-        self.orientationXEdit = self.createSpinBox(-1.0, 1.0, 0.05)
-        self.orientationYEdit = self.createSpinBox(-1.0, 1.0, 0.05)
-        self.orientationZEdit = self.createSpinBox(-1.0, 1.0, 0.05)
+        # Create input fields for the Euler angles of the orientation, wrapping around at half a turn
+        self.orientationXEdit = self.createSpinBox(-180.0, 180.0, 5)
+        self.orientationYEdit = self.createSpinBox(-180.0, 180.0, 5)
+        self.orientationZEdit = self.createSpinBox(-180.0, 180.0, 5)
+        for spinBox in (self.orientationXEdit, self.orientationYEdit, self.orientationZEdit):
+            spinBox.setWrapping(True)
+            spinBox.setSuffix("°")
 
         # Create a QHBoxLayout for the orientation fields
         self.orientationLayout = QHBoxLayout()
-        self.orientationLayout.addWidget(self.orientationWEdit)
         self.orientationLayout.addWidget(self.orientationXEdit)
         self.orientationLayout.addWidget(self.orientationYEdit)
         self.orientationLayout.addWidget(self.orientationZEdit)
@@ -124,24 +159,20 @@ class EditWindow(QDialog):
         # Add the input fields to the form
         self.editForm.addRow("Name:", self.nameEdit)
         self.editForm.addRow("Color:", self.colorLabel)
+        self.editForm.addRow("Parent:", self.parentEdit)
         self.editForm.addRow("Position:", self.positionLayout)
         self.editForm.addRow("Orientation:", self.orientationLayout)
         self.editForm.addRow("Dimensions:", self.dimensionLayout)
 
-        # Create a list to keep track of the changes
-        self.history = []
-        self.history_index = -1
-
         # Connect the editingFinished signals to the applyChanges methods
         """ Should use valueChanged for more real-time updates, but there currently is a bug.
         When the program starts, the valueChanged signals are emitted, which causes the entity to be updated.
         """
         self.nameEdit.editingFinished.connect(self.applyNameChange)
+        self.parentEdit.editingFinished.connect(self.applyParentChange)
         self.positionXEdit.valueChanged.connect(self.applyPositionChange)
         self.positionYEdit.valueChanged.connect(self.applyPositionChange)
         self.positionZEdit.valueChanged.connect(self.applyPositionChange)
-        self.orientationWEdit.valueChanged.connect(
-            self.applyOrientationChange)
         self.orientationXEdit.valueChanged.connect(
             self.applyOrientationChange)
         self.orientationYEdit.valueChanged.connect(
@@ -158,68 +189,105 @@ class EditWindow(QDialog):
         spin_box.setSingleStep(step)
         return spin_box
 
-    def executeCommand(self, data):
+    def executeCommand(self, data, previousData=None):
         # Create a command to update the selected entity's data
-        command = Command(self.selectedEntity, data)
+        command = Command(self.selectedEntity, data, previousData)
         command.execute()
 
-        # Add it to the history
-        self.history = self.history[:self.history_index+1]
-        self.history.append(command)
-        self.history_index += 1
+        # Add it to the scene's history, merging it into the previous command if it continues the same edit
+        self.mainWindow.commandStack.push(command)
 
     def applyNameChange(self):
-        if self.nameEdit.signalsBlocked():
+        if self.loading or self.selectedEntity is None:
             return None
         # Get the new name from the input field
         name = self.nameEdit.text()
+        self.shown['name'] = name
 
         if name == self.selectedEntity.name:
             return
 
-        # Create a command to update the selected entity's name
+        # Create a command to update the selected entity's name; the entity list is notified by the entity
         self.executeCommand({'name': name})
 
-        # Update the text of the QListWidgetItem
-        self.mainWindow.uiWidget.entityWidgetList.currentItem().setText(name)
+    def applyParentChange(self):
+        if self.loading or self.selectedEntity is None:
+            return None
+        entity = self.selectedEntity
+        name = self.parentEdit.text().strip()
+        if name == self.shown.get('parent'):
+            return
+        store = entity.store
+        parent = None
+        if name:
+            # Names are not unique; a name shared by several objects is refused rather than guessed
+            rows = store.nameRows.get(name, ())
+            row = next(iter(rows)) if len(rows) == 1 else None
+            if row is None or row in store.subtree(entity.row):
+                if not rows:
+                    reason = "is not in the scene"
+                elif row is None:
+                    reason = f"is the name of {len(rows)} objects"
+                else:
+                    reason = "is the object or inside it"
+                self.mainWindow.reportError(f"Error: {name} {reason} and cannot be the parent of {entity.name}.")
+                self.parentEdit.setText(self.shown.get('parent', ''))
+                return
+            parent = store.views[row]
+        self.shown['parent'] = name
+
+        # Keep the entity where it is, so its position and orientation become relative to the new parent
+        position, orientation = entity.localTransformUnder(parent)
+        self.executeCommand({'parent': None if parent is None else parent.id,
+                             'position': position, 'orientation': orientation})
+        self.loadEntity(entity)
 
     def applyPositionChange(self):
-        if self.positionXEdit.signalsBlocked():
+        if self.loading or self.selectedEntity is None:
             return None
         # Get the new position
         positionX = self.positionXEdit.value()
         positionY = self.positionYEdit.value()
         positionZ = self.positionZEdit.value()
         position = (positionX, positionY, positionZ)
+        self.shown['position'] = position
 
         # Create a command to update the selected entity's position
         self.executeCommand({'position': position})
 
     def applyOrientationChange(self):
-        # Get the new orientation
-        orientationW = self.orientationWEdit.value()
-        orientationX = self.orientationXEdit.value()
-        orientationY = self.orientationYEdit.value()
-        orientationZ = self.orientationZEdit.value()
-        orientation = (orientationW, orientationX, orientationY, orientationZ)
+        if self.loading or self.selectedEntity is None:
+            return None
+        # Turn the angles into a unit quaternion once, here; the store only ever receives normalized rotations
+        angles = (self.orientationXEdit.value(), self.orientationYEdit.value(), self.orientationZEdit.value())
+        rotation = QQuaternion.fromEulerAngles(*angles).normalized()
+        orientation = (rotation.scalar(), rotation.x(), rotation.y(), rotation.z())
+
+        # Keep the angles as typed; the same rotation read back could show as different angles
+        self.shown['angles'] = angles
+        self.shown['orientation'] = orientation
 
         # Create a command to update the selected entity's orientation
         self.executeCommand({'orientation': orientation})
 
     def applyDimensionChange(self):
+        if self.loading or self.selectedEntity is None:
+            return None
         # Get the new dimensions
         dimensionX = self.dimensionXEdit.value()
         dimensionY = self.dimensionYEdit.value()
         dimensionZ = self.dimensionZEdit.value()
         dimensions = (dimensionX, dimensionY, dimensionZ)
+        self.shown['dimensions'] = dimensions
 
         # Create a command to update the selected entity's dimensions
         self.executeCommand({'dimensions': dimensions})
 
     def openColorPicker(self, event):
-        color = QColorDialog.getColor(self.selectedEntity.material.diffuse())
+        color = QColorDialog.getColor(self.selectedEntity.color())
         if color.isValid():
             self.updateColorLabel(color)
+            self.shown['color'] = color.getRgb()
 
             # Create a command to update the selected entity's color
             self.executeCommand({'color': color.getRgb()})
@@ -229,85 +297,80 @@ class EditWindow(QDialog):
         palette.setColor(self.colorLabel.backgroundRole(), color)
         self.colorLabel.setPalette(palette)
 
-    def blockOrUnblockSignals(self, block):
-        # Block the signals of the input fields
-        self.nameEdit.blockSignals(block)
-        self.positionXEdit.blockSignals(block)
-        self.positionYEdit.blockSignals(block)
-        self.positionZEdit.blockSignals(block)
-        self.orientationWEdit.blockSignals(block)
-        self.orientationXEdit.blockSignals(block)
-        self.orientationYEdit.blockSignals(block)
-        self.orientationZEdit.blockSignals(block)
-        self.dimensionXEdit.blockSignals(block)
-        self.dimensionYEdit.blockSignals(block)
-        self.dimensionZEdit.blockSignals(block)
+    def showValues(self, key, spinBoxes, values):
+        # Compare with the values last shown, rounded like the spin boxes show them, and set only those that differ
+        values = tuple(round(value, spinBox.decimals()) for spinBox, value in zip(spinBoxes, values))
+        shown = self.shown.get(key)
+        if values == shown:
+            return
+        for index, (spinBox, value) in enumerate(zip(spinBoxes, values)):
+            if shown is None or shown[index] != value:
+                spinBox.setValue(value)
+                self.widgetUpdates += 1
+        self.shown[key] = values
 
+    def invalidate(self):
+        self.shown = {}
+
+    @profiled('EditWindow.loadEntity', 'ui')
     def loadEntity(self, entity):
         self.selectedEntity = entity
-
-        # Block the signals of the input fields
-        self.blockOrUnblockSignals(True)
-
-        # Update the input fields with the selected entity's attributes
-        self.nameEdit.setText(self.selectedEntity.name)
-
-        # Update the color label
-        color = self.selectedEntity.material.diffuse()
-        self.updateColorLabel(color)
-
-        # Update the position fields
-        position = self.selectedEntity.transform.translation()
-        self.positionXEdit.setValue(position.x())
-        self.positionYEdit.setValue(position.y())
-        self.positionZEdit.setValue(position.z())
-
-        # Update the orientation fields
-        orientation = self.selectedEntity.transform.rotation()
-        self.orientationWEdit.setValue(orientation.scalar())
-        self.orientationXEdit.setValue(orientation.x())
-        self.orientationYEdit.setValue(orientation.y())
-        self.orientationZEdit.setValue(orientation.z())
-
-        # Update the dimension fields
-        if isinstance(self.selectedEntity.mesh, Qt3DExtras.QCuboidMesh):
-            self.dimensionXEdit.setValue(self.selectedEntity.mesh.xExtent())
-            self.dimensionYEdit.setValue(self.selectedEntity.mesh.yExtent())
-            self.dimensionZEdit.setValue(self.selectedEntity.mesh.zExtent())
-            self.dimensionYEdit.setVisible(True)
-            self.dimensionZEdit.setVisible(True)
-        elif isinstance(self.selectedEntity.mesh, Qt3DExtras.QSphereMesh):
-            self.dimensionXEdit.setValue(self.selectedEntity.mesh.radius())
-            self.dimensionYEdit.setValue(0)
-            self.dimensionZEdit.setValue(0)
-            self.dimensionYEdit.setVisible(False)
-            self.dimensionZEdit.setVisible(False)
-        elif isinstance(self.selectedEntity.mesh, Qt3DRender.QMesh):
-            self.dimensionXEdit.setValue(
-                self.selectedEntity.transform.scale3D().x() * (1/STL_SCALE))
-            self.dimensionYEdit.setValue(
-                self.selectedEntity.transform.scale3D().y() * (1/STL_SCALE))
-            self.dimensionZEdit.setValue(
-                self.selectedEntity.transform.scale3D().z() * (1/STL_SCALE))
-            self.dimensionYEdit.setVisible(True)
-            self.dimensionZEdit.setVisible(True)
-
-        # Unblock the signals of the input fields
-        self.blockOrUnblockSignals(False)
-
-    def undo(self):
-        """ TODO: There's a bug here where the undo throws an error when the object has already been deleted """
-        if self.history_index >= 0:
-            self.history[self.history_index].undo()
-            self.history_index -= 1
-
-            # Update the values in the EditWindow
-            self.loadEntity(self.selectedEntity)
-
-    def redo(self):
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.history[self.history_index].execute()
-
-            # Update the values in the EditWindow
-            self.loadEntity(self.selectedEntity)
+        store = entity.store
+        row = entity.row
+
+        # Keep the change signals of the fields set below from creating commands
+        self.loading = True
+        try:
+            name = store.names[row]
+            if name != self.shown.get('name'):
+                self.nameEdit.setText(name)
+                self.shown['name'] = name
+                self.widgetUpdates += 1
+
+            parent = store.names[store.parent[row]] if store.parent[row] >= 0 else ''
+            if parent != self.shown.get('parent'):
+                self.parentEdit.setText(parent)
+                self.shown['parent'] = parent
+                self.widgetUpdates += 1
+
+            color = tuple(store.color[row].tolist())
+            if color != self.shown.get('color'):
+                self.updateColorLabel(QColor(*color))
+                self.shown['color'] = color
+                self.widgetUpdates += 1
+
+            self.loadPosition(entity)
+            self.loadOrientation(entity)
+
+            # Spheres only have a radius
+            sphere = entity.shape == ShapeType.SPHERE
+            if sphere != self.shown.get('sphere'):
+                self.dimensionYEdit.setVisible(not sphere)
+                self.dimensionZEdit.setVisible(not sphere)
+                self.shown['sphere'] = sphere
+                self.widgetUpdates += 2
+            self.showValues('dimensions', (self.dimensionXEdit, self.dimensionYEdit, self.dimensionZEdit),
+                            store.dimensions[row].tolist())
+        finally:
+            self.loading = False
+
+    @profiled('EditWindow.loadPosition', 'ui')
+    def loadPosition(self, entity):
+        # Only touch the position fields whose value changed, so frequent refreshes while dragging stay cheap
+        loading, self.loading = self.loading, True
+        self.showValues('position', (self.positionXEdit, self.positionYEdit, self.positionZEdit),
+                        entity.store.translation[entity.row].tolist())
+        self.loading = loading
+
+    def loadOrientation(self, entity):
+        # Angles typed in this window stay as typed for as long as they still describe the entity's rotation
+        orientation = tuple(entity.store.rotation[entity.row].tolist())
+        shown = self.shown.get('orientation')
+        if shown is not None and sameOrientation(orientation, shown):
+            return
+        angles = QQuaternion(*orientation).toEulerAngles()
+        loading, self.loading = self.loading, True
+        self.showValues('angles', (self.orientationXEdit, self.orientationYEdit, self.orientationZEdit),
+                        (angles.x(), angles.y(), angles.z()))
+        self.loading = loading
+        self.shown['orientation'] = orientation
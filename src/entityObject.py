@@ -1,38 +1,105 @@
+import uuid
+
 from PySide6.QtGui import QQuaternion, QVector3D, QColor
 from PySide6.Qt3DCore import Qt3DCore
 from PySide6.Qt3DExtras import Qt3DExtras
-from PySide6.Qt3DRender import Qt3DRender
-from PySide6.QtCore import QUrl, QFileInfo
-from src.constants import STL_SCALE, ShapeType, shapeClasses
+from PySide6.QtCore import QFileInfo
+from src.constants import DEFAULT_COLOR, STL_SCALE, ShapeType
+from src.sceneStore import DIRTY_COLOR, DIRTY_TRANSFORM, SHAPES
+from src.stlMesh import StlMesh
 
 
 class Entity3D:
     """
     The Entity3D class represents a 3D entity in the scene.
+    Its state lives in one row of the main window's SceneStore; this class is a thin view onto that row
+    plus the Qt objects that render it. Setters write the row and mark it dirty, and the store pushes
+    dirty rows to the Qt objects once per frame, so read the state through the getters, not the Qt objects.
+    In instanced mode the entity has no Qt entity, transform or material: it is a slot of the InstanceBatch
+    drawing every entity with its mesh, and a dirty row marks that slot to be read from the store instead.
+    A frozen entity has no Qt objects either: it is baked into a static batch, and any change thaws it again.
+    An entity may have a parent entity. Its position and orientation are then relative to the parent and it
+    moves with it; Qt entities stay flat under the scene root and are given the world transform by the store.
 
     Attributes
     ----------
+    id : str
+        A unique id that identifies the entity in the scene journal.
+    store : SceneStore
+        The store holding the entity's state.
+    row : int
+        The entity's row in the store, or None while the entity is detached from the scene.
     entity : Qt3DCore.QEntity
-        The Qt3D entity that this class wraps.
-    mesh : Qt3DExtras.QGeometryRenderer
-        The mesh that defines the shape of the entity.
+        The Qt3D entity that this class wraps, or None in instanced mode.
+    mesh : QGeometryRenderer
+        The mesh that defines the shape of the entity, shared through the geometry registry.
+    shape : ShapeType
+        The shape type of the entity.
     name : str
         The name of the entity.
     material : Qt3DExtras.QDiffuseSpecularMaterial
-        The material of the entity.
+        The material of the entity, or None in instanced mode.
     transform : Qt3DCore.QTransform
-        The transform of the entity.
-    picker : Qt3DRender.QObjectPicker
-        The object picker for the entity.
+        The transform of the entity, or None in instanced mode.
+    batch : InstanceBatch
+        The batch drawing the entity in instanced mode, or None.
+    slot : int
+        The entity's slot in its batch, or None.
+    staticBatch : StaticBatch
+        The static batch the entity is frozen into, or being frozen into while the batch builds, or None.
     mainWindow : MainWindow
         The main window of the application.
+    detachedState : dict
+        The entity's store row while it is detached, so it can be attached again.
+    parent : Entity3D
+        The parent entity, or None. It is kept while either entity is detached.
+    children : list
+        The entities whose parent is this entity.
 
     Methods
     -------
-    onClicked(event):
-        Handles the event when the entity is clicked.
+    position(), setPosition(position):
+        Gets or sets the position as a QVector3D.
+    rotation(), setRotation(rotation):
+        Gets or sets the orientation as a QQuaternion.
+    scale(), setScale(scale):
+        Gets or sets the scale as a QVector3D.
+    worldPosition(), setWorldPosition(position):
+        Gets or sets the position in world space, as a QVector3D.
+    setParentEntity(parent):
+        Makes the entity a child of another entity, or of none, keeping its local transform.
+    localTransformUnder(parent):
+        Returns the position and orientation keeping the entity in place under another parent.
+    color(), setColor(color):
+        Gets or sets the color as a QColor.
+    pushToQt(flags, translation, rotation, scale, color):
+        Copies the entity's state from the store to its Qt objects, or marks its instance slot dirty.
+    createEntity(root_entity):
+        Creates the Qt entity, transform and material that draw the entity on its own.
+    setInstanced(instanced, root_entity):
+        Switches between drawing the entity on its own and in the batch of its mesh.
+    freeze():
+        Drops the entity's own Qt objects or instance once its static batch draws it.
+    thaw():
+        Takes the entity out of its static batch and draws it on its own again, in the current mode.
+    setVisible(visible):
+        Shows or hides the entity without changing its state.
+    setLod(level):
+        Draws the entity with one of its mesh's levels of detail.
+    updateLocalBounds():
+        Stores the bounding box and dimensions of the entity's mesh.
+    setMesh(mesh):
+        Replaces the mesh of the entity, releasing the previous one.
+    detach():
+        Takes the entity out of the scene, keeping its mesh and Qt objects so it can be attached again.
+    attach(root_entity):
+        Puts a detached entity back into the scene.
+    remove():
+        Releases the mesh and the store row and deletes the entity.
     toDict():
         Converts the entity to a dictionary.
+    properties(keys):
+        Returns some fields of the entity's dictionary, without building the rest of it.
     setup(scale, rotation, position):
         Sets up the entity with the given scale, rotation, and position.
     updateProperties(data):
@@ -43,91 +110,358 @@ class Entity3D:
         Creates a new entity from a dictionary.
     """
 
-    def __init__(self, root_entity, mesh, name, mainWindow):
-        self.entity = Qt3DCore.QEntity(root_entity)
-        self.mesh = mesh
-        self.name = name
+    # Signal connections to bound methods need weak references
+    __slots__ = ('id', 'store', 'row', 'entity', 'mesh', 'shape', 'material',
+                 'transform', 'batch', 'slot', 'staticBatch', 'mainWindow', 'detachedState', 'parent', 'children',
+                 '__weakref__')
+
+    def __init__(self, root_entity, shape, name, mainWindow, dimensions=None, source=None, asset=None):
+        # Get the shared mesh first, since loading an STL source can fail
+        self.mesh = mainWindow.geometryRegistry.acquire(shape, dimensions, source, asset)
+        self.shape = shape
+        self.id = uuid.uuid4().hex
         self.mainWindow = mainWindow
+        self.detachedState = None
+        self.store = mainWindow.sceneStore
+        self.row = self.store.allocate(self)
+        self.store.shape[self.row] = SHAPES.index(shape)
+        self.name = name
+        self.store.color[self.row] = DEFAULT_COLOR
+        self.entity = self.material = self.transform = None
+        self.batch = self.slot = None
+        self.staticBatch = None
+        self.parent = None
+        self.children = []
+        if mainWindow.instanceRenderer.enabled:
+            mainWindow.instanceRenderer.add(self)
+        else:
+            self.createEntity(root_entity)
+        self.updateLocalBounds()
+        if isinstance(self.mesh, StlMesh):
+            # An STL mesh that is still importing grows from its placeholder box to the loaded mesh
+            self.mesh.boundsChanged.connect(self.updateLocalBounds)
+
+    @property
+    def name(self):
+        return self.store.names[self.row]
+
+    @name.setter
+    def name(self, value):
+        self.store.setName(self.row, value)
+
+    def position(self):
+        return QVector3D(*self.store.translation[self.row].tolist())
+
+    def setPosition(self, position):
+        self.store.translation[self.row] = (position.x(), position.y(), position.z())
+        self.store.markDirty(self.row, DIRTY_TRANSFORM)
+
+    def rotation(self):
+        return QQuaternion(*self.store.rotation[self.row].tolist())
+
+    def setRotation(self, rotation):
+        self.store.rotation[self.row] = (rotation.scalar(), rotation.x(), rotation.y(), rotation.z())
+        self.store.markDirty(self.row, DIRTY_TRANSFORM)
+
+    def scale(self):
+        return QVector3D(*self.store.scale[self.row].tolist())
+
+    def setScale(self, scale):
+        self.store.scale[self.row] = (scale.x(), scale.y(), scale.z())
+        self.store.markDirty(self.row, DIRTY_TRANSFORM)
+        if self.shape == ShapeType.STL:
+            # STL dimensions are the scale without the import scale factor
+            self.store.dimensions[self.row] = self.store.scale[self.row] / STL_SCALE
+
+    def worldPosition(self):
+        self.store.updateWorld()
+        return QVector3D(*self.store.worldTranslation[self.row].tolist())
+
+    def setWorldPosition(self, position):
+        # Move the world position into the parent's frame
+        parentRow = self.store.parent[self.row]
+        if parentRow < 0:
+            self.setPosition(position)
+            return
+        self.store.updateWorld()
+        parentRotation = QQuaternion(*self.store.worldRotation[parentRow].tolist())
+        offset = position - QVector3D(*self.store.worldTranslation[parentRow].tolist())
+        self.setPosition(parentRotation.inverted().rotatedVector(offset))
+
+    def setParentEntity(self, parent):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        if parent is not None:
+            parent.children.append(self)
+        if self.row is not None:
+            self.store.setParent(self.row, -1 if parent is None or parent.row is None else parent.row)
+
+    def localTransformUnder(self, parent):
+        # The position and orientation relative to parent, or to the world, that keep the world transform
+        store = self.store
+        store.updateWorld()
+        position = QVector3D(*store.worldTranslation[self.row].tolist())
+        rotation = QQuaternion(*store.worldRotation[self.row].tolist())
+        if parent is not None:
+            parentRotation = QQuaternion(*store.worldRotation[parent.row].tolist()).inverted()
+            position = parentRotation.rotatedVector(position - QVector3D(*store.worldTranslation[parent.row].tolist()))
+            rotation = (parentRotation * rotation).normalized()
+        return ((position.x(), position.y(), position.z()),
+                (rotation.scalar(), rotation.x(), rotation.y(), rotation.z()))
+
+    def color(self):
+        return QColor(*self.store.color[self.row].tolist())
+
+    def setColor(self, color):
+        self.store.color[self.row] = color.getRgb()
+        self.store.markDirty(self.row, DIRTY_COLOR)
+
+    def pushToQt(self, flags, translation, rotation, scale, color):
+        if self.staticBatch is not None:
+            # A frozen entity that changed is drawn on its own again, with its whole state
+            self.thaw()
+            flags = DIRTY_TRANSFORM | DIRTY_COLOR
+        if self.batch is not None:
+            # The batch reads the whole row from the store when it uploads
+            self.batch.markDirty(self.slot)
+            return
+        if flags & DIRTY_TRANSFORM:
+            self.transform.setTranslation(QVector3D(*translation))
+            self.transform.setRotation(QQuaternion(*rotation))
+            self.transform.setScale3D(QVector3D(*scale))
+        if flags & DIRTY_COLOR:
+            self.material.setDiffuse(QColor(*color))
+
+    def createEntity(self, root_entity):
+        # Build the entity before parenting it; adding components to an entity in the scene is much slower
+        self.entity = Qt3DCore.QEntity()
         self.material = Qt3DExtras.QDiffuseSpecularMaterial()
         self.material.setSpecular(QColor(0, 0, 0))
-
+        self.material.setDiffuse(QColor(*self.store.color[self.row].tolist()))
         self.transform = Qt3DCore.QTransform()
-
-        self.entity.addComponent(self.mesh)
+        mesh = self.mesh.lods[self.store.lod[self.row]] if isinstance(self.mesh, StlMesh) else self.mesh
+        self.entity.addComponent(mesh)
         self.entity.addComponent(self.transform)
         self.entity.addComponent(self.material)
+        self.entity.setEnabled(bool(self.store.visible[self.row]))
+        self.entity.setParent(root_entity)
 
-        # Create a QObjectPicker and attach it to the entity
-        self.picker = Qt3DRender.QObjectPicker(self.entity)
-        self.entity.addComponent(self.picker)
+    def unparentEntity(self):
+        # Take the Qt entity out of the scene, and out of the group of the batch it was added with
+        group = self.entity.parentNode()
+        self.entity.setParent(None)
+        self.mainWindow.leaveGroup(group)
 
-        # Connect the clicked signal to a slot
-        self.picker.clicked.connect(self.onClicked)
+    def deleteEntity(self):
+        # The shared mesh is parented to the registry's root entity, so only the transform and material go too
+        self.unparentEntity()
+        self.entity.deleteLater()
+        self.entity = self.material = self.transform = None
 
-        # Connect mouse movements to the mainWindow
-        self.picker.pressed.connect(self.mainWindow.onMousePressed)
-        self.picker.released.connect(self.mainWindow.onMouseReleased)
-        self.picker.setDragEnabled(True)
-        self.picker.moved.connect(self.mainWindow.onMouseMoved)
+    def setInstanced(self, instanced, root_entity):
+        if instanced == (self.batch is not None) or self.row is None or self.store.frozen[self.row]:
+            # A frozen entity is drawn in the current mode once it thaws
+            return
+        if instanced:
+            self.deleteEntity()
+            self.mainWindow.instanceRenderer.add(self)
+        else:
+            self.mainWindow.instanceRenderer.remove(self)
+            self.createEntity(root_entity)
+        # Push the whole row to the new representation on the next frame
+        self.store.markDirty(self.row, DIRTY_TRANSFORM | DIRTY_COLOR)
 
-    def onClicked(self, event):
-        self.mainWindow.onEntityClicked(self)
+    def freeze(self):
+        if self.store.frozen[self.row]:
+            return
+        if self.batch is not None:
+            self.mainWindow.instanceRenderer.remove(self)
+        else:
+            self.deleteEntity()
+        self.store.frozen[self.row] = True
 
-    def toDict(self):
-        # Convert the entity to a dictionary
-        data = {
-            'name': self.name,
-            'color': self.material.diffuse().getRgb(),
-            'position': (self.transform.translation().x(),
-                         self.transform.translation().y(),
-                         self.transform.translation().z()),
-            'orientation': (self.transform.rotation().scalar(),
-                            self.transform.rotation().x(),
-                            self.transform.rotation().y(),
-                            self.transform.rotation().z()),
-        }
+    def thaw(self):
+        if self.staticBatch is None:
+            return
+        self.mainWindow.staticBatcher.remove(self)
+        if self.row is None or not self.store.frozen[self.row]:
+            # Still drawn on its own, because the batch was not built yet or the entity is detached
+            return
+        self.store.frozen[self.row] = False
+        if self.mainWindow.instanceRenderer.enabled:
+            self.mainWindow.instanceRenderer.add(self)
+        else:
+            self.createEntity(self.mainWindow.rootEntity)
+        self.store.markDirty(self.row, DIRTY_TRANSFORM | DIRTY_COLOR)
+
+    def setVisible(self, visible):
+        self.store.visible[self.row] = visible
+        if self.batch is not None:
+            self.store.markDirty(self.row, DIRTY_COLOR)
+            return
+        self.entity.setEnabled(visible)
+
+    def setLod(self, level):
+        # Swap the drawn renderer; self.mesh stays the full-detail mesh used for picking and saving
+        if self.batch is not None:
+            # Move to the batch drawing the level
+            self.mainWindow.instanceRenderer.remove(self)
+            self.store.lod[self.row] = level
+            self.mainWindow.instanceRenderer.add(self)
+            self.store.markDirty(self.row, DIRTY_COLOR)
+            return
+        lods = self.mesh.lods
+        self.entity.removeComponent(lods[self.store.lod[self.row]])
+        self.entity.addComponent(lods[level])
+        self.store.lod[self.row] = level
+
+    def updateLocalBounds(self):
+        # Keep the unscaled bounding box of the mesh in the store for bounds queries; detached entities update on attach
+        if self.row is None:
+            return
         if isinstance(self.mesh, Qt3DExtras.QCuboidMesh):
-            data['dimensions'] = (self.mesh.xExtent(),
-                                  self.mesh.yExtent(),
-                                  self.mesh.zExtent())
-            data['shape'] = 'Cube'
+            halfExtent = (self.mesh.xExtent() / 2, self.mesh.yExtent() / 2, self.mesh.zExtent() / 2)
+            self.store.localMin[self.row] = [-v for v in halfExtent]
+            self.store.localMax[self.row] = halfExtent
+            self.store.dimensions[self.row] = [2 * v for v in halfExtent]
         elif isinstance(self.mesh, Qt3DExtras.QSphereMesh):
-            data['dimensions'] = (self.mesh.radius(),)
-            data['shape'] = 'Sphere'
-        elif isinstance(self.mesh, Qt3DRender.QMesh):
-            data['dimensions'] = (self.transform.scale3D().x() * (1/STL_SCALE),
-                                  self.transform.scale3D().y() * (1/STL_SCALE),
-                                  self.transform.scale3D().z() * (1/STL_SCALE))
-            data['shape'] = 'STL'
-            # Save the source file of the STL mesh
-            data['source'] = self.mesh.source().toLocalFile()
+            radius = self.mesh.radius()
+            self.store.localMin[self.row] = -radius
+            self.store.localMax[self.row] = radius
+            self.store.dimensions[self.row] = (radius, 0, 0)
+        elif isinstance(self.mesh, StlMesh):
+            self.store.localMin[self.row], self.store.localMax[self.row] = self.mesh.bounds()
+        self.store.markDirty(self.row, DIRTY_TRANSFORM)
+
+    def setMesh(self, mesh):
+        if mesh is self.mesh:
+            # Acquiring the mesh we already use only added a reference
+            self.mainWindow.geometryRegistry.release(mesh)
+            return
+        self.thaw()
+        if self.store.lod[self.row]:
+            self.setLod(0)
+        if self.batch is not None:
+            # Leave the old mesh's batch before the mesh can be deleted
+            self.mainWindow.instanceRenderer.remove(self)
+            self.mainWindow.geometryRegistry.release(self.mesh)
+            self.mesh = mesh
+            self.mainWindow.instanceRenderer.add(self)
+            self.store.markDirty(self.row, DIRTY_COLOR)
+        else:
+            self.entity.removeComponent(self.mesh)
+            self.mainWindow.geometryRegistry.release(self.mesh)
+            self.mesh = mesh
+            self.entity.addComponent(self.mesh)
+        self.updateLocalBounds()
+        if isinstance(self.mesh, StlMesh):
+            self.mesh.boundsChanged.connect(self.updateLocalBounds)
+
+    def detach(self):
+        # Keep a copy of the row, then free it; the Qt entity loses its parent so it stops rendering.
+        # A frozen entity leaves its static batch and comes back drawn on its own.
+        if self.staticBatch is not None:
+            self.mainWindow.staticBatcher.remove(self)
+        if self.batch is not None:
+            self.mainWindow.instanceRenderer.remove(self)
+        self.detachedState = self.store.readRow(self.row)
+        self.store.release(self.row)
+        self.row = None
+        if self.entity is not None:
+            self.unparentEntity()
+
+    def attach(self, root_entity):
+        self.row = self.store.allocate(self)
+        self.store.writeRow(self.row, self.detachedState)
+        self.detachedState = None
+        self.store.markDirty(self.row, DIRTY_TRANSFORM | DIRTY_COLOR)
+        # Come back in the current mode, which may have changed while the entity was detached
+        if self.mainWindow.instanceRenderer.enabled:
+            if self.entity is not None:
+                self.deleteEntity()
+            self.mainWindow.instanceRenderer.add(self)
+        elif self.entity is None:
+            self.createEntity(root_entity)
+        else:
+            self.entity.setParent(root_entity)
+        # Link the entity to its parent and children again, if they are in the scene
+        if self.parent is not None and self.parent.row is not None:
+            self.store.setParent(self.row, self.parent.row)
+        # Children that stayed in the scene were left where they were in world space, so keep them there
+        for child in self.children:
+            if child.row is not None:
+                self.store.reparent(child.row, self.row)
+        if isinstance(self.mesh, StlMesh):
+            # The mesh may have finished importing while the entity was detached
+            self.updateLocalBounds()
+
+    def remove(self):
+        if self.row is not None:
+            self.detach()
+        self.detachedState = None
+        self.setParentEntity(None)
+        for child in list(self.children):
+            child.setParentEntity(None)
+        self.mainWindow.geometryRegistry.release(self.mesh)
+        self.mesh = None
+        if self.entity is not None:
+            self.entity.deleteLater()
+            self.entity = None
+
+    def toDict(self):
+        # Convert the entity to a dictionary
+        return self.store.toDicts([self.row])[0]
+
+    def properties(self, keys):
+        # The same values toDict returns for these keys
+        store = self.store
+        row = self.row
+        data = {}
+        for key in keys:
+            if key == 'name':
+                data[key] = store.names[row]
+            elif key == 'color':
+                data[key] = tuple(store.color[row].tolist())
+            elif key == 'position':
+                data[key] = tuple(store.translation[row].tolist())
+            elif key == 'orientation':
+                data[key] = tuple(store.rotation[row].tolist())
+            elif key == 'dimensions':
+                dimensions = store.dimensions[row].tolist()
+                data[key] = tuple(dimensions[:1] if self.shape == ShapeType.SPHERE else dimensions)
+            elif key == 'parent':
+                data[key] = store.views[store.parent[row]].id if store.parent[row] >= 0 else None
         return data
 
     def setup(self, scale, rotation, position):
-        self.transform.setScale3D(scale)  # Set scale
-        self.transform.setRotation(rotation)  # Set rotation
-        self.transform.setTranslation(position)  # Set position
+        self.setScale(scale)  # Set scale
+        self.setRotation(rotation)  # Set rotation
+        self.setPosition(position)  # Set position
 
     def updateProperties(self, data):
         for key, value in data.items():
             if key == 'name':
                 self.name = value
+                self.mainWindow.uiWidget.sceneModel.entityChanged(self)
             elif key == 'color':
-                self.material.setDiffuse(QColor(*value))
+                self.setColor(QColor(*value))
             elif key == 'position':
-                self.transform.setTranslation(QVector3D(*value))
+                self.setPosition(QVector3D(*value))
             elif key == 'orientation':
-                self.transform.setRotation(QQuaternion(*value))
+                self.setRotation(QQuaternion(*value))
+            elif key == 'parent':
+                # Parents are saved by id; the main window finds them, later while a scene is loading
+                self.mainWindow.setParentById(self, value)
             elif key == 'dimensions':
-                if isinstance(self.mesh, Qt3DExtras.QCuboidMesh):
-                    self.mesh.setXExtent(value[0])
-                    self.mesh.setYExtent(value[1])
-                    self.mesh.setZExtent(value[2])
-                elif isinstance(self.mesh, Qt3DExtras.QSphereMesh):
-                    self.mesh.setRadius(value[0])
-                elif isinstance(self.mesh, Qt3DRender.QMesh):
+                if isinstance(self.mesh, StlMesh):
                     scaled_values = [v * STL_SCALE for v in value]
-                    self.transform.setScale3D(QVector3D(*scaled_values))
+                    self.setScale(QVector3D(*scaled_values))
+                else:
+                    # Shared meshes are never edited in place, so switch to the mesh with the new dimensions
+                    self.setMesh(self.mainWindow.geometryRegistry.acquire(self.shape, value))
+        if 'color' in data or 'dimensions' in data:
+            self.mainWindow.uiWidget.sceneModel.thumbnailChanged(self)
 
     def updateFromDict(self, data):
         # Update the properties of the entity from a dictionary
@@ -136,17 +470,23 @@ class Entity3D:
     @staticmethod
     def fromDict(data, root_entity, mainWindow):
         # Create a new entity from a dictionary
-        shape_class = shapeClasses.get(ShapeType[data['shape'].upper()])
-        entity = Entity3D(root_entity, shape_class(), data['name'], mainWindow)
-        if data['shape'] == 'STL':
-            file_info = QFileInfo(data['source'])
-            if file_info.exists():
-                # Load the STL file
-                entity.mesh.setSource(QUrl.fromLocalFile(data['source']))
-            else:
-                # Show an error message and skip loading the entity
-                print(
-                    f"Error: STL file {data['source']} does not exist. Skipping entity {data['name']}.")
-                return None
+        shape = ShapeType[data['shape'].upper()]
+        source = data.get('source')
+        asset = data.get('asset')
+        # The mesh of a file that has moved is still in the asset store
+        if (shape == ShapeType.STL and not QFileInfo(source).exists()
+                and not (asset and mainWindow.geometryRegistry.assets.contains(asset))):
+            # Show an error message and skip loading the entity
+            mainWindow.reportError(
+                f"Error: STL file {source} does not exist. Skipping entity {data['name']}.")
+            return None
+        try:
+            entity = Entity3D(root_entity, shape, data['name'], mainWindow,
+                              data.get('dimensions'), source, asset)
+        except (OSError, ValueError) as e:
+            mainWindow.reportError(
+                f"Error: could not read STL file {source}: {e}. Skipping entity {data['name']}.")
+            return None
+        entity.id = data.get('id', entity.id)
         entity.updateProperties(data)
         return entity
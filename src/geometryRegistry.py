@@ -0,0 +1,177 @@
+import errno
+import os
+from itertools import count
+
+from PySide6.QtCore import QUrl
+from PySide6.Qt3DExtras import Qt3DExtras
+from src.assetStore import AssetStore
+from src.constants import DEFAULT_DIMENSIONS, ShapeType
+from src.stlMesh import StlMesh
+
+
+class GeometryRegistry:
+    """
+    The GeometryRegistry class hands out one shared QGeometryRenderer per unique mesh.
+    Meshes are keyed by shape type plus dimensions, or by asset hash for STL meshes, and are
+    reference counted so a mesh is deleted once the last entity using it releases it.
+    With an importer, STL meshes are returned at once with a placeholder box and loaded in the background.
+    An STL file whose hash is not known yet is keyed by its path until its import finds the hash; if
+    another mesh has that hash already, resolve returns it so the entities can switch to it.
+    Shared meshes are never modified in place: an entity whose dimensions change releases its
+    mesh and acquires the one matching its new dimensions.
+
+    Attributes
+    ----------
+    rootEntity : Qt3DCore.QEntity
+        The owner of every mesh, so a mesh outlives the entity that first used it.
+    shared : bool
+        Whether meshes are shared. When False every acquire creates a new mesh (used for benchmarking).
+    importer : StlImporter
+        The importer that loads STL files in the background, or None to load them synchronously.
+    assets : AssetStore
+        The store holding the processed STL meshes.
+    meshes : dict
+        A dictionary mapping mesh keys to meshes.
+    refCounts : dict
+        A dictionary mapping mesh keys to the number of entities using the mesh.
+    keys : dict
+        A dictionary mapping meshes back to their keys.
+
+    Methods
+    -------
+    meshKey(shape, dimensions, source, asset):
+        Returns the registry key of a mesh.
+    acquire(shape, dimensions, source, asset):
+        Returns the mesh for the given parameters, creating it if needed.
+    addReference(mesh):
+        Adds a reference to a mesh that is already in use.
+    resolve(mesh):
+        Keys a loaded STL mesh by its asset hash and returns the mesh that has that hash.
+    release(mesh):
+        Releases one reference to a mesh, deleting it when it is no longer used.
+    forget(mesh):
+        Stops handing out a mesh, so the next acquire of its key creates a new one.
+    stats():
+        Returns the number of unique meshes and references.
+    """
+
+    def __init__(self, rootEntity, shared=True, importer=None, assets=None):
+        self.rootEntity = rootEntity
+        self.shared = shared
+        self.importer = importer
+        self.assets = assets if assets is not None else AssetStore()
+        self.meshes = {}
+        self.refCounts = {}
+        self.keys = {}
+        self.uniqueIds = count()
+
+    @staticmethod
+    def meshKey(shape, dimensions=None, source=None, asset=None):
+        if dimensions is None:
+            dimensions = DEFAULT_DIMENSIONS[shape]
+        if shape == ShapeType.STL:
+            # STL dimensions are applied through the transform scale, so only the content of the file matters
+            return (shape, asset) if asset is not None else (shape, 'file', os.path.abspath(source))
+        if shape == ShapeType.SPHERE:
+            return (shape, (float(dimensions[0]),))
+        return (shape, tuple(float(d) for d in dimensions))
+
+    def createMesh(self, shape, dimensions, source, asset):
+        if shape == ShapeType.CUBE:
+            mesh = Qt3DExtras.QCuboidMesh(self.rootEntity)
+            mesh.setXExtent(dimensions[0])
+            mesh.setYExtent(dimensions[1])
+            mesh.setZExtent(dimensions[2])
+        elif shape == ShapeType.SPHERE:
+            mesh = Qt3DExtras.QSphereMesh(self.rootEntity)
+            mesh.setRadius(dimensions[0])
+        elif self.importer is not None:
+            # Report a missing file right away unless its mesh is stored; the importer finds every other error
+            if not (asset is not None and self.assets.contains(asset)) and not os.path.isfile(source):
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), source)
+            mesh = StlMesh(self.assets, self.rootEntity)
+            mesh.sourceUrl = QUrl.fromLocalFile(source)
+            mesh.asset = asset
+            self.importer.load(mesh, source, asset)
+        else:
+            mesh = StlMesh(self.assets, self.rootEntity)
+            try:
+                mesh.setSource(QUrl.fromLocalFile(source))
+            except (OSError, ValueError):
+                mesh.deleteLater()
+                raise
+        return mesh
+
+    def acquire(self, shape, dimensions=None, source=None, asset=None):
+        if dimensions is None:
+            dimensions = DEFAULT_DIMENSIONS[shape]
+        if shape == ShapeType.STL and asset is None:
+            # A file imported before is shared by hash without reading it again
+            asset = self.assets.knownHash(source)
+        key = self.meshKey(shape, dimensions, source, asset)
+        if not self.shared:
+            # Give every mesh its own key so nothing is ever shared
+            key = key + (next(self.uniqueIds),)
+
+        mesh = self.meshes.get(key)
+        if mesh is None:
+            mesh = self.createMesh(shape, dimensions, source, asset)
+            self.meshes[key] = mesh
+            self.refCounts[key] = 0
+            self.keys[mesh] = key
+            if isinstance(mesh, StlMesh) and mesh.loaded:
+                # A synchronous load knows the hash at once; share the mesh if the same content is in use already
+                shared = self.resolve(mesh)
+                if shared is not mesh:
+                    del self.meshes[key]
+                    del self.refCounts[key]
+                    del self.keys[mesh]
+                    mesh.deleteLater()
+                    mesh = shared
+                key = self.keys[mesh]
+        self.refCounts[key] += 1
+        return mesh
+
+    def addReference(self, mesh):
+        self.refCounts[self.keys[mesh]] += 1
+
+    def resolve(self, mesh):
+        # Called once an STL mesh is loaded and its hash is known
+        key = self.keys.get(mesh)
+        hashKey = (ShapeType.STL, mesh.asset)
+        if key is None or key == hashKey or self.meshes.get(key) is not mesh or not self.shared:
+            return mesh
+        existing = self.meshes.get(hashKey)
+        if existing is not None:
+            return existing
+        self.meshes[hashKey] = self.meshes.pop(key)
+        self.refCounts[hashKey] = self.refCounts.pop(key)
+        self.keys[mesh] = hashKey
+        return mesh
+
+    def release(self, mesh):
+        key = self.keys.get(mesh)
+        if key is None:
+            return
+        self.refCounts[key] -= 1
+        if self.refCounts[key] == 0:
+            del self.meshes[key]
+            del self.refCounts[key]
+            del self.keys[mesh]
+            if self.importer is not None:
+                self.importer.drop(mesh)
+            mesh.deleteLater()
+
+    def forget(self, mesh):
+        # Move the mesh to a key of its own; the entities still using it release it as usual
+        key = self.keys.get(mesh)
+        if key is None or self.meshes.get(key) is not mesh:
+            return
+        unique = key + (next(self.uniqueIds),)
+        self.meshes[unique] = self.meshes.pop(key)
+        self.refCounts[unique] = self.refCounts.pop(key)
+        self.keys[mesh] = unique
+
+    def stats(self):
+        return {'meshes': len(self.meshes),
+                'references': sum(self.refCounts.values())}
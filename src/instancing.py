@@ -0,0 +1,352 @@
+import numpy as np
+from PySide6.QtCore import QByteArray
+from PySide6.QtGui import QVector3D
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from src.profiler import profiled
+
+# Per-instance floats: translation, rotation quaternion (w, x, y, z), scale and RGBA color in 0..1
+INSTANCE_ATTRIBUTES = (('instanceTranslation', 0, 3), ('instanceRotation', 3, 4),
+                       ('instanceScale', 7, 3), ('instanceColor', 10, 4))
+INSTANCE_FLOATS = 14
+INSTANCE_STRIDE = INSTANCE_FLOATS * 4
+
+VERTEX_SHADER = b"""#version 150 core
+
+in vec3 vertexPosition;
+in vec3 vertexNormal;
+in vec3 instanceTranslation;
+in vec4 instanceRotation;
+in vec3 instanceScale;
+in vec4 instanceColor;
+
+out vec3 worldPosition;
+out vec3 worldNormal;
+out vec4 color;
+
+uniform mat4 modelMatrix;
+uniform mat3 modelNormalMatrix;
+uniform mat4 viewProjectionMatrix;
+
+vec3 rotate(vec4 q, vec3 v)
+{
+    // Rotate v by the unit quaternion q = (w, x, y, z)
+    vec3 u = q.yzw;
+    return v + 2.0 * cross(u, cross(u, v) + q.x * v);
+}
+
+void main()
+{
+    // A zero scale collapses a hidden instance to a point, which draws nothing
+    vec3 position = rotate(instanceRotation, vertexPosition * instanceScale) + instanceTranslation;
+    worldPosition = vec3(modelMatrix * vec4(position, 1.0));
+    worldNormal = normalize(modelNormalMatrix * rotate(instanceRotation, vertexNormal / instanceScale));
+    color = instanceColor;
+    gl_Position = viewProjectionMatrix * vec4(worldPosition, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = b"""#version 150 core
+
+in vec3 worldPosition;
+in vec3 worldNormal;
+in vec4 color;
+
+out vec4 fragColor;
+
+uniform vec3 eyePosition;
+
+void main()
+{
+    // Light from the camera plus some ambient light, so every face the camera sees is lit
+    float diffuse = abs(dot(normalize(worldNormal), normalize(eyePosition - worldPosition)));
+    fragColor = vec4(color.rgb * (0.2 + 0.8 * diffuse), color.a);
+}
+"""
+
+
+def createShaderMaterial(vertexShader, fragmentShader, parent=None):
+    """ Creates a material drawing with a GLSL 1.50 shader program in the forward pass of Qt3DWindow. """
+    material = Qt3DRender.QMaterial(parent)
+    effect = Qt3DRender.QEffect(material)
+    technique = Qt3DRender.QTechnique(effect)
+    apiFilter = technique.graphicsApiFilter()
+    apiFilter.setApi(Qt3DRender.QGraphicsApiFilter.OpenGL)
+    apiFilter.setProfile(Qt3DRender.QGraphicsApiFilter.NoProfile)
+    apiFilter.setMajorVersion(3)
+    apiFilter.setMinorVersion(2)
+
+    # The forward renderer of Qt3DWindow only draws techniques with this key
+    filterKey = Qt3DRender.QFilterKey(technique)
+    filterKey.setName("renderingStyle")
+    filterKey.setValue("forward")
+    technique.addFilterKey(filterKey)
+
+    program = Qt3DRender.QShaderProgram(technique)
+    program.setVertexShaderCode(QByteArray(vertexShader))
+    program.setFragmentShaderCode(QByteArray(fragmentShader))
+    renderPass = Qt3DRender.QRenderPass(technique)
+    renderPass.setShaderProgram(program)
+    technique.addRenderPass(renderPass)
+    effect.addTechnique(technique)
+    material.setEffect(effect)
+    return material
+
+
+def createInstanceMaterial(parent=None):
+    """ Creates the material drawing instances with the per-instance attributes of an InstanceBatch. """
+    return createShaderMaterial(VERTEX_SHADER, FRAGMENT_SHADER, parent)
+
+
+def copyAttribute(attribute, geometry):
+    # A new attribute reading the same buffer, so a geometry can add attributes without changing the shared mesh
+    copy = Qt3DCore.QAttribute(geometry)
+    copy.setName(attribute.name())
+    copy.setAttributeType(attribute.attributeType())
+    copy.setVertexBaseType(attribute.vertexBaseType())
+    copy.setVertexSize(attribute.vertexSize())
+    copy.setByteOffset(attribute.byteOffset())
+    copy.setByteStride(attribute.byteStride())
+    copy.setCount(attribute.count())
+    copy.setDivisor(attribute.divisor())
+    copy.setBuffer(attribute.buffer())
+    return copy
+
+
+class InstanceBatch:
+    """
+    The InstanceBatch class draws every entity using one mesh with a single instanced draw call.
+    Each entity owns a slot of a NumPy array of per-instance transforms and colors, which is copied to
+    a QBuffer read by the instance attributes of the batch's geometry. The mesh's own attributes are
+    copied into that geometry and read the mesh's buffers, so the vertices are not duplicated.
+    Slots are kept contiguous by moving the last slot into a removed one. Only the range of slots
+    marked dirty since the last upload is gathered from the scene store and copied to the buffer.
+
+    Attributes
+    ----------
+    source : QGeometryRenderer
+        The shared mesh, or level of detail of an STL mesh, that the batch draws.
+    entity : Qt3DCore.QEntity
+        The entity holding the instanced renderer and the instance material.
+    renderer : Qt3DRender.QGeometryRenderer
+        The renderer drawing count instances of the source geometry.
+    buffer : Qt3DCore.QBuffer
+        The per-instance data on the GPU.
+    data : numpy.ndarray
+        A (capacity, INSTANCE_FLOATS) float32 array of per-instance data.
+    views : list
+        The Entity3D in each slot.
+    dirtyRange : list
+        The first and one past the last slot marked dirty since the last upload, or None.
+    uploadedCount : int
+        The instance count set on the renderer.
+    bounds : tuple
+        The world-space minimum and maximum corners covering every instance uploaded so far.
+
+    Methods
+    -------
+    add(view):
+        Gives an entity the next slot and returns it.
+    remove(slot):
+        Frees a slot by moving the last slot into it.
+    markDirty(slot):
+        Marks a slot to be read from the store on the next upload.
+    upload(store):
+        Copies the dirty slots from the store to the GPU and updates the instance count and bounds.
+    updateGeometry():
+        Copies the attributes of the source geometry, after it changed.
+    release():
+        Deletes the batch's Qt objects.
+    """
+
+    def __init__(self, source, material, parent):
+        self.source = source
+        self.entity = Qt3DCore.QEntity(parent)
+        self.renderer = Qt3DRender.QGeometryRenderer(self.entity)
+        self.buffer = Qt3DCore.QBuffer(self.entity)
+        self.data = np.zeros((64, INSTANCE_FLOATS), np.float32)
+        self.views = []
+        self.dirtyRange = None
+        self.uploadedCapacity = 0
+        self.uploadedCount = 0
+        self.bounds = None
+        self.geometry = None
+        self.updateGeometry()
+        self.entity.addComponent(self.renderer)
+        self.entity.addComponent(material)
+        source.geometryChanged.connect(self.updateGeometry)
+        source.primitiveTypeChanged.connect(self.updateGeometry)
+
+    def updateGeometry(self):
+        # Build a geometry reading the source's vertex buffers plus the instance buffer
+        geometry = Qt3DCore.QGeometry(self.entity)
+        sourceGeometry = self.source.geometry()
+        if sourceGeometry is not None:
+            for attribute in sourceGeometry.attributes():
+                geometry.addAttribute(copyAttribute(attribute, geometry))
+        for name, offset, size in INSTANCE_ATTRIBUTES:
+            attribute = Qt3DCore.QAttribute(geometry)
+            attribute.setName(name)
+            attribute.setAttributeType(Qt3DCore.QAttribute.VertexAttribute)
+            attribute.setVertexBaseType(Qt3DCore.QAttribute.Float)
+            attribute.setVertexSize(size)
+            attribute.setByteOffset(offset * 4)
+            attribute.setByteStride(INSTANCE_STRIDE)
+            attribute.setDivisor(1)
+            attribute.setCount(self.uploadedCount)
+            attribute.setBuffer(self.buffer)
+            geometry.addAttribute(attribute)
+        self.renderer.setPrimitiveType(self.source.primitiveType())
+        self.renderer.setInstanceCount(self.uploadedCount)
+        self.renderer.setGeometry(geometry)
+        if self.geometry is not None:
+            self.geometry.deleteLater()
+        self.geometry = geometry
+
+    def markDirty(self, slot):
+        if self.dirtyRange is None:
+            self.dirtyRange = [slot, slot + 1]
+        else:
+            self.dirtyRange[0] = min(self.dirtyRange[0], slot)
+            self.dirtyRange[1] = max(self.dirtyRange[1], slot + 1)
+
+    def add(self, view):
+        slot = len(self.views)
+        if slot == len(self.data):
+            # Double the capacity, so adding stays amortized O(1); the whole buffer is uploaded again
+            data = np.zeros((2 * len(self.data), INSTANCE_FLOATS), np.float32)
+            data[:slot] = self.data
+            self.data = data
+        self.views.append(view)
+        self.markDirty(slot)
+        return slot
+
+    def remove(self, slot):
+        last = len(self.views) - 1
+        if slot != last:
+            self.data[slot] = self.data[last]
+            self.views[slot] = self.views[last]
+            self.views[slot].slot = slot
+            self.markDirty(slot)
+        self.views.pop()
+        # The instance count shrinks on the next upload even if no slot was written
+        self.markDirty(min(slot, last))
+
+    def upload(self, store):
+        if self.dirtyRange is None:
+            return
+        start, stop = self.dirtyRange
+        self.dirtyRange = None
+        count = len(self.views)
+        stop = min(stop, count)
+        if start < stop:
+            # Gather the dirty range from the store with one indexing per column; hidden instances get no size
+            rows = np.array([view.row for view in self.views[start:stop]], np.intp)
+            data = self.data[start:stop]
+            data[:, 0:3] = store.worldTranslation[rows]
+            data[:, 3:7] = store.worldRotation[rows]
+            data[:, 7:10] = store.scale[rows] * store.visible[rows, None]
+            data[:, 10:14] = store.color[rows] / np.float32(255)
+
+        if len(self.data) != self.uploadedCapacity:
+            self.buffer.setData(QByteArray(self.data.tobytes()))
+            self.uploadedCapacity = len(self.data)
+        elif start < stop:
+            self.buffer.updateData(start * INSTANCE_STRIDE, QByteArray(self.data[start:stop].tobytes()))
+
+        # Qt3D culls an entity by the bounds of its renderer, so they have to cover every instance.
+        # They only grow, which keeps an update proportional to the slots written.
+        if start < stop:
+            mins, maxs = store.worldBounds(rows)
+            low, high = mins.min(axis=0), maxs.max(axis=0)
+            if self.bounds is not None:
+                low, high = np.minimum(low, self.bounds[0]), np.maximum(high, self.bounds[1])
+            self.bounds = (low, high)
+            self.renderer.setMinPoint(QVector3D(*low.tolist()))
+            self.renderer.setMaxPoint(QVector3D(*high.tolist()))
+
+        if count != self.uploadedCount:
+            for attribute in self.renderer.geometry().attributes():
+                if attribute.divisor() == 1:
+                    attribute.setCount(count)
+            self.renderer.setInstanceCount(count)
+            self.entity.setEnabled(count > 0)
+            self.uploadedCount = count
+
+    def release(self):
+        self.source.geometryChanged.disconnect(self.updateGeometry)
+        self.source.primitiveTypeChanged.disconnect(self.updateGeometry)
+        self.entity.setParent(None)
+        self.entity.deleteLater()
+
+
+class InstanceRenderer:
+    """
+    The InstanceRenderer class draws entities that share a mesh with one instanced draw call per mesh,
+    instead of a Qt3D entity with its own transform and material per entity.
+    Entities in instanced mode have no Qt objects of their own: the scene store marks the slots of their
+    dirty rows, and flush() copies those slots from the store and uploads them once per frame. Picking, editing and
+    serialization read the store, so they work the same for instanced entities.
+
+    Attributes
+    ----------
+    rootEntity : Qt3DCore.QEntity
+        The entity the batches are added under.
+    enabled : bool
+        Whether new and reattached entities are drawn instanced.
+    material : Qt3DRender.QMaterial
+        The material shared by every batch.
+    batches : dict
+        The batch drawing each source mesh.
+
+    Methods
+    -------
+    source(view):
+        Returns the mesh or level of detail an entity is drawn with.
+    add(view):
+        Puts an entity into the batch of its mesh.
+    remove(view):
+        Takes an entity out of its batch, deleting the batch once it is empty.
+    flush():
+        Uploads the instances written since the last frame.
+    stats():
+        Returns the number of batches and instances.
+    """
+
+    def __init__(self, rootEntity, store, enabled=False):
+        self.rootEntity = rootEntity
+        self.store = store
+        self.enabled = enabled
+        self.material = createInstanceMaterial(rootEntity)
+        self.batches = {}
+
+    def source(self, view):
+        lods = getattr(view.mesh, 'lods', None)
+        return view.mesh if lods is None else lods[self.store.lod[view.row]]
+
+    def add(self, view):
+        source = self.source(view)
+        batch = self.batches.get(source)
+        if batch is None:
+            batch = InstanceBatch(source, self.material, self.rootEntity)
+            self.batches[source] = batch
+        view.batch = batch
+        view.slot = batch.add(view)
+
+    def remove(self, view):
+        batch = view.batch
+        batch.remove(view.slot)
+        view.batch = None
+        view.slot = None
+        if not batch.views:
+            # The mesh may be deleted once no entity uses it, so the batch cannot outlive its last instance
+            del self.batches[batch.source]
+            batch.release()
+
+    @profiled('InstanceRenderer.flush', 'frame')
+    def flush(self):
+        for batch in self.batches.values():
+            batch.upload(self.store)
+
+    def stats(self):
+        return {'batches': len(self.batches), 'instances': sum(len(batch.views) for batch in self.batches.values())}
@@ -1,14 +1,39 @@
-import json
-from PySide6.QtCore import Qt, QUrl
+import os
+from itertools import islice
+
+import numpy as np
+from PySide6.QtCore import Qt, QEvent, QElapsedTimer
 from PySide6.QtGui import QQuaternion, QVector3D, QColor
 from PySide6.Qt3DCore import Qt3DCore
 from PySide6.Qt3DExtras import Qt3DExtras
+from PySide6.Qt3DLogic import Qt3DLogic
 from PySide6.QtWidgets import (QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
-                               QLabel)
+                               QLabel, QDialog, QFileDialog)
+from src.command import Command
+from src.commandStack import AddEntitiesCommand, CommandStack, CompoundCommand, DeleteEntitiesCommand
 from src.editWindow import EditWindow
+from src.profiler import profiled, profiler
+from src.profilerOverlay import ProfilerOverlay
 from src.userInterface import UIWidget
 from src.entityObject import Entity3D
-from src.constants import PERSPECTIVE_PROJECTION_VALUES, STL_SCALE, ShapeType, shapeClasses, STL_FILE_PATH
+from src.geometryRegistry import GeometryRegistry
+from src.instancing import InstanceRenderer
+from src.staticBatching import StaticBatcher
+from src.stlPicker import StlPicker
+from src.thumbnails import ThumbnailRenderer
+from src.culling import ViewCuller
+from src.picking import PickingEngine
+from src.spatialHash import SpatialHash
+from src.sceneJournal import SceneJournal
+from src.sceneStore import DIRTY_COLOR, DIRTY_TRANSFORM, SHAPES, SceneStore
+from src.sceneExport import exportScene
+from src.sceneFormat import writeSceneChunks
+from src.sceneLoader import SceneLoader
+from src.stlImporter import StlImporter
+from src.assetStore import AssetStore
+from src.constants import (PERSPECTIVE_PROJECTION_VALUES, STL_SCALE, ShapeType, STL_FILE_PATH,
+                           SCENE_FILE_PATH, JSON_SCENE_FILE_PATH, DRAG_PANEL_REFRESH_HZ, SAVE_CHUNK_SIZE,
+                           SNAP_DISTANCE, PLACEMENT_GAP, INSTANCED_RENDERING)
 
 
 class MainWindow(QMainWindow):
@@ -23,25 +48,84 @@ class MainWindow(QMainWindow):
         The widget that contains the user interface controls.
     editWindow : EditWindow
         The window for editing the properties of the selected entity.
+    profilerOverlay : ProfilerOverlay
+        The panel showing frame times and the timings of profiled sections, hidden unless profiling.
     rootEntity : Qt3DCore.QEntity
         The root entity of the 3D scene.
-    entities : list
-        A list of all entities in the scene.
-    previousMousePosition : QVector3D
-        The previous position of the mouse.
+    sceneStore : SceneStore
+        The arrays holding the state of every entity.
+    frameAction : Qt3DLogic.QFrameAction
+        Triggers once per frame to push changed entity state to Qt.
+    groups : dict
+        The entities that batches of entities are added under, mapped to the number of entities still drawn
+        under each. Qt3D parents do not own nodes created in Python, so they are kept here until they are empty.
+    culler : ViewCuller
+        Hides entities outside the view and picks the level of detail of STL entities once per frame.
+    instanceRenderer : InstanceRenderer
+        Draws the entities sharing a mesh with one instanced draw call, in instanced mode.
+    staticBatcher : StaticBatcher
+        Draws frozen entities from merged buffers built in the background.
+    thumbnailRenderer : ThumbnailRenderer
+        Renders the thumbnails of the object list and the STL picker on worker threads.
+    assets : AssetStore
+        The store keeping one processed copy of every imported STL mesh, named by its hash.
+    stlImporter : StlImporter
+        The importer that loads STL files on worker threads while their entities show placeholder boxes.
+    geometryRegistry : GeometryRegistry
+        The registry that shares meshes between entities.
+    journal : SceneJournal
+        The journal that persists every change to the scene as it happens.
+    sceneLoader : SceneLoader
+        The loader that builds saved entities in time-sliced chunks.
+    entities : dict
+        The entities in the scene in the order they were added, as dictionary keys so removal is O(1).
+    idIndex : dict
+        The entities in the scene by id, rebuilt when entities were added or removed since it was last used.
+    pendingParents : list
+        The (entity, parent id) pairs read while the scene loads, linked once every entity is built.
+    commandStack : CommandStack
+        The scene-wide undo history of edits, additions and deletions.
+    pickingEngine : PickingEngine
+        The engine that finds the entity under the mouse.
+    spatialHash : SpatialHash
+        The grid of entity bounds used to place new entities and to keep dragged entities from overlapping.
+    dragPoint : numpy.ndarray
+        The point on the drag plane under the mouse at the previous move.
+    dragNormal : numpy.ndarray
+        The normal of the drag plane, which faces the camera.
+    dragStart : tuple
+        The position of the dragged entity, relative to its parent, when the drag started.
+    dragTarget : numpy.ndarray
+        The world position the mouse has dragged the entity to, ignoring other entities.
+    dragResolved : numpy.ndarray
+        The world position the dragged entity reached without entering other entities, before snapping.
+    pendingDragPosition : QPointF
+        The latest mouse position of the drag, applied once per frame, or None if it was applied.
+    panelTimer : QElapsedTimer
+        Limits how often the edit window is refreshed while dragging.
     mousePressed : bool
         A flag indicating whether the mouse button is currently pressed.
+    dragged : bool
+        A flag indicating whether the selected entity was moved during the current press.
     selectedEntity : Entity3D
         The currently selected entity in the scene.
 
     Methods
     -------
+    eventFilter(watched, event):
+        Forwards mouse events from the 3D window to the mouse handlers.
+    cameraRay(point):
+        Returns the world-space ray from the camera through a point in the 3D window.
     onMousePressed(event):
-        Handles the mouse press event.
+        Picks the entity under the mouse and starts dragging it.
     onMouseReleased(event):
         Handles the mouse release event.
     onMouseMoved(event):
-        Handles the mouse move event.
+        Stores the mouse position of a drag for the next frame.
+    applyDrag():
+        Moves the dragged entity to the latest mouse position, stopping at and snapping to other entities.
+    onFrame(dt):
+        Runs the per-frame work, pushing changed entity state to Qt.
     updateCameraPosition():
         Updates the label displaying the camera position.
     onEntityClicked(entity):
@@ -50,20 +134,72 @@ class MainWindow(QMainWindow):
         Creates the 3D scene.
     addShape():
         Adds a new shape to the scene based on the selected shape in the UI widget.
-    addEntity(mesh, shape):
-        Adds a new entity to the scene.
+    importStl():
+        Lets STL files be picked by their thumbnails and adds an entity for each, loading the files in the background.
+    exportScene(filename):
+        Writes every entity, transformed and colored, into one STL, OBJ or glTF file, asking for it if not given.
+    reportError(message):
+        Prints an error and shows it in the UI widget.
+    onMeshLoaded(mesh):
+        Shows that an STL file finished loading and moves its entities to an identical mesh already in use.
+    onImportFailed(mesh, path, error):
+        Reports an STL file that could not be loaded and removes the entities waiting for it.
+    onImportsCancelled(meshes):
+        Removes the entities waiting for cancelled STL imports.
+    removeMeshEntities(meshes):
+        Deletes the entities using any of the given meshes, outside the undo history.
+    addEntity(shape, dimensions, source):
+        Adds a new entity to the scene and returns it.
+    placeEntity(entity):
+        Moves a new entity to the free position closest to the center of the view.
+    setInstanced(instanced):
+        Switches every entity between instanced drawing and a Qt entity of its own.
+    freezeEntities(entities):
+        Bakes entities that are not expected to move into static batches.
+    thawEntities(entities):
+        Draws frozen entities on their own again.
+    addEntities(scene):
+        Adds every entity of a SceneColumns batch, e.g. from sceneGenerators, and returns them.
+    createGroup():
+        Returns a new group entity, outside the scene, to build a batch of entities under.
+    addGroup(group):
+        Adds a group to the scene with the entities built under it.
+    leaveGroup(group):
+        Drops a group once the last entity drawn under it has left it.
     deleteEntity():
         Deletes the selected entity from the scene.
+    editEntities(entities, data):
+        Applies the same change to several entities as one undoable command.
+    attachEntities(entities):
+        Puts detached entities back into the scene.
+    detachEntities(entities):
+        Takes entities out of the scene without deleting them.
+    entityById(id):
+        Returns the entity in the scene with an id, or None.
+    setParentById(entity, id):
+        Makes an entity the child of the entity with an id, or of none when id is None.
+    undo():
+        Undoes the last change to the scene.
+    redo():
+        Redoes the last undone change to the scene.
     updateEditButton():
         Updates the state of the "Edit" button.
     openEditWindow():
         Opens the edit window for the selected entity.
     closeEvent(event):
         Handles the event when the application is closing.
+    snapshot():
+        Returns the dictionaries of all entities, used when compacting the journal.
+    recordChunks(entities):
+        Yields the dictionaries of the entities in chunks.
     save_data(data, filename):
-        Saves the entities to a file.
-    load_data(filename):
-        Loads the entities from a file.
+        Saves the entities to a binary .scene or a JSON file, which may be compressed.
+    load_data():
+        Starts replaying the snapshot and journal and prepares the scene loader.
+    onEntitiesLoaded(entities):
+        Adds a chunk of entities built by the scene loader.
+    onSceneLoaded():
+        Compacts the journal once the scene is built, if the loaded files need it.
     """
 
     def __init__(self):
@@ -103,80 +239,208 @@ class MainWindow(QMainWindow):
         vSideLayout.addWidget(self.editWindow)
         self.editWindow.hide()  # Initially hidden
 
+        # Create the profiler panel, shown with the "Profiler" button
+        self.profilerOverlay = ProfilerOverlay()
+        vSideLayout.addWidget(self.profilerOverlay)
+        self.profilerOverlay.hide()
+
         # Add both the UI Widget and Edit Window to the layout
         mainLayout.addLayout(vSideLayout)
 
         # Set the widget as the central widget of the window
         self.setCentralWidget(widget)
 
+        # Create the store holding the state of every entity
+        self.sceneStore = SceneStore()
+
         # Create the 3D scene
+        self.groups = {}
         self.createScene()
 
+        # Hide entities outside the view and draw distant STL meshes simplified
+        self.culler = ViewCuller(self.sceneStore, self.view)
+
+        # Create the registry that shares one mesh between entities with the same geometry;
+        # STL files are loaded on worker threads, so large files do not block the window
+        self.assets = AssetStore()
+        self.stlImporter = StlImporter(self.assets, self)
+        self.geometryRegistry = GeometryRegistry(self.rootEntity, importer=self.stlImporter, assets=self.assets)
+
+        # Draw entities that share a mesh with one instanced draw call when instancing is on
+        self.instanceRenderer = InstanceRenderer(self.rootEntity, self.sceneStore, INSTANCED_RENDERING)
+
+        # Draw frozen entities from a few merged buffers, built on a worker thread
+        self.staticBatcher = StaticBatcher(self.sceneStore, self.rootEntity, self)
+
+        # Decorate the object list with thumbnails rendered in the background and cached on disk
+        self.thumbnailRenderer = ThumbnailRenderer(self.assets, parent=self)
+        self.uiWidget.sceneModel.setThumbnails(self.thumbnailRenderer)
+
         # Create a timer to update the camera position label
         self.view.camera().positionChanged.connect(self.updateCameraPosition)
 
-        # Load entities from file
-        self.entities = self.load_data('entities.json')
-
-        # Store the previous mouse position
-        self.previousMousePosition = QVector3D()
+        # Load entities by replaying the saved snapshot and the journal of changes made since.
+        # Entities are built in time-sliced chunks, so the window is usable while a large scene loads.
+        self.entities = {}
+        self.idIndex = {}
+        self.idIndexVersion = None
+        self.pendingParents = []
+        self.commandStack = CommandStack()
+        self.journal = SceneJournal(SCENE_FILE_PATH, self.snapshot)
+        self.load_data()
+
+        # Pick entities with rays from the camera instead of a picker per entity
+        self.pickingEngine = PickingEngine(self.sceneStore, self.staticBatcher)
+        self.view.installEventFilter(self)
+
+        # Index the entity bounds in a grid, for placing new entities and colliding dragged ones
+        self.spatialHash = SpatialHash(self.sceneStore)
+
+        # Store the drag plane and the mouse position waiting for the next frame
+        self.dragPoint = None
+        self.dragNormal = None
+        self.dragStart = None
+        self.dragTarget = None
+        self.dragResolved = None
+        self.pendingDragPosition = None
+        self.panelTimer = QElapsedTimer()
+        self.panelTimer.start()
         self.mousePressed = False
+        self.dragged = False
 
         # Store the selected entity
         self.selectedEntity = None
 
         # Connect the buttons to their respective slots
         self.uiWidget.addButton.clicked.connect(self.addShape)
+        self.uiWidget.importButton.clicked.connect(self.importStl)
+        self.uiWidget.cancelImportButton.clicked.connect(self.stlImporter.cancel)
         self.uiWidget.deleteButton.clicked.connect(self.deleteEntity)
+        self.uiWidget.exportButton.clicked.connect(lambda: self.exportScene())
         # self.uiWidget.editButton.clicked.connect(self.openEditWindow)
 
         # Connect the currentItemChanged signal to a slot
-        self.uiWidget.entityWidgetList.currentItemChanged.connect(
+        self.uiWidget.entityListView.selectionModel().currentChanged.connect(
             self.updateEditButton)
 
-        # Connect the undo and redo buttons to the undo and redo methods of the EditWindow
-        self.uiWidget.undoButton.clicked.connect(self.editWindow.undo)
-        self.uiWidget.redoButton.clicked.connect(self.editWindow.redo)
-
-        # Restore all objects to the UI Widget
-        if self.entities:
-            for entity in self.entities:
-                self.uiWidget.addToList(entity)
-
+        # Connect the undo and redo buttons to the scene-wide command stack
+        self.uiWidget.undoButton.clicked.connect(self.undo)
+        self.uiWidget.redoButton.clicked.connect(self.redo)
+        self.uiWidget.profilerButton.toggled.connect(self.profilerOverlay.setActive)
+        self.uiWidget.instancedCheckBox.setChecked(self.instanceRenderer.enabled)
+        self.uiWidget.instancedCheckBox.toggled.connect(self.setInstanced)
+        self.uiWidget.freezeButton.clicked.connect(lambda: self.freezeEntities(self.uiWidget.listedEntities()))
+        self.uiWidget.thawButton.clicked.connect(lambda: self.thawEntities(list(self.entities)))
+
+        # Show the progress of STL imports and remove the entities of files that cannot be loaded
+        self.stlImporter.progressChanged.connect(self.uiWidget.showImportProgress)
+        self.stlImporter.meshLoaded.connect(self.onMeshLoaded)
+        self.stlImporter.importFailed.connect(self.onImportFailed)
+        self.stlImporter.importsCancelled.connect(self.onImportsCancelled)
+
+        # Start restoring objects once the event loop runs
+        self.sceneLoader.start()
+
+    def eventFilter(self, watched, event):
+        # Route mouse events from the 3D window to the picking handlers
+        if watched is self.view:
+            if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+                self.onMousePressed(event)
+            elif event.type() == QEvent.MouseMove:
+                self.onMouseMoved(event)
+            elif event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+                self.onMouseReleased(event)
+        return super().eventFilter(watched, event)
+
+    def cameraRay(self, point):
+        # Unproject the mouse position onto the near and far planes to get a world-space ray
+        camera = self.view.camera()
+        inverse, _ = (camera.projectionMatrix() * camera.viewMatrix()).inverted()
+        x = 2 * point.x() / self.view.width() - 1
+        y = 1 - 2 * point.y() / self.view.height()
+        near = inverse.map(QVector3D(x, y, -1))
+        far = inverse.map(QVector3D(x, y, 1))
+        origin = np.array((near.x(), near.y(), near.z()))
+        direction = np.array((far.x(), far.y(), far.z())) - origin
+        return origin, direction / np.linalg.norm(direction)
+
+    @profiled('MainWindow.onMousePressed', 'input')
     def onMousePressed(self, event):
+        # Pick the entity under the mouse with a single ray from the camera
+        origin, direction = self.cameraRay(event.position())
+        hit = self.pickingEngine.pick(origin, direction)
+        if hit is None:
+            return
+        row, distance = hit
+        self.onEntityClicked(self.sceneStore.views[row])
+        position = self.selectedEntity.position()
+        self.dragStart = (position.x(), position.y(), position.z())
+        # The drag moves the entity in world space; the command records the position relative to its parent
+        position = self.selectedEntity.worldPosition()
+        self.dragTarget = np.array((position.x(), position.y(), position.z()))
+        self.dragResolved = self.dragTarget.copy()
+
+        # Drag on the plane through the picked point that faces the camera, so the entity keeps its depth
         self.mousePressed = True
         self.camController.setEnabled(False)
-        self.previousMousePosition = event.worldIntersection()
-        self.initialZ = self.previousMousePosition.z()
+        camera = self.view.camera()
+        viewVector = camera.viewCenter() - camera.position()
+        self.dragNormal = np.array((viewVector.x(), viewVector.y(), viewVector.z()))
+        self.dragPoint = origin + direction * distance
 
     def onMouseReleased(self, event):
+        if not self.mousePressed:
+            return
         self.mousePressed = False
         self.camController.setEnabled(True)
 
-    def onMouseMoved(self, event):
-        """ When I keep swinging the mouse around, the object gets smaller and smaller. Why? """
-        # Get the world position of the mouse click
-        world_position = event.worldIntersection()
+        # Apply the last move, refresh the panel and record the whole drag as one undoable command
+        self.applyDrag()
+        if self.dragged and self.selectedEntity is not None:
+            position = self.selectedEntity.position()
+            self.editWindow.loadEntity(self.selectedEntity)
+            self.editWindow.executeCommand({'position': (position.x(), position.y(), position.z())},
+                                           {'position': self.dragStart})
+        self.dragged = False
 
+    def onMouseMoved(self, event):
+        # Only keep the latest mouse position; applyDrag handles it once per frame
         if self.mousePressed:
-            # If an entity is selected, calculate the new position of the entity
-            if self.selectedEntity is not None:
-                # Calculate the difference between the current and previous mouse positions
-                difference = QVector3D(world_position.x() - self.previousMousePosition.x(),
-                                       world_position.y() - self.previousMousePosition.y(),
-                                       world_position.z() - self.previousMousePosition.z()) 
-
-                # Apply the difference to the entity's position
-                new_position = self.selectedEntity.transform.translation() + difference
-
-                # Clamp the z position to [-10, 10]
-                # new_position.setZ(max(min(new_position.z(), 10), -10))
-                self.selectedEntity.transform.setTranslation(new_position)
-
-                self.editWindow.loadEntity(self.selectedEntity)
+            self.pendingDragPosition = event.position()
+
+    @profiled('MainWindow.applyDrag', 'input')
+    def applyDrag(self):
+        if self.pendingDragPosition is None or self.selectedEntity is None:
+            return
+        point = self.pendingDragPosition
+        self.pendingDragPosition = None
+
+        # Intersect the mouse ray with the drag plane
+        origin, direction = self.cameraRay(point)
+        denominator = direction @ self.dragNormal
+        if abs(denominator) < 1e-9:
+            return
+        point = origin + direction * ((self.dragPoint - origin) @ self.dragNormal / denominator)
+
+        # Apply the difference between the current and previous points to the entity's position
+        self.dragTarget += point - self.dragPoint
+        self.dragPoint = point
+        if self.uiWidget.snapCheckBox.isChecked():
+            # Stop where the entity would enter another one, then close a small gap to the nearest surface.
+            # Snapping starts from the unsnapped position every time, so the entity can be pulled away again.
+            row = self.selectedEntity.row
+            self.dragResolved = self.spatialHash.sweep(row, self.dragResolved, self.dragTarget)
+            position = self.spatialHash.snap(row, self.dragResolved, SNAP_DISTANCE)
+        else:
+            self.dragResolved = self.dragTarget.copy()
+            position = self.dragResolved
+        self.selectedEntity.setWorldPosition(QVector3D(*position))
+        self.dragged = True
 
-            # Update the previous mouse position
-            self.previousMousePosition = world_position
+        # Refresh the position fields at a limited rate; the rest of the panel cannot change while dragging
+        if self.panelTimer.hasExpired(1000 // DRAG_PANEL_REFRESH_HZ):
+            self.editWindow.loadPosition(self.selectedEntity)
+            self.panelTimer.restart()
 
     def updateCameraPosition(self):
         # Update the camera position label
@@ -185,12 +449,17 @@ class MainWindow(QMainWindow):
             f"Camera position: x={camera_position.x():.2f}, y={camera_position.y():.2f}, z={camera_position.z():.2f}")
 
     def onEntityClicked(self, entity):
-        # Find the corresponding item in the list and select it
-        for i in range(self.uiWidget.entityWidgetList.count()):
-            item = self.uiWidget.entityWidgetList.item(i)
-            if item.data(Qt.UserRole) is entity:
-                self.uiWidget.entityWidgetList.setCurrentItem(item)
-                break
+        # Select the corresponding row in the list; the model finds it without scanning
+        self.uiWidget.selectEntity(entity)
+
+    @profiled('MainWindow.onFrame', 'frame')
+    def onFrame(self, dt):
+        profiler.frame()
+        self.applyDrag()
+        self.culler.update()
+        self.sceneStore.flush()
+        self.instanceRenderer.flush()
+        self.uiWidget.sceneModel.flushThumbnails()
 
     def createScene(self):
 
@@ -206,6 +475,11 @@ class MainWindow(QMainWindow):
         self.view.camera().setPosition(QVector3D(0, 0, 10))
         self.view.camera().setUpVector(QVector3D(0, 1, 0))
 
+        # Push entity changes from the scene store to Qt once per frame
+        self.frameAction = Qt3DLogic.QFrameAction(self.rootEntity)
+        self.rootEntity.addComponent(self.frameAction)
+        self.frameAction.triggered.connect(self.onFrame)
+
         # For camera controls
         self.camController = Qt3DExtras.QOrbitCameraController(self.rootEntity)
         self.camController.setLinearSpeed(90)
@@ -220,73 +494,298 @@ class MainWindow(QMainWindow):
         selectedShape = ShapeType[self.uiWidget.shapeComboBox.currentText().upper()]
 
         # Create the shape
-        shape_class = shapeClasses.get(selectedShape)
-        if shape_class is not None:
-            if selectedShape == ShapeType.STL:
-                # If the selected shape is STL, load the STL file
-                mesh = shape_class()
-                mesh.setSource(QUrl.fromLocalFile(STL_FILE_PATH))
-                self.addEntity(mesh, selectedShape)
-            else:
-                self.addEntity(shape_class(), selectedShape)
-
-    def addEntity(self, mesh, shape):
-        # Create an entity
-        entity = Entity3D(self.rootEntity, mesh, shape.value +
-                          str(len(self.entities) + 1), self)
-
-        if shape == ShapeType.CUBE:
-            entity.mesh.setXExtent(1)
-            entity.mesh.setYExtent(1)
-            entity.mesh.setZExtent(1)
-        elif shape == ShapeType.SPHERE:
-            entity.mesh.setRadius(1)
+        if selectedShape == ShapeType.STL:
+            # If the selected shape is STL, load the STL file
+            try:
+                self.addEntity(selectedShape, source=STL_FILE_PATH)
+            except (OSError, ValueError) as e:
+                self.reportError(f"Error: could not load STL file {STL_FILE_PATH}: {e}")
+        else:
+            self.addEntity(selectedShape)
+
+    def importStl(self):
+        # Every file gets its entity at once; the placeholder boxes turn into the meshes as the files load
+        picker = StlPicker(self.thumbnailRenderer, os.path.dirname(STL_FILE_PATH), self)
+        accepted = picker.exec() == QDialog.Accepted
+        paths = picker.selectedPaths()
+        picker.deleteLater()
+        if not accepted:
+            return
+        for path in paths:
+            try:
+                self.addEntity(ShapeType.STL, source=path)
+            except (OSError, ValueError) as e:
+                self.reportError(f"Error: could not load STL file {path}: {e}")
+
+    def exportScene(self, filename=None):
+        if filename is None:
+            filename, _ = QFileDialog.getSaveFileName(
+                self, "Export scene", "scene.glb",
+                "Binary glTF (*.glb);;Binary STL (*.stl);;Wavefront OBJ (*.obj)")
+            if not filename:
+                return
+        try:
+            entities, triangles, skipped = exportScene(filename, self.entities, self.sceneStore)
+        except (OSError, ValueError) as e:
+            self.reportError(f"Error: could not export the scene to {filename}: {e}")
+            return
+        message = f"Exported {entities} objects, {triangles} triangles, to {filename}"
+        if skipped:
+            # Their files are still importing, so there is nothing to write for them yet
+            message += f"; {skipped} STL objects still loading were left out"
+        self.uiWidget.showStatus(message)
+
+    def reportError(self, message):
+        print(message)
+        self.uiWidget.showStatus(message)
+
+    def onMeshLoaded(self, mesh):
+        self.uiWidget.showStatus(f"Loaded {mesh.source().toLocalFile()}")
+        # The file's content may already be in the scene under another path; share that mesh instead.
+        # Detached entities keep this mesh, which still draws the same geometry.
+        shared = self.geometryRegistry.resolve(mesh)
+        entities = [entity for entity in self.entities if entity.mesh is mesh]
+        if shared is not mesh:
+            for entity in entities:
+                self.geometryRegistry.addReference(shared)
+                entity.setMesh(shared)
+        # Their thumbnails can be rendered now that the mesh is known
+        for entity in entities:
+            self.uiWidget.sceneModel.thumbnailChanged(entity)
+
+    def onImportFailed(self, mesh, path, error):
+        self.reportError(f"Error: could not read STL file {path}: {error}. Removing its entities.")
+        self.removeMeshEntities([mesh])
+
+    def onImportsCancelled(self, meshes):
+        self.uiWidget.showStatus("STL import cancelled")
+        self.removeMeshEntities(meshes)
+
+    def removeMeshEntities(self, meshes):
+        # Later entities of the same files load them again instead of sharing the unloaded meshes
+        for mesh in meshes:
+            self.geometryRegistry.forget(mesh)
+        meshes = set(meshes)
+        entities = [entity for entity in self.entities if entity.mesh in meshes]
+        if entities:
+            self.detachEntities(entities)
+        # The meshes will never load, so undo must not bring the entities back as empty placeholders;
+        # the commands that add, edit or delete them leave the history with them
+        dropped = self.commandStack.dropEntities(lambda entity: entity.mesh in meshes)
+        for entity in dict.fromkeys(entities + dropped):
+            entity.remove()
+
+    def addEntity(self, shape, dimensions=None, source=None):
+        # Create an entity, sharing its mesh with every other entity of the same shape and dimensions
+        entity = Entity3D(self.rootEntity, shape, shape.value +
+                          str(len(self.entities) + 1), self, dimensions, source)
 
         scale = QVector3D(STL_SCALE, STL_SCALE,
                           STL_SCALE) if shape == ShapeType.STL else QVector3D(1, 1, 1)
         rotation = QQuaternion.fromAxisAndAngle(QVector3D(1, 0, 0), 45)
-        position = QVector3D(3 * len(self.entities), 0, 0)
-
-        entity.setup(scale, rotation, position)
+        entity.setup(scale, rotation, QVector3D(0, 0, 0))
+        self.placeEntity(entity)
 
         # Add the entity to the UI widget
         self.uiWidget.addToList(entity)
 
         # Add the entity to the dictionary of entities
-        self.entities.append(entity)
+        self.entities[entity] = None
+        self.journal.recordCreate(entity)
+        self.commandStack.push(AddEntitiesCommand(self, [entity]))
+        return entity
+
+    def placeEntity(self, entity):
+        # Search the plane facing the camera, so the entity appears in view beside the ones already there
+        camera = self.view.camera()
+        right = QVector3D.crossProduct(camera.viewVector(), camera.upVector())
+        up = QVector3D.crossProduct(right, camera.viewVector())
+        axes = [(vector.x(), vector.y(), vector.z()) for vector in (right, up)]
+        center = camera.viewCenter()
+        position = self.spatialHash.freePosition(entity.row, (center.x(), center.y(), center.z()),
+                                                 axes, PLACEMENT_GAP)
+        entity.setPosition(QVector3D(*position))
+
+    @profiled('MainWindow.addEntities', 'scene')
+    def addEntities(self, scene):
+        # Create a whole batch as one undoable change; meshes are shared through the registry as usual
+        columns = scene.columns
+        shapes = [SHAPES[index] for index in columns['shape'].tolist()]
+        names = columns['name'].tolist()
+        sources = columns['source'].tolist()
+        assets = columns['asset'].tolist()
+        dimensions = columns['dimensions'].tolist()
+        first = len(self.entities) + 1
+
+        # Keep the list and the edit window from repainting until the batch is complete
+        self.uiWidget.entityListView.setUpdatesEnabled(False)
+        self.editWindow.setUpdatesEnabled(False)
+        try:
+            # Build the batch under a group outside the scene and add the group in one step
+            group = self.createGroup()
+            entities = []
+            created = []
+            for index, shape in enumerate(shapes):
+                name = scene.strings[names[index]] or shape.value + str(first + index)
+                source = scene.strings[sources[index]] if sources[index] >= 0 else None
+                asset = scene.strings[assets[index]] if assets[index] >= 0 else None
+                size = dimensions[index][:1] if shape == ShapeType.SPHERE else dimensions[index]
+                try:
+                    entity = Entity3D(group, shape, name, self, size, source, asset)
+                except (OSError, TypeError, ValueError) as e:
+                    self.reportError(f"Error: could not create {name} from {source}: {e}. Skipping it.")
+                    continue
+                entities.append(entity)
+                created.append(index)
+            self.addGroup(group)
+
+            # Write the state of the whole batch with one assignment per column
+            store = self.sceneStore
+            rows = np.array([entity.row for entity in entities], np.intp)
+            store.translation[rows] = columns['position'][created]
+            store.rotation[rows] = columns['orientation'][created]
+            store.color[rows] = columns['color'][created]
+            stl = store.shape[rows] == SHAPES.index(ShapeType.STL)
+            store.dimensions[rows[stl]] = columns['dimensions'][created][stl]
+            store.scale[rows[stl]] = store.dimensions[rows[stl]] * STL_SCALE
+            store.markDirty(rows, DIRTY_TRANSFORM | DIRTY_COLOR)
+
+            # Insert into the list with a single model update
+            self.entities.update(dict.fromkeys(entities))
+            self.uiWidget.addEntitiesToList(entities)
+        finally:
+            self.uiWidget.entityListView.setUpdatesEnabled(True)
+            self.editWindow.setUpdatesEnabled(True)
+
+        self.journal.recordCreates(entities, store.toDicts(rows))
+        if entities:
+            self.commandStack.push(AddEntitiesCommand(self, entities))
+            self.uiWidget.selectEntity(entities[-1])
+        return entities
+
+    def setInstanced(self, instanced):
+        # Detached entities switch when they are attached again
+        self.instanceRenderer.enabled = instanced
+        for entity in self.entities:
+            entity.setInstanced(instanced, self.rootEntity)
+
+    def freezeEntities(self, entities):
+        # Push pending changes first; a change still waiting for the next frame would thaw the entity at once
+        self.sceneStore.flush()
+        count = self.staticBatcher.freeze(entities)
+        self.uiWidget.showStatus(f"Freezing {count} objects")
+
+    def thawEntities(self, entities):
+        for entity in entities:
+            entity.thaw()
+
+    def createGroup(self):
+        # Every entity added to an entity in the scene costs time proportional to the size of the scene,
+        # so batches are built under a group outside the scene and the group is added in one step
+        return Qt3DCore.QEntity()
+
+    def addGroup(self, group):
+        # Instanced entities have no Qt entity of their own, so a batch of them leaves the group empty
+        count = len(group.childNodes())
+        if count:
+            group.setParent(self.rootEntity)
+            self.groups[group] = count
+
+    def leaveGroup(self, group):
+        # Count entities out as they leave, since listing the children of a large group is slow
+        count = self.groups.get(group)
+        if count is None:
+            return
+        if count > 1:
+            self.groups[group] = count - 1
+        else:
+            del self.groups[group]
+            group.setParent(None)
 
     def deleteEntity(self):
-        # Get the selected item
-        selectedItem = self.uiWidget.entityWidgetList.currentItem()
-
-        # Remove the entity from the scene and the dictionary
-        if selectedItem is not None:
-            # Get the entity from the item's data
-            selectedEntity = selectedItem.data(Qt.UserRole)
-            self.entities.remove(selectedEntity)
-
-            # Delete the entity
-            selectedEntity.entity.deleteLater()
-
-            # Remove the item from the widget list
-            row = self.uiWidget.entityWidgetList.row(selectedItem)
-            self.uiWidget.entityWidgetList.takeItem(row)
+        # Get the selected entity
+        selectedEntity = self.uiWidget.currentEntity()
+
+        # Remove the entity and its descendants from the scene; they are only detached, so the deletion can be undone
+        if selectedEntity is not None:
+            views = self.sceneStore.views
+            command = DeleteEntitiesCommand(self, [views[row] for row in self.sceneStore.subtree(selectedEntity.row)])
+            command.execute()
+            self.commandStack.push(command)
+
+    def editEntities(self, entities, data):
+        # Apply the same change to several entities as one undoable command
+        commands = [Command(entity, data) for entity in entities]
+        command = CompoundCommand(commands)
+        command.execute()
+        self.commandStack.push(command)
+
+    def attachEntities(self, entities):
+        # Put detached entities back into the scene, the list and the journal
+        group = self.createGroup()
+        for entity in entities:
+            entity.attach(group)
+            self.entities[entity] = None
+        self.addGroup(group)
+        self.journal.recordCreates(entities, self.sceneStore.toDicts([entity.row for entity in entities]))
+        self.uiWidget.addEntitiesToList(entities)
+        if entities:
+            self.uiWidget.selectEntity(entities[-1])
+
+    def detachEntities(self, entities):
+        # Removing the current row selects another one, which updates selectedEntity
+        self.uiWidget.removeFromList(entities)
+        # Children first, so every parent still has its row when its children leave it
+        for entity in reversed(entities):
+            self.journal.recordDelete(entity)
+            del self.entities[entity]
+            entity.detach()
 
             # If the deleted entity was the selected one, set selectedEntity to None
-            if self.selectedEntity == selectedEntity:
+            if self.selectedEntity is entity:
                 self.selectedEntity = None
 
-            # Update the state of the "Edit" button
-            self.updateEditButton()
+        # Update the state of the "Edit" button
+        self.updateEditButton()
+
+    def entityById(self, id):
+        store = self.sceneStore
+        if self.idIndexVersion != store.structureVersion:
+            self.idIndex = {view.id: view for view in store.views}
+            self.idIndexVersion = store.structureVersion
+        return self.idIndex.get(id)
+
+    def setParentById(self, entity, id):
+        if self.sceneLoader.isLoading():
+            # A parent may be saved after its children; link them all once the scene is built
+            self.pendingParents.append((entity, id))
+            return
+        parent = None if id is None else self.entityById(id)
+        if id is not None and parent is None:
+            self.reportError(f"Error: the parent {id} of {entity.name} is not in the scene. Keeping it at the top.")
+        elif parent is not None and parent.row in self.sceneStore.subtree(entity.row):
+            self.reportError(f"Error: {parent.name} is inside {entity.name} and cannot be its parent.")
+            parent = None
+        entity.setParentEntity(parent)
+
+    def undo(self):
+        if self.commandStack.undo() is not None:
+            # Update the values in the EditWindow
+            self.openEditWindow()
+
+    def redo(self):
+        if self.commandStack.redo() is not None:
+            # Update the values in the EditWindow
+            self.openEditWindow()
 
     def updateEditButton(self):
         # Enable the "Edit" button if an item is selected, disable it otherwise
-        selectedItem = self.uiWidget.entityWidgetList.currentItem()
-        # self.uiWidget.editButton.setEnabled(selectedItem is not None)
+        selectedEntity = self.uiWidget.currentEntity()
+        # self.uiWidget.editButton.setEnabled(selectedEntity is not None)
 
         # Update selectedEntity
-        if selectedItem is not None:
-            self.selectedEntity = selectedItem.data(Qt.UserRole)
+        if selectedEntity is not None:
+            self.selectedEntity = selectedEntity
             self.openEditWindow()
         else:
             self.selectedEntity = None
@@ -300,21 +799,54 @@ class MainWindow(QMainWindow):
             self.editWindow.hide()
 
     def closeEvent(self, event):
-        # Save entities to file when the application is closing
-        self.save_data(self.entities, 'entities.json')
+        # Stop the STL imports and fold the journal into a final snapshot when the application is closing
+        self.stlImporter.shutdown()
+        self.staticBatcher.shutdown()
+        self.thumbnailRenderer.shutdown()
+        self.journal.close()
         event.accept()
 
+    def snapshot(self):
+        # Serialize all rows in one pass; records that are still waiting to be built are saved as they were loaded
+        rows = [entity.row for entity in self.entities]
+        return self.sceneStore.toDicts(rows) + self.sceneLoader.remainingRecords()
+
+    def recordChunks(self, entities):
+        # Serialize the entities a chunk of rows at a time, so only one chunk of dictionaries exists at once
+        entities = iter(entities)
+        while True:
+            rows = [entity.row for entity in islice(entities, SAVE_CHUNK_SIZE)]
+            if not rows:
+                return
+            yield self.sceneStore.toDicts(rows)
+
+    @profiled('MainWindow.save_data', 'persistence')
     def save_data(self, data, filename):
-        with open(filename, 'w') as f:
-            json.dump([entity.toDict() for entity in data], f)
-
-    def load_data(self, filename):
-        try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-                entities = [Entity3D.fromDict(
-                    d, self.rootEntity, self) for d in data]
-                return entities
-        except (FileNotFoundError, EOFError, ValueError) as e:
-            print(f"Error loading data from {filename}: {e}")
-            return []
+        # The format follows the extension: .scene for the binary format, anything else for JSON, compressed
+        # for .json.gz or .json.zst. JSON is written as it is serialized, in constant memory.
+        writeSceneChunks(self.recordChunks(data), filename)
+
+    @profiled('MainWindow.load_data', 'persistence')
+    def load_data(self):
+        # Replay the snapshot and journal; a JSON scene is imported when there is no binary scene yet
+        records = self.journal.load(JSON_SCENE_FILE_PATH)
+        self.sceneLoader = SceneLoader(
+            records, lambda data: Entity3D.fromDict(data, self.rootEntity, self), self)
+        self.sceneLoader.entitiesLoaded.connect(self.onEntitiesLoaded)
+        self.sceneLoader.finished.connect(self.onSceneLoaded)
+
+    def onEntitiesLoaded(self, entities):
+        # Entities whose STL file could not be loaded are skipped by the loader
+        self.entities.update(dict.fromkeys(entities))
+        self.uiWidget.addEntitiesToList(entities)
+
+    def onSceneLoaded(self):
+        # Link the loaded entities to their parents, skipping those removed while the scene loaded
+        pending, self.pendingParents = self.pendingParents, []
+        for entity, id in pending:
+            if entity.row is not None:
+                self.setParentById(entity, id)
+
+        # Fold an imported or recovered scene into a new snapshot once every entity is built, in the background
+        if self.journal.needsCompaction:
+            self.journal.compact()
@@ -0,0 +1,308 @@
+import math
+import weakref
+
+import numpy as np
+
+from src.constants import ShapeType
+from src.profiler import profiled
+from src.sceneStore import SHAPES, quaternionsToMatrices
+
+# Maximum number of primitives in a BVH leaf; leaves are tested with one vectorized call
+LEAF_SIZE = 8
+
+# Stand-in for zero ray direction components, so slab tests never divide by zero
+EPSILON = 1e-30
+
+
+def safeInverse(direction):
+    direction = np.asarray(direction, np.float64)
+    return 1.0 / np.where(direction == 0, EPSILON, direction)
+
+
+def rayBoxDistances(origin, inverseDirection, mins, maxs):
+    """ Returns the distance along the ray to each box, or inf where the ray misses it. """
+    t1 = (mins - origin) * inverseDirection
+    t2 = (maxs - origin) * inverseDirection
+    near = np.maximum(np.minimum(t1, t2).max(axis=1), 0)
+    far = np.maximum(t1, t2).min(axis=1)
+    return np.where(far >= near, near, np.inf)
+
+
+def rayTriangleDistances(origin, direction, triangles):
+    """ Returns the distance along the ray to each (T, 3, 3) triangle, or inf where the ray misses it (Moller-Trumbore). """
+    v0 = triangles[:, 0]
+    edge1 = triangles[:, 1] - v0
+    edge2 = triangles[:, 2] - v0
+    p = np.cross(direction, edge2)
+    determinant = np.einsum('ij,ij->i', edge1, p)
+    valid = np.abs(determinant) > 1e-12
+    inverseDeterminant = 1.0 / np.where(valid, determinant, 1)
+    s = origin - v0
+    u = np.einsum('ij,ij->i', s, p) * inverseDeterminant
+    q = np.cross(s, edge1)
+    v = q @ direction * inverseDeterminant
+    t = np.einsum('ij,ij->i', edge2, q) * inverseDeterminant
+    hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return np.where(hit, t, np.inf)
+
+
+class Bvh:
+    """
+    The Bvh class is a bounding volume hierarchy over axis-aligned boxes.
+    Nodes are stored in flat arrays in build order, so every child has a higher index than its parent.
+    When the boxes move, refit() recomputes the node bounds level by level without changing the tree.
+
+    Attributes
+    ----------
+    order : numpy.ndarray
+        Primitive indices sorted so every leaf covers a contiguous range.
+    start, count : numpy.ndarray
+        The range of each node in order.
+    left, right : numpy.ndarray
+        The children of each node, or -1 for leaves.
+    nodeMin, nodeMax : list
+        The bounds of each node as Python lists, which are faster to test one node at a time than NumPy rows.
+
+    Methods
+    -------
+    refit(mins, maxs):
+        Recomputes the node bounds for moved boxes.
+    closestHit(origin, direction, leafTest):
+        Returns the closest hit found by leafTest among the leaves the ray passes through.
+    """
+
+    def __init__(self, mins, maxs):
+        count = len(mins)
+        centers = (mins + maxs) * 0.5
+        self.order = np.arange(count)
+        starts, counts, lefts, rights, depths = [0], [count], [-1], [-1], [0]
+
+        # Split on the longest axis of the box centers at the median until the leaves are small enough
+        stack = [0] if count > 0 else []
+        while stack:
+            node = stack.pop()
+            start, size = starts[node], counts[node]
+            if size <= LEAF_SIZE:
+                continue
+            indices = self.order[start:start + size]
+            nodeCenters = centers[indices]
+            axis = np.argmax(nodeCenters.max(axis=0) - nodeCenters.min(axis=0))
+            half = size // 2
+            self.order[start:start + size] = indices[np.argpartition(nodeCenters[:, axis], half)]
+            for childStart, childSize in ((start, half), (start + half, size - half)):
+                starts.append(childStart)
+                counts.append(childSize)
+                lefts.append(-1)
+                rights.append(-1)
+                depths.append(depths[node] + 1)
+                stack.append(len(starts) - 1)
+            lefts[node], rights[node] = len(starts) - 2, len(starts) - 1
+
+        self.start = np.array(starts)
+        self.count = np.array(counts)
+        self.left = np.array(lefts)
+        self.right = np.array(rights)
+        depths = np.array(depths)
+        isLeaf = self.left < 0
+        leaves = np.flatnonzero(isLeaf & (self.count > 0))
+        self.leaves = leaves[np.argsort(self.start[leaves])]
+        self.levels = [np.flatnonzero(~isLeaf & (depths == depth)) for depth in range(depths.max() + 1)]
+        self.startList = self.start.tolist()
+        self.countList = self.count.tolist()
+        self.leftList = self.left.tolist()
+        self.rightList = self.right.tolist()
+        self.refit(mins, maxs)
+
+    def refit(self, mins, maxs):
+        nodeMin = np.zeros((len(self.start), 3))
+        nodeMax = np.zeros((len(self.start), 3))
+        if len(self.leaves):
+            # Leaves cover contiguous ranges of order, so one reduceat computes every leaf box
+            starts = self.start[self.leaves]
+            nodeMin[self.leaves] = np.minimum.reduceat(mins[self.order], starts)
+            nodeMax[self.leaves] = np.maximum.reduceat(maxs[self.order], starts)
+        for nodes in reversed(self.levels):
+            nodeMin[nodes] = np.minimum(nodeMin[self.left[nodes]], nodeMin[self.right[nodes]])
+            nodeMax[nodes] = np.maximum(nodeMax[self.left[nodes]], nodeMax[self.right[nodes]])
+        self.nodeMin = nodeMin.tolist()
+        self.nodeMax = nodeMax.tolist()
+
+    def closestHit(self, origin, direction, leafTest):
+        # leafTest(primitives, maxDistance) returns the (distance, primitive) of its closest hit or (inf, None)
+        if not self.countList[0]:
+            return math.inf, None
+        ox, oy, oz = (float(v) for v in origin)
+        ix, iy, iz = (float(v) for v in safeInverse(direction))
+        best, bestPrimitive = math.inf, None
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            (minX, minY, minZ), (maxX, maxY, maxZ) = self.nodeMin[node], self.nodeMax[node]
+            tx1, tx2 = (minX - ox) * ix, (maxX - ox) * ix
+            ty1, ty2 = (minY - oy) * iy, (maxY - oy) * iy
+            tz1, tz2 = (minZ - oz) * iz, (maxZ - oz) * iz
+            near = max(min(tx1, tx2), min(ty1, ty2), min(tz1, tz2), 0.0)
+            far = min(max(tx1, tx2), max(ty1, ty2), max(tz1, tz2))
+            if far < near or near >= best:
+                continue
+            if self.leftList[node] < 0:
+                start = self.startList[node]
+                distance, primitive = leafTest(self.order[start:start + self.countList[node]], best)
+                if distance < best:
+                    best, bestPrimitive = distance, primitive
+            else:
+                stack.append(self.rightList[node])
+                stack.append(self.leftList[node])
+        return best, bestPrimitive
+
+
+class TriangleBvh:
+    """
+    The TriangleBvh class accelerates ray casts against the triangles of one mesh.
+
+    Attributes
+    ----------
+    triangles : numpy.ndarray
+        A (T, 3, 3) float64 array of triangle corners.
+    bvh : Bvh
+        The hierarchy over the triangle bounds.
+
+    Methods
+    -------
+    intersect(origin, direction):
+        Returns the distance to the closest triangle hit by the ray, or inf.
+    """
+
+    def __init__(self, triangles):
+        self.triangles = np.asarray(triangles, np.float64)
+        self.bvh = Bvh(self.triangles.min(axis=1), self.triangles.max(axis=1))
+
+    def intersect(self, origin, direction):
+        def leafTest(primitives, maxDistance):
+            distances = rayTriangleDistances(origin, direction, self.triangles[primitives])
+            closest = int(np.argmin(distances))
+            return distances[closest], primitives[closest]
+        return self.bvh.closestHit(origin, direction, leafTest)[0]
+
+
+class PickingEngine:
+    """
+    The PickingEngine class finds the entity hit by a ray, replacing a Qt3D object picker per entity.
+    A BVH over the world-space bounds of every store row narrows a pick down to a few candidates, which are then
+    tested exactly in the entity's local space: as a box, a sphere, or against a per-mesh triangle BVH for STL meshes.
+    The BVH is rebuilt when entities are added or removed and refitted when they move, lazily on the next pick.
+    Frozen rows are skipped there: they are picked by the triangles of their static batches, which map back to them.
+
+    Attributes
+    ----------
+    store : SceneStore
+        The store holding the entity transforms and bounds.
+    bvh : Bvh
+        The hierarchy over the world-space entity bounds.
+    mins, maxs : numpy.ndarray
+        The world-space entity bounds the hierarchy was last built or refitted from.
+    triangleBvhs : weakref.WeakKeyDictionary
+        Triangle BVHs keyed by the StlData they were built from.
+    staticBatcher : StaticBatcher
+        The batcher drawing the frozen rows, or None.
+
+    Methods
+    -------
+    update():
+        Rebuilds or refits the BVH if the store changed since the last pick.
+    intersectRow(row, origin, direction):
+        Returns the distance to the exact surface of one entity, or inf.
+    pick(origin, direction):
+        Returns the (row, distance) of the closest entity hit by the ray, or None.
+    """
+
+    def __init__(self, store, staticBatcher=None):
+        self.store = store
+        self.staticBatcher = staticBatcher
+        self.bvh = None
+        self.structureVersion = None
+        self.transformVersion = None
+        self.triangleBvhs = weakref.WeakKeyDictionary()
+
+    @profiled('PickingEngine.update', 'pick')
+    def update(self):
+        if (self.structureVersion == self.store.structureVersion
+                and self.transformVersion == self.store.transformVersion):
+            return
+        self.mins, self.maxs = self.store.worldBounds()
+        if self.structureVersion != self.store.structureVersion:
+            self.bvh = Bvh(self.mins, self.maxs)
+        else:
+            self.bvh.refit(self.mins, self.maxs)
+        self.structureVersion = self.store.structureVersion
+        self.transformVersion = self.store.transformVersion
+
+    def triangleBvh(self, data):
+        bvh = self.triangleBvhs.get(data)
+        if bvh is None:
+            bvh = TriangleBvh(data.triangles())
+            self.triangleBvhs[data] = bvh
+        return bvh
+
+    def intersectRow(self, row, origin, direction):
+        store = self.store
+        # Move the ray into the entity's local space; distances along it stay in world units
+        matrix = quaternionsToMatrices(store.worldRotation[row:row + 1].astype(np.float64))[0]
+        scale = store.scale[row].astype(np.float64)
+        scale = np.where(scale == 0, EPSILON, scale)
+        localOrigin = matrix.T @ (origin - store.worldTranslation[row]) / scale
+        localDirection = matrix.T @ direction / scale
+
+        shape = SHAPES[store.shape[row]]
+        if shape == ShapeType.CUBE:
+            return rayBoxDistances(localOrigin, safeInverse(localDirection),
+                                   store.localMin[row:row + 1], store.localMax[row:row + 1])[0]
+        if shape == ShapeType.SPHERE:
+            radius = store.localMax[row, 0]
+            a = localDirection @ localDirection
+            b = 2 * localOrigin @ localDirection
+            c = localOrigin @ localOrigin - radius * radius
+            discriminant = b * b - 4 * a * c
+            if discriminant < 0 or a == 0:
+                return math.inf
+            root = math.sqrt(discriminant)
+            for t in ((-b - root) / (2 * a), (-b + root) / (2 * a)):
+                if t >= 0:
+                    return t
+            return math.inf
+        data = store.views[row].mesh.data
+        if data is None:
+            # An STL mesh that is still importing is picked by its placeholder box
+            return rayBoxDistances(localOrigin, safeInverse(localDirection),
+                                   store.localMin[row:row + 1], store.localMax[row:row + 1])[0]
+        return self.triangleBvh(data).intersect(localOrigin, localDirection)
+
+    @profiled('PickingEngine.pick', 'pick')
+    def pick(self, origin, direction):
+        self.update()
+        if self.bvh is None:
+            return None
+        origin = np.asarray(origin, np.float64)
+        direction = np.asarray(direction, np.float64)
+
+        def leafTest(rows, maxDistance):
+            # Test the exact shapes of the rows whose bounds are hit, nearest first
+            distances = rayBoxDistances(origin, safeInverse(direction), self.mins[rows], self.maxs[rows])
+            distances[self.store.frozen[rows]] = np.inf
+            best, bestRow = math.inf, None
+            for index in np.argsort(distances):
+                if distances[index] >= min(best, maxDistance):
+                    break
+                distance = self.intersectRow(rows[index], origin, direction)
+                if distance < best:
+                    best, bestRow = distance, int(rows[index])
+            return best, bestRow
+
+        distance, row = self.bvh.closestHit(origin, direction, leafTest)
+        if self.staticBatcher is not None:
+            hit = self.staticBatcher.pick(origin, direction, distance)
+            if hit is not None:
+                row, distance = hit
+        if row is None:
+            return None
+        return row, distance
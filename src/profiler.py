@@ -0,0 +1,172 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+from src.constants import PROFILER_HISTORY, PROFILER_TRACE_EVENTS
+
+# Returned by section() while the profiler is disabled, so a disabled section allocates nothing
+DISABLED_SECTION = nullcontext()
+
+
+class Section:
+    # Times one run of a section and records it when it ends
+    __slots__ = ('profiler', 'name', 'category', 'start')
+
+    def __init__(self, profiler, name, category):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.category, self.start, time.perf_counter_ns())
+
+
+class Profiler:
+    """
+    The Profiler class times named sections of the application, such as the frame loop, picking,
+    edit window updates, commands and persistence. For every section it keeps the durations of its
+    latest runs for rolling percentiles, and it keeps the latest runs of all sections as trace events
+    that can be exported for chrome://tracing or Perfetto. While disabled, section() returns a shared
+    no-op context manager and profiled functions only check a flag.
+
+    Attributes
+    ----------
+    enabled : bool
+        Whether sections are recorded.
+    durations : dict
+        A dictionary mapping each section name to a deque of its latest durations, in milliseconds.
+    counts : dict
+        A dictionary mapping each section name to the number of times it ran.
+    frameTimes : deque
+        The latest times between frames, in milliseconds.
+    events : deque
+        The latest runs of all sections as (name, category, start, end, thread) tuples, in nanoseconds.
+    lastFrame : int
+        The time of the previous frame in nanoseconds, or None.
+    lock : threading.Lock
+        Guards the recorded data, since persistence also runs on a background thread.
+
+    Methods
+    -------
+    setEnabled(enabled):
+        Starts or stops recording.
+    section(name, category):
+        Returns a context manager that times a section.
+    record(name, category, start, end):
+        Records one run of a section.
+    frame():
+        Records the start of a frame.
+    stats():
+        Returns the count and rolling percentiles of every section.
+    exportTrace(path):
+        Writes the recorded events as a Chrome trace JSON file.
+    reset():
+        Clears everything recorded.
+    """
+
+    def __init__(self, history=PROFILER_HISTORY, traceEvents=PROFILER_TRACE_EVENTS):
+        self.enabled = False
+        self.history = history
+        self.durations = {}
+        self.counts = {}
+        self.frameTimes = deque(maxlen=history)
+        self.events = deque(maxlen=traceEvents)
+        self.lastFrame = None
+        self.lock = threading.Lock()
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+        # The time between the last frame before a pause and the first one after it is not a frame time
+        self.lastFrame = None
+
+    def section(self, name, category='app'):
+        if not self.enabled:
+            return DISABLED_SECTION
+        return Section(self, name, category)
+
+    def record(self, name, category, start, end):
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = deque(maxlen=self.history)
+                self.counts[name] = 0
+            self.durations[name].append((end - start) / 1e6)
+            self.counts[name] += 1
+            self.events.append((name, category, start, end, threading.get_ident()))
+
+    def frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        if self.lastFrame is not None:
+            with self.lock:
+                self.frameTimes.append((now - self.lastFrame) / 1e6)
+                self.events.append(('frame', 'frame', self.lastFrame, now, 0))
+        self.lastFrame = now
+
+    def stats(self):
+        with self.lock:
+            series = {name: list(values) for name, values in self.durations.items()}
+            series['frame'] = list(self.frameTimes)
+            counts = dict(self.counts, frame=len(self.frameTimes))
+        stats = {}
+        for name, values in series.items():
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99)).tolist()
+            stats[name] = {'count': counts[name], 'last': values[-1], 'p50': p50, 'p95': p95,
+                           'p99': p99, 'max': max(values)}
+        return stats
+
+    def exportTrace(self, path):
+        # Complete ("X") events in microseconds; frames go on a track of their own
+        with self.lock:
+            events = list(self.events)
+        threads = {0: 'Frames', threading.main_thread().ident: 'Main thread'}
+        pid = os.getpid()
+        trace = []
+        for name, category, start, end, thread in events:
+            threads.setdefault(thread, f"Thread {len(threads)}")
+            trace.append({'name': name, 'cat': category, 'ph': 'X', 'ts': start / 1000,
+                          'dur': (end - start) / 1000, 'pid': pid, 'tid': thread})
+        for thread, name in threads.items():
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': name}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.counts.clear()
+            self.frameTimes.clear()
+            self.events.clear()
+        self.lastFrame = None
+
+
+# The profiler shared by the whole application
+profiler = Profiler()
+
+
+def profiled(name, category='app'):
+    """ Decorates a function so every call is timed as a section while the profiler is enabled. """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(name, category, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
@@ -0,0 +1,82 @@
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QFontDatabase
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QFileDialog
+from src.constants import PROFILER_OVERLAY_REFRESH_MS
+from src.profiler import profiler
+
+
+class ProfilerOverlay(QWidget):
+    """
+    A class used to represent a panel showing the frame time and the rolling percentiles of every
+    profiled section. The profiler records only while the panel is shown, and the panel refreshes
+    at a fixed interval rather than on every frame.
+    ...
+
+    Attributes
+    ----------
+    statsLabel : QLabel
+        a label listing the count, last, p50, p95, p99 and max time of each section
+    exportButton : QPushButton
+        a button to export the recorded sections as a Chrome trace
+    resetButton : QPushButton
+        a button to clear the recorded sections
+    refreshTimer : QTimer
+        a timer that refreshes the statistics while the panel is shown
+
+    Methods
+    -------
+    setActive(active):
+        Shows the panel and starts the profiler, or hides it and stops the profiler
+    refresh():
+        Updates the statistics from the profiler
+    exportTrace():
+        Asks for a file name and writes the Chrome trace to it
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+
+        self.statsLabel = QLabel()
+        self.statsLabel.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.statsLabel)
+
+        buttons = QHBoxLayout()
+        self.exportButton = QPushButton("Export trace")
+        self.exportButton.clicked.connect(self.exportTrace)
+        buttons.addWidget(self.exportButton)
+        self.resetButton = QPushButton("Reset")
+        self.resetButton.clicked.connect(profiler.reset)
+        buttons.addWidget(self.resetButton)
+        layout.addLayout(buttons)
+
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setInterval(PROFILER_OVERLAY_REFRESH_MS)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+    def setActive(self, active):
+        profiler.setEnabled(active)
+        self.setVisible(active)
+        if active:
+            self.refresh()
+            self.refreshTimer.start()
+        else:
+            self.refreshTimer.stop()
+
+    def refresh(self):
+        stats = profiler.stats()
+        lines = [f"{'section (ms)':<30} {'count':>6} {'last':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7}"]
+        # The frame time first, then the sections that take the most time per run
+        for name in sorted(stats, key=lambda name: (name != 'frame', -stats[name]['p95'])):
+            s = stats[name]
+            lines.append(f"{name:<30} {s['count']:>6} {s['last']:>7.2f} {s['p50']:>7.2f} "
+                         f"{s['p95']:>7.2f} {s['p99']:>7.2f} {s['max']:>7.2f}")
+        self.statsLabel.setText('\n'.join(lines))
+
+    def exportTrace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export trace", "trace.json", "Chrome trace (*.json)")
+        if path:
+            try:
+                profiler.exportTrace(path)
+            except OSError as e:
+                print(f"Error exporting trace to {path}: {e}")
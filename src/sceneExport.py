@@ -0,0 +1,260 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from src.constants import EXPORT_CHUNK_VERTICES
+from src.profiler import profiled
+from src.stlLoader import BINARY_TRIANGLE
+from src.tessellation import bakeTransforms, meshData
+
+# The formats exportScene writes, by file extension
+EXPORT_FORMATS = ('.glb', '.obj', '.stl')
+
+# Binary glTF chunk and header constants, see the glTF 2.0 specification
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+GL_UNSIGNED_BYTE = 5121
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+# The interleaved vertex of a GLB export; 28 bytes keeps every attribute 4 byte aligned
+GLB_VERTEX = np.dtype([('position', '<f4', (3,)), ('normal', '<f4', (3,)), ('color', 'u1', (4,))])
+
+GENERATOR = "3D Object Viewer"
+UINT32_LIMIT = 1 << 32
+
+
+class ExportPart:
+    """ The rows of the entities that share one mesh, with the mesh's vertex data in its local space. """
+    __slots__ = ('mesh', 'rows')
+
+    def __init__(self, mesh, rows):
+        self.mesh = mesh
+        self.rows = rows
+
+
+def exportParts(views):
+    """
+    Groups entities by mesh into ExportParts and returns them with the number of entities left out because
+    their STL file is still importing. Reads the Qt meshes, so call it on the GUI thread.
+    """
+    meshes = {}
+    rows = {}
+    skipped = 0
+    for view in views:
+        if view.mesh not in meshes:
+            data = meshData(view.mesh)
+            meshes[view.mesh] = None if data is None or len(data.indices) == 0 else data
+        if meshes[view.mesh] is None:
+            skipped += 1
+            continue
+        rows.setdefault(view.mesh, []).append(view.row)
+    parts = [ExportPart(meshes[mesh], np.array(meshRows, np.intp)) for mesh, meshRows in rows.items()]
+    return parts, skipped
+
+
+def partChunks(parts, store, chunkVertices=EXPORT_CHUNK_VERTICES):
+    """
+    Yields (part, rows, positions, normals) for runs of the rows of each part with about chunkVertices
+    vertices, and at least one entity, so only one run is transformed and held in memory at a time.
+    Positions and normals are (K, N, 3) arrays in world space.
+    """
+    for part in parts:
+        step = max(1, chunkVertices // len(part.mesh.vertices))
+        for first in range(0, len(part.rows), step):
+            rows = part.rows[first:first + step]
+            positions, normals = bakeTransforms(part.mesh, store.worldTransforms(rows), store.scale[rows])
+            yield part, rows, positions, normals
+
+
+def writeAtomically(filename, write):
+    # Write to a temporary file first so a failed export never leaves a half-written file behind
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            result = write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, filename)
+        return result
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def countTriangles(parts):
+    return sum(len(part.mesh.indices) // 3 * len(part.rows) for part in parts)
+
+
+def stlColors(colors):
+    # The VisCAM and SolidView convention: 5 bits per channel, blue lowest, and bit 15 set when the color is valid
+    channels = colors[:, :3].astype(np.uint16) >> 3
+    return (1 << 15) | (channels[:, 0] << 10) | (channels[:, 1] << 5) | channels[:, 2]
+
+
+def writeStl(f, parts, store):
+    """ Writes the parts as one binary STL file, with each entity's color in the attribute of its triangles. """
+    triangles = countTriangles(parts)
+    if triangles >= UINT32_LIMIT:
+        raise ValueError(f"{triangles} triangles do not fit in a binary STL file")
+    f.write(f"Exported by {GENERATOR}".encode('ascii').ljust(80) + np.uint32(triangles).astype('<u4').tobytes())
+    for part, rows, positions, _ in partChunks(parts, store):
+        corners = positions[:, part.mesh.indices.reshape(-1, 3)]
+        records = np.empty(corners.shape[:2], BINARY_TRIANGLE)
+        records['vertices'] = corners
+        # Facet normals from the winding, like the normals the loader computes
+        normals = np.cross(corners[:, :, 1] - corners[:, :, 0], corners[:, :, 2] - corners[:, :, 0])
+        lengths = np.linalg.norm(normals, axis=2, keepdims=True)
+        np.divide(normals, lengths, out=normals, where=lengths > 0)
+        records['normal'] = normals
+        records['attribute'] = stlColors(store.color[rows])[:, None]
+        f.write(records.tobytes())
+    return triangles
+
+
+def formatRows(pattern, array):
+    # One line per row of a 2D array, formatted in a single string operation
+    return (pattern * len(array)) % tuple(array.ravel().tolist())
+
+
+def materialName(color):
+    return 'color_' + ''.join(f'{channel:02x}' for channel in color)
+
+
+def objectName(name):
+    # Everything after "o " is the name, so only line breaks and runs of white space must go
+    return '_'.join(name.split()) or 'object'
+
+
+def writeMtl(f, parts, store):
+    """ Writes one material per distinct entity color, named by materialName. """
+    colors = np.unique(np.concatenate([store.color[part.rows] for part in parts]), axis=0)
+    for color in colors.tolist():
+        f.write(f"newmtl {materialName(color)}\nKd {color[0] / 255:.4f} {color[1] / 255:.4f} {color[2] / 255:.4f}\n"
+                f"d {color[3] / 255:.4f}\n\n".encode('ascii'))
+
+
+def writeObj(f, parts, store, materialFile):
+    """
+    Writes the parts as one Wavefront OBJ file, with an object per entity that uses the material of its color
+    from materialFile. Vertices are written with their normals, in world space.
+    """
+    f.write(f"# Exported by {GENERATOR}\nmtllib {materialFile}\n".encode('utf-8'))
+    base = 1
+    for part, rows, positions, normals in partChunks(parts, store):
+        f.write(formatRows('v %.6g %.6g %.6g\n', positions.reshape(-1, 3)).encode('ascii'))
+        f.write(formatRows('vn %.4f %.4f %.4f\n', normals.reshape(-1, 3)).encode('ascii'))
+        vertexCount = len(part.mesh.vertices)
+        # Each corner is written as vertex//normal, which share an index
+        faces = np.repeat(part.mesh.indices.reshape(-1, 3).astype(np.int64), 2, axis=1)
+        lines = []
+        for i, (row, color) in enumerate(zip(rows.tolist(), store.color[rows].tolist())):
+            lines.append(f"o {objectName(store.names[row])}\nusemtl {materialName(color)}\n")
+            lines.append(formatRows('f %d//%d %d//%d %d//%d\n', faces + (base + i * vertexCount)))
+        f.write(''.join(lines).encode('utf-8'))
+        base += len(rows) * vertexCount
+    return countTriangles(parts)
+
+
+def writeGlb(f, parts, store):
+    """
+    Writes the parts as one binary glTF file holding one mesh, with the entity colors as vertex colors.
+    The JSON chunk comes first and needs the bounds of every position, so the positions are computed once
+    for the bounds and again when the vertices are written; only one chunk of them is in memory at a time.
+    """
+    vertexCount = sum(len(part.mesh.vertices) * len(part.rows) for part in parts)
+    indexCount = 3 * countTriangles(parts)
+    indexBytes = 4 * indexCount
+    vertexBytes = GLB_VERTEX.itemsize * vertexCount
+    if vertexCount >= UINT32_LIMIT or indexBytes + vertexBytes >= UINT32_LIMIT:
+        raise ValueError(f"{vertexCount} vertices do not fit in a binary glTF file")
+
+    low = np.full(3, np.inf, np.float32)
+    high = np.full(3, -np.inf, np.float32)
+    for _, _, positions, _ in partChunks(parts, store):
+        low = np.minimum(low, positions.min(axis=(0, 1)))
+        high = np.maximum(high, positions.max(axis=(0, 1)))
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': GENERATOR},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'name': 'scene'}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 1, 'NORMAL': 2, 'COLOR_0': 3},
+                                    'indices': 0, 'material': 0}]}],
+        'materials': [{'pbrMetallicRoughness': {'metallicFactor': 0, 'roughnessFactor': 1}}],
+        'buffers': [{'byteLength': indexBytes + vertexBytes}],
+        # The indices come first: they do not depend on the transforms, so no pass is needed to know their size
+        'bufferViews': [{'buffer': 0, 'byteOffset': 0, 'byteLength': indexBytes, 'target': GL_ELEMENT_ARRAY_BUFFER},
+                        {'buffer': 0, 'byteOffset': indexBytes, 'byteLength': vertexBytes,
+                         'byteStride': GLB_VERTEX.itemsize, 'target': GL_ARRAY_BUFFER}],
+        'accessors': [{'bufferView': 0, 'componentType': GL_UNSIGNED_INT, 'count': indexCount, 'type': 'SCALAR'},
+                      {'bufferView': 1, 'byteOffset': 0, 'componentType': GL_FLOAT, 'count': vertexCount,
+                       'type': 'VEC3', 'min': low.tolist(), 'max': high.tolist()},
+                      {'bufferView': 1, 'byteOffset': 12, 'componentType': GL_FLOAT, 'count': vertexCount,
+                       'type': 'VEC3'},
+                      {'bufferView': 1, 'byteOffset': 24, 'componentType': GL_UNSIGNED_BYTE, 'normalized': True,
+                       'count': vertexCount, 'type': 'VEC4'}],
+    }
+    # Chunks are padded to 4 bytes, the JSON with spaces
+    content = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    content += b' ' * (-len(content) % 4)
+    length = 12 + 8 + len(content) + 8 + indexBytes + vertexBytes
+    f.write(np.array((GLB_MAGIC, GLB_VERSION, length, len(content), GLB_JSON_CHUNK), '<u4').tobytes())
+    f.write(content)
+    f.write(np.array((indexBytes + vertexBytes, GLB_BIN_CHUNK), '<u4').tobytes())
+
+    base = 0
+    for part in parts:
+        meshVertices = len(part.mesh.vertices)
+        step = max(1, EXPORT_CHUNK_VERTICES // meshVertices)
+        for first in range(0, len(part.rows), step):
+            count = min(step, len(part.rows) - first)
+            offsets = base + meshVertices * np.arange(first, first + count, dtype=np.uint32)
+            f.write((part.mesh.indices[None] + offsets[:, None]).astype('<u4').tobytes())
+        base += meshVertices * len(part.rows)
+
+    for _, rows, positions, normals in partChunks(parts, store):
+        vertices = np.empty(positions.shape[:2], GLB_VERTEX)
+        vertices['position'] = positions
+        # Normals must have unit length; those of collapsed faces or zero scales point up instead
+        normals[~normals.any(axis=2)] = (0, 1, 0)
+        vertices['normal'] = normals
+        vertices['color'] = store.color[rows][:, None]
+        f.write(vertices.tobytes())
+    return indexCount // 3
+
+
+@profiled('exportScene', 'persistence')
+def exportScene(filename, views, store):
+    """
+    Writes the entities, with their world transforms and colors baked in, into one .stl, .obj or .glb file
+    chosen by the extension. An OBJ file gets its materials in a .mtl file next to it. The file is written a
+    chunk of entities at a time, so the memory used stays about the same at any scene size. Returns the number
+    of entities and triangles written and the number of entities left out because their STL file is still
+    importing. Raises ValueError for an unknown extension or a scene with nothing to export, and OSError if
+    the file cannot be written.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Cannot export to {extension or 'a file without an extension'}; "
+                         f"use one of {', '.join(EXPORT_FORMATS)}")
+    parts, skipped = exportParts(views)
+    if not parts:
+        raise ValueError("The scene has no objects to export")
+    if extension == '.stl':
+        triangles = writeAtomically(filename, lambda f: writeStl(f, parts, store))
+    elif extension == '.obj':
+        materialPath = os.path.splitext(filename)[0] + '.mtl'
+        writeAtomically(materialPath, lambda f: writeMtl(f, parts, store))
+        triangles = writeAtomically(filename, lambda f: writeObj(f, parts, store, os.path.basename(materialPath)))
+    else:
+        triangles = writeAtomically(filename, lambda f: writeGlb(f, parts, store))
+    return sum(len(part.rows) for part in parts), triangles, skipped
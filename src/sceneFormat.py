@@ -0,0 +1,376 @@
+import gzip
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+
+import numpy as np
+
+from src.constants import DEFAULT_COLOR, ShapeType
+from src.sceneStore import SHAPES
+
+MAGIC = b'3DSCENE\0'
+VERSION = 3  # Version 1 files have no asset column and version 2 files no parent column; both are still read
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('count', '<u4'),
+                   ('strings', '<u4'), ('stringBytes', '<u4')])
+
+# Columns in file order; floats first so every section stays 4 byte aligned
+COLUMNS = (('position', '<f4', 3),
+           ('orientation', '<f4', 4),
+           ('dimensions', '<f4', 3),
+           ('id', '<u4', 1),
+           ('name', '<u4', 1),
+           ('source', '<i4', 1),
+           ('asset', '<i4', 1),
+           ('parent', '<i4', 1),
+           ('color', 'u1', 4),
+           ('shape', 'u1', 1))
+
+# Characters read at a time when a JSON scene is streamed
+JSON_BLOCK_SIZE = 1 << 20
+
+# Records converted at a time when a binary scene is streamed
+RECORD_CHUNK_SIZE = 10000
+
+# JSON scenes whose name ends in one of these are compressed
+GZIP_EXTENSION = '.gz'
+ZSTD_EXTENSION = '.zst'
+GZIP_LEVEL = 6  # Most of the ratio of level 9 at several times the speed
+
+
+class SceneColumns:
+    """
+    The SceneColumns class holds a scene as a struct of arrays, one array per entity attribute.
+    Names, ids, STL sources, asset hashes and parent ids are stored once in a string table and referenced by index.
+
+    Attributes
+    ----------
+    columns : dict
+        A dictionary mapping column names to NumPy arrays with one row per entity.
+    strings : list
+        The string table.
+
+    Methods
+    -------
+    fromRecords(records):
+        Builds the columns from a list of entity dictionaries.
+    fromArrays(shapes, positions, orientations, colors, dimensions, names, sources):
+        Builds the columns from one array per attribute, filling in defaults for the ones not given.
+    records(start, stop):
+        Returns the entity dictionaries for a range of rows.
+    """
+
+    def __init__(self, columns, strings):
+        self.columns = columns
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.columns['shape'])
+
+    @staticmethod
+    def fromRecords(records):
+        count = len(records)
+        columns = {name: np.zeros((count, width) if width > 1 else count, dtype)
+                   for name, dtype, width in COLUMNS}
+        strings = []
+        stringIndex = {}
+
+        def intern(value):
+            if value not in stringIndex:
+                stringIndex[value] = len(strings)
+                strings.append(value)
+            return stringIndex[value]
+
+        for row, data in enumerate(records):
+            shape = ShapeType[data['shape'].upper()]
+            columns['shape'][row] = SHAPES.index(shape)
+            columns['position'][row] = data['position']
+            columns['orientation'][row] = data['orientation']
+            columns['color'][row] = data['color']
+            dimensions = data.get('dimensions', (1, 1, 1))
+            columns['dimensions'][row, :len(dimensions)] = dimensions
+            columns['id'][row] = intern(data.get('id', ''))
+            columns['name'][row] = intern(data['name'])
+            columns['source'][row] = intern(data['source']) if 'source' in data else -1
+            columns['asset'][row] = intern(data['asset']) if 'asset' in data else -1
+            columns['parent'][row] = intern(data['parent']) if data.get('parent') is not None else -1
+        return SceneColumns(columns, strings)
+
+    @staticmethod
+    def fromArrays(shapes, positions, orientations=None, colors=None, dimensions=None, names=None, sources=None):
+        count = len(shapes)
+        columns = {name: np.zeros((count, width) if width > 1 else count, dtype)
+                   for name, dtype, width in COLUMNS}
+        columns['shape'][:] = [SHAPES.index(shape) for shape in shapes]
+        columns['position'][:] = np.asarray(positions, np.float32).reshape(count, 3)
+        columns['orientation'][:] = (1, 0, 0, 0) if orientations is None else orientations
+        columns['color'][:] = DEFAULT_COLOR if colors is None else colors
+        columns['dimensions'][:] = 1 if dimensions is None else dimensions
+
+        # Ids are left empty, so entities get new ones when they are created
+        strings = ['']
+        columns['id'][:] = 0
+        if names is not None:
+            strings.extend(names)
+            columns['name'][:] = np.arange(1, count + 1)
+        columns['asset'][:] = -1
+        columns['parent'][:] = -1
+        if sources is None:
+            columns['source'][:] = -1
+        else:
+            stringIndex = {}
+            for row, source in enumerate(sources):
+                if source is None:
+                    columns['source'][row] = -1
+                    continue
+                if source not in stringIndex:
+                    stringIndex[source] = len(strings)
+                    strings.append(source)
+                columns['source'][row] = stringIndex[source]
+
+        # An STL entity cannot be created without a file to load its mesh from
+        missing = np.flatnonzero((columns['shape'] == SHAPES.index(ShapeType.STL)) & (columns['source'] < 0))
+        if len(missing):
+            raise ValueError(f"STL entity {missing[0]} has no source file")
+        return SceneColumns(columns, strings)
+
+    def records(self, start=0, stop=None):
+        # Convert whole column slices at once; tolist is far faster than indexing rows one by one
+        rows = slice(start, stop)
+        columns = {name: self.columns[name][rows].tolist() for name, _, _ in COLUMNS}
+        records = []
+        for shapeIndex, position, orientation, color, dimensions, id, name, source, asset, parent in zip(
+                columns['shape'], columns['position'], columns['orientation'], columns['color'],
+                columns['dimensions'], columns['id'], columns['name'], columns['source'], columns['asset'],
+                columns['parent']):
+            shape = SHAPES[shapeIndex]
+            data = {
+                'name': self.strings[name],
+                'color': tuple(color),
+                'position': tuple(position),
+                'orientation': tuple(orientation),
+                'dimensions': tuple(dimensions[:1] if shape == ShapeType.SPHERE else dimensions),
+                'shape': shape.value,
+            }
+            if self.strings[id]:
+                data['id'] = self.strings[id]
+            if source >= 0:
+                data['source'] = self.strings[source]
+            if asset >= 0:
+                data['asset'] = self.strings[asset]
+            if parent >= 0:
+                data['parent'] = self.strings[parent]
+            records.append(data)
+        return records
+
+
+def isEntityRecord(data):
+    # Whether a record has the fields every entity needs; python validate.py checks the values and repairs them
+    return (isinstance(data, dict) and isinstance(data.get('shape'), str)
+            and data['shape'].upper() in ShapeType.__members__ and isinstance(data.get('name'), str)
+            and all(key in data for key in ('position', 'orientation', 'color')))
+
+
+def padding(size):
+    return -size % 4
+
+
+def encodeScene(records):
+    """ Encodes a list of entity dictionaries into the binary scene format. """
+    scene = SceneColumns.fromRecords(records)
+    encoded = [string.encode('utf-8') for string in scene.strings]
+    offsets = np.zeros(len(encoded) + 1, '<u4')
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+
+    header = np.zeros(1, HEADER)
+    header[0] = (MAGIC, VERSION, len(scene), len(encoded), offsets[-1])
+    parts = [header.tobytes()]
+    for name, dtype, _ in COLUMNS:
+        data = scene.columns[name].astype(dtype, copy=False).tobytes()
+        parts.append(data + b'\0' * padding(len(data)))
+    parts.append(offsets.tobytes())
+    parts.append(b''.join(encoded))
+    return b''.join(parts)
+
+
+def decodeScene(data):
+    """ Decodes the binary scene format into SceneColumns without copying the column data. """
+    header = np.frombuffer(data, HEADER, 1)[0]
+    if header['magic'] != MAGIC.rstrip(b'\0') or header['version'] not in (1, 2, VERSION):
+        raise ValueError("Not a binary scene file or unsupported version")
+    count = int(header['count'])
+
+    columns = {}
+    offset = HEADER.itemsize
+    for name, dtype, width in COLUMNS:
+        if name == 'asset' and header['version'] == 1:
+            # Scenes saved before the asset store refer to STL files by path only
+            columns[name] = np.full(count, -1, dtype)
+            continue
+        if name == 'parent' and header['version'] < 3:
+            # Scenes saved before the hierarchy are flat
+            columns[name] = np.full(count, -1, dtype)
+            continue
+        array = np.frombuffer(data, dtype, count * width, offset)
+        columns[name] = array.reshape(count, width) if width > 1 else array
+        offset += array.nbytes + padding(array.nbytes)
+
+    offsets = np.frombuffer(data, '<u4', int(header['strings']) + 1, offset).tolist()
+    offset += (len(offsets)) * 4
+    blob = bytes(data[offset:offset + int(header['stringBytes'])])
+    strings = [blob[start:stop].decode('utf-8') for start, stop in zip(offsets, offsets[1:])]
+    return SceneColumns(columns, strings)
+
+
+def isBinaryScene(filename):
+    return os.path.splitext(filename)[1] == '.scene'
+
+
+def zstandard():
+    # Zstandard compression needs the optional zstandard package
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Zstandard compressed scenes need the zstandard package: pip install zstandard") from None
+    return zstandard
+
+
+def openText(filename):
+    """ Opens a JSON scene for reading as text, decompressing it if its name ends in .gz or .zst. """
+    extension = os.path.splitext(filename)[1]
+    if extension == GZIP_EXTENSION:
+        return gzip.open(filename, 'rt', encoding='utf-8')
+    if extension == ZSTD_EXTENSION:
+        return zstandard().open(filename, 'rt', encoding='utf-8')
+    return open(filename, 'r', encoding='utf-8')
+
+
+def compressedWriter(f, filename):
+    # Wraps a binary file being written as filename, compressing the data if the name ends in .gz or .zst
+    name, extension = os.path.splitext(os.path.basename(filename))
+    if extension == GZIP_EXTENSION:
+        return gzip.GzipFile(name, 'wb', GZIP_LEVEL, f)
+    if extension == ZSTD_EXTENSION:
+        return zstandard().ZstdCompressor().stream_writer(f, closefd=False)
+    return nullcontext(f)
+
+
+def writeScene(records, filename):
+    """ Saves entity dictionaries to a .scene (binary) or .json file, atomically replacing it. """
+    writeSceneChunks([records], filename)
+
+
+def writeSceneChunks(chunks, filename):
+    """
+    Saves lists of entity dictionaries to a .scene or .json file like writeScene. JSON is written one list at
+    a time, so the lists can come from a generator and only one is held in memory; a binary scene stores every
+    column contiguously, so its records are collected first. JSON is compressed if the name ends in .gz or .zst.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isBinaryScene(filename):
+                f.write(encodeScene([data for chunk in chunks for data in chunk]))
+            else:
+                with compressedWriter(f, filename) as out:
+                    out.write(b'[')
+                    separator = b''
+                    for chunk in chunks:
+                        if chunk:
+                            # The list without its brackets, so the chunks join into one array
+                            out.write(separator + json.dumps(chunk)[1:-1].encode('utf-8'))
+                            separator = b', '
+                    out.write(b']')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, filename)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def readScene(filename):
+    """ Loads entity dictionaries from a .scene (binary) or .json file, which may be compressed. """
+    if isBinaryScene(filename):
+        # Memory-map the file so only the pages that are converted are read
+        return decodeScene(np.memmap(filename, np.uint8, 'r')).records()
+    with openText(filename) as f:
+        return json.load(f)
+
+
+def iterJsonRecords(filename, blockSize=JSON_BLOCK_SIZE):
+    """
+    Yields the entity dictionaries of a JSON scene one at a time, reading the file in blocks, so only a block
+    and the record being decoded are held in memory. Raises ValueError where the file stops being a JSON array,
+    and OSError if it cannot be read or decompressed.
+    """
+    decoder = json.JSONDecoder()
+    with openText(filename) as f:
+        buffer = ''
+        position = 0
+        started = False
+        eof = False
+        readSize = blockSize
+        # Characters dropped from the front of the buffer, to report errors at their place in the file
+        consumed = 0
+        while True:
+            # Skip whitespace, the opening bracket and the commas between records
+            while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ',')):
+                position += 1
+            if position < len(buffer) and not started:
+                if buffer[position] != '[':
+                    raise ValueError(f"Scene file {filename} is not a JSON array")
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            if position < len(buffer):
+                try:
+                    data, end = decoder.raw_decode(buffer, position)
+                    # A record ending with the block may continue in the next one, e.g. a number
+                    complete = end < len(buffer) or eof
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise ValueError(f"Invalid JSON in scene file {filename} at character "
+                                         f"{consumed + e.pos}: {e.msg}") from None
+                    # The record is cut off by the block, or the file is invalid further on; read ever larger
+                    # blocks, so an error far from the end of a large file is not decoded once per block
+                    readSize *= 2
+                    complete = False
+                if complete:
+                    readSize = blockSize
+                    position = end
+                    yield data
+                    continue
+            elif eof:
+                raise ValueError(f"Scene file {filename} ends before its closing bracket")
+            block = f.read(readSize)
+            eof = not block
+            buffer = buffer[position:] + block
+            consumed += position
+            position = 0
+
+
+def iterScene(filename, chunkSize):
+    """ Yields the entity dictionaries of a .scene or .json file in lists of at most chunkSize. """
+    if isBinaryScene(filename):
+        scene = decodeScene(np.memmap(filename, np.uint8, 'r'))
+        for start in range(0, len(scene), chunkSize):
+            yield scene.records(start, start + chunkSize)
+        return
+    chunk = []
+    for data in iterJsonRecords(filename):
+        chunk.append(data)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iterRecords(filename):
+    """ Yields the entity dictionaries of a .scene or .json file one at a time, without reading it all at once. """
+    for chunk in iterScene(filename, RECORD_CHUNK_SIZE):
+        yield from chunk
@@ -0,0 +1,134 @@
+import csv
+
+import numpy as np
+
+from src.constants import ShapeType
+from src.sceneFormat import SceneColumns
+
+# CSV columns read by readCsv; only shape and position are required
+CSV_POSITION = ('x', 'y', 'z')
+CSV_ORIENTATION = ('qw', 'qx', 'qy', 'qz')
+CSV_COLOR = ('r', 'g', 'b', 'a')
+CSV_DIMENSIONS = ('width', 'height', 'depth')
+
+
+def gridLayout(counts, spacing=3.0, shape=ShapeType.CUBE, origin=(0, 0, 0), dimensions=None, color=None,
+               source=None):
+    """
+    Returns SceneColumns for entities of one shape laid out on a regular grid.
+
+    Parameters
+    ----------
+    counts : tuple
+        The number of entities along X, Y and Z.
+    spacing : float or tuple
+        The distance between neighbouring entities, for all axes or per axis.
+    shape : ShapeType
+        The shape of every entity.
+    origin : tuple
+        The position of the first entity.
+    dimensions : tuple
+        The dimensions of every entity, or None for the default.
+    color : tuple
+        The RGBA color of every entity, or None for the default.
+    source : str
+        The STL file of every entity; required for STL entities.
+    """
+    axes = [np.arange(count, dtype=np.float32) for count in counts]
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+    positions = grid * np.asarray(spacing, np.float32) + np.asarray(origin, np.float32)
+    count = len(positions)
+    return SceneColumns.fromArrays([shape] * count, positions,
+                                   dimensions=None if dimensions is None else np.tile(padded(dimensions), (count, 1)),
+                                   colors=color, sources=None if source is None else [source] * count)
+
+
+def scatterLayout(count, bounds=((-50, -50, -50), (50, 50, 50)), shapes=(ShapeType.CUBE, ShapeType.SPHERE),
+                  sizeRange=(0.5, 2.0), sizeSteps=4, seed=None):
+    """
+    Returns SceneColumns for entities scattered uniformly at random inside a box.
+    Shapes, orientations, colors and sizes are random as well; a seed makes the layout reproducible.
+    Sizes are drawn from a few evenly spaced steps, so entities of the same shape and size share a mesh.
+
+    Parameters
+    ----------
+    count : int
+        The number of entities.
+    bounds : tuple
+        The minimum and maximum corners of the box.
+    shapes : tuple
+        The shapes to pick from; STL is not supported since it needs a source file.
+    sizeRange : tuple
+        The smallest and largest size.
+    sizeSteps : int
+        The number of distinct sizes.
+    seed : int
+        The seed of the random generator, or None for a different layout every time.
+    """
+    rng = np.random.default_rng(seed)
+    low, high = np.asarray(bounds, np.float32)
+    positions = rng.uniform(low, high, (count, 3))
+
+    # Normalized Gaussian 4-vectors are uniformly distributed rotations
+    orientations = rng.standard_normal((count, 4))
+    orientations /= np.linalg.norm(orientations, axis=1, keepdims=True)
+
+    colors = np.full((count, 4), 255, np.uint8)
+    colors[:, :3] = rng.integers(0, 256, (count, 3))
+    sizes = np.linspace(*sizeRange, sizeSteps)[rng.integers(0, sizeSteps, count)]
+    dimensions = np.repeat(sizes[:, None], 3, axis=1)
+    return SceneColumns.fromArrays([shapes[i] for i in rng.integers(0, len(shapes), count)], positions,
+                                   orientations, colors, dimensions)
+
+
+def readCsv(path):
+    """
+    Returns SceneColumns for the entities listed in a CSV file with a header row.
+    The shape, x, y and z columns are required. The optional columns are qw, qx, qy, qz for the
+    orientation, r, g, b, a for the color, width, height, depth for the dimensions (the radius of a
+    sphere is its width), name, and source for the STL file of STL entities.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        # Remember the line of each row for error messages; a quoted cell may span several lines
+        rows, lines = [], []
+        for row in reader:
+            rows.append(row)
+            lines.append(reader.line_num)
+    if not rows:
+        return SceneColumns.fromArrays([], np.zeros((0, 3)))
+    header = rows[0].keys()
+    missing = [column for column in ('shape',) + CSV_POSITION if column not in header]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} column")
+
+    def floats(columns):
+        if not all(column in header for column in columns):
+            return None
+        values = np.empty((len(rows), len(columns)), np.float32)
+        for index, row in enumerate(rows):
+            for column, name in enumerate(columns):
+                # A short row has None for the cells it is missing
+                try:
+                    values[index, column] = float(row[name])
+                except (TypeError, ValueError):
+                    raise ValueError(f"{path}:{lines[index]}: {name} is not a number: {row[name]!r}") from None
+        return values
+
+    shapes = []
+    for row, line in zip(rows, lines):
+        try:
+            shapes.append(ShapeType[(row['shape'] or '').strip().upper()])
+        except KeyError as e:
+            raise ValueError(f"{path}:{line}: unknown shape {e}") from None
+        if shapes[-1] == ShapeType.STL and not row.get('source'):
+            raise ValueError(f"{path}:{line}: STL entity has no source")
+    return SceneColumns.fromArrays(
+        shapes, floats(CSV_POSITION), floats(CSV_ORIENTATION), floats(CSV_COLOR), floats(CSV_DIMENSIONS),
+        [row['name'] or '' for row in rows] if 'name' in header else None,
+        [row['source'] or None for row in rows] if 'source' in header else None)
+
+
+def padded(dimensions):
+    # A sphere's dimensions are just its radius
+    return tuple(dimensions) + (0,) * (3 - len(dimensions))
@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+
+from PySide6.QtCore import QTimer
+from src.constants import (JOURNAL_BATCH_SIZE, JOURNAL_COMPACT_THRESHOLD,
+                           JOURNAL_FLUSH_INTERVAL_MS)
+from src.profiler import profiled, profiler
+from src.sceneFormat import isEntityRecord, iterRecords, writeScene
+
+
+def readRecords(filename):
+    # Yield the records of a journal file, stopping at a line cut short by a crash
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"Warning: ignoring incomplete journal record in {filename}")
+                return
+
+
+class SceneJournal:
+    """
+    The SceneJournal class persists the scene incrementally as an append-only journal next to a snapshot file.
+    Every create, update and delete is appended as one JSON line. Lines are buffered and written with a
+    single fsync per batch, and once the journal grows past a threshold it is folded into a new snapshot
+    on a background thread. Replaying the snapshot followed by the journal restores the scene after a crash.
+    The snapshot is streamed while it is replayed, so loading holds only the journal and the records being built.
+
+    Attributes
+    ----------
+    snapshotPath : str
+        The path of the snapshot file, in the binary .scene format or as a JSON list of entity dictionaries.
+    journalPath : str
+        The path of the active journal.
+    compactingPath : str
+        The path the active journal is moved to while it is being folded into the snapshot.
+    snapshotProvider : callable
+        A function returning the current entity dictionaries, called on the GUI thread when compacting.
+    compactThreshold : int
+        The number of journal records that triggers a compaction.
+    pending : list
+        Serialized records waiting for the next flush.
+    recordCount : int
+        The number of records in the active journal.
+    needsCompaction : bool
+        Whether the loaded files should be compacted once the scene is built, e.g. after recovering from a crash.
+    flushTimer : QTimer
+        A timer that flushes pending records at a fixed interval.
+    compactor : threading.Thread
+        The thread writing the current compaction, if any.
+
+    Methods
+    -------
+    load(importPath):
+        Reads the journal and returns a generator of the entity dictionaries of the snapshot with the journal applied.
+    replay(path, created, updates, deleted):
+        Yields the snapshot records as they are read, with the journal applied, then the entities created since.
+    recordCreate(entity):
+        Appends a record for a newly added entity.
+    recordCreates(entities, records):
+        Appends records for many added entities and writes them with a single fsync.
+    recordUpdate(entity, data):
+        Appends a record for changed entity properties.
+    recordDelete(entity):
+        Appends a record for a deleted entity.
+    flush():
+        Writes and fsyncs all pending records.
+    compact(wait):
+        Folds the journal into a new snapshot, in the background unless wait is True.
+    close():
+        Flushes the journal and writes a final snapshot.
+    """
+
+    def __init__(self, snapshotPath, snapshotProvider, compactThreshold=JOURNAL_COMPACT_THRESHOLD):
+        self.snapshotPath = snapshotPath
+        self.journalPath = snapshotPath + '.journal'
+        self.compactingPath = self.journalPath + '.compacting'
+        self.snapshotProvider = snapshotProvider
+        self.compactThreshold = compactThreshold
+        self.pending = []
+        self.recordCount = 0
+        self.needsCompaction = False
+        self.compactor = None
+        self.file = None
+
+        # Flush at a fixed interval, so one fsync covers every record written in between
+        self.flushTimer = QTimer()
+        self.flushTimer.setInterval(JOURNAL_FLUSH_INTERVAL_MS)
+        self.flushTimer.timeout.connect(self.flush)
+
+    def load(self, importPath=None):
+        # Without a snapshot, start from the file at importPath (e.g. a scene saved in an older format)
+        path = self.snapshotPath
+        if not os.path.exists(path) and importPath is not None and os.path.exists(importPath):
+            path = importPath
+            self.needsCompaction = True
+
+        # A leftover compacting journal means the app stopped before a compaction finished
+        if os.path.exists(self.compactingPath):
+            self.needsCompaction = True
+
+        # Read the journal first; it stays small, since it is folded into the snapshot once it grows.
+        # Replaying is idempotent, so records already folded into the snapshot can safely be applied again.
+        created = {}
+        updates = {}
+        deleted = set()
+        for filename in (self.compactingPath, self.journalPath):
+            for record in readRecords(filename):
+                id = record['id']
+                if record['op'] == 'create':
+                    created[id] = record['data']
+                    updates.pop(id, None)
+                    deleted.discard(id)
+                elif record['op'] == 'update':
+                    if id in created:
+                        created[id].update(record['data'])
+                    else:
+                        updates.setdefault(id, {}).update(record['data'])
+                elif record['op'] == 'delete':
+                    created.pop(id, None)
+                    updates.pop(id, None)
+                    deleted.add(id)
+                if filename == self.journalPath:
+                    self.recordCount += 1
+
+        self.file = open(self.journalPath, 'a', encoding='utf-8')
+        self.flushTimer.start()
+        return self.replay(path, created, updates, deleted)
+
+    def replay(self, path, created, updates, deleted):
+        # Stream the snapshot with the journal applied, so the whole scene is never held in memory at once
+        try:
+            for index, data in enumerate(iterRecords(path)):
+                if not isEntityRecord(data):
+                    # A record that cannot be built would also fail every snapshot it is written to
+                    print(f"Error: skipping invalid record {index} of {path}: {str(data)[:80]}. "
+                          f"Run python validate.py {path} to repair the file.")
+                    continue
+                id = data.get('id')
+                if id is None:
+                    # Old snapshots have no ids; those records cannot be targeted by the journal, so compact them
+                    self.needsCompaction = True
+                elif id in created:
+                    # Deleted and created again, e.g. by undo; keep the entity at its place in the snapshot
+                    data = created.pop(id)
+                elif id in deleted:
+                    continue
+                elif id in updates:
+                    data.update(updates[id])
+                yield data
+        except FileNotFoundError:
+            pass
+        except (EOFError, OSError, ValueError) as e:
+            # Keep the records read before the error
+            print(f"Error loading data from {path}: {e}")
+        yield from created.values()
+
+    def append(self, record):
+        self.pending.append(json.dumps(record) + '\n')
+        if len(self.pending) >= JOURNAL_BATCH_SIZE:
+            self.flush()
+
+    def recordCreate(self, entity):
+        self.append({'op': 'create', 'id': entity.id, 'data': entity.toDict()})
+
+    def recordCreates(self, entities, records):
+        # Append the whole batch before writing, instead of an early flush every JOURNAL_BATCH_SIZE records
+        self.pending.extend(json.dumps({'op': 'create', 'id': entity.id, 'data': data}) + '\n'
+                            for entity, data in zip(entities, records))
+        self.flush()
+
+    def recordUpdate(self, entity, data):
+        self.append({'op': 'update', 'id': entity.id, 'data': data})
+
+    def recordDelete(self, entity):
+        self.append({'op': 'delete', 'id': entity.id})
+
+    @profiled('SceneJournal.writePending', 'persistence')
+    def writePending(self):
+        if not self.pending or self.file is None:
+            return
+        self.file.writelines(self.pending)
+        self.file.flush()
+        with profiler.section('SceneJournal.fsync', 'persistence'):
+            os.fsync(self.file.fileno())
+        self.recordCount += len(self.pending)
+        self.pending = []
+
+    def flush(self):
+        self.writePending()
+        if self.recordCount >= self.compactThreshold:
+            self.compact()
+
+    @profiled('SceneJournal.compact', 'persistence')
+    def compact(self, wait=False):
+        if self.compactor is not None:
+            if not wait and self.compactor.is_alive():
+                # A compaction is already running; the next flush will try again
+                return
+            self.compactor.join()
+            self.compactor = None
+
+        # Collect the snapshot on the GUI thread, since it reads Qt objects
+        self.writePending()
+        records = self.snapshotProvider()
+
+        # Move the journal aside so new records go to a fresh file while the snapshot is written
+        self.file.close()
+        if os.path.exists(self.compactingPath):
+            with open(self.compactingPath, 'ab') as out, open(self.journalPath, 'rb') as journal:
+                out.write(journal.read())
+            os.remove(self.journalPath)
+        else:
+            os.replace(self.journalPath, self.compactingPath)
+        self.file = open(self.journalPath, 'a', encoding='utf-8')
+        self.recordCount = 0
+        self.needsCompaction = False
+
+        self.compactor = threading.Thread(target=self.writeCompaction, args=(records,), daemon=True)
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+            self.compactor = None
+
+    @profiled('SceneJournal.writeCompaction', 'persistence')
+    def writeCompaction(self, records):
+        try:
+            writeScene(records, self.snapshotPath)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            # Keep the compacting journal, it is replayed on the next start
+            print(f"Error writing snapshot {self.snapshotPath}: {e}")
+            return
+        os.remove(self.compactingPath)
+
+    def close(self):
+        self.flushTimer.stop()
+        if self.file is None:
+            return
+        self.compact(wait=True)
+        self.file.close()
+        self.file = None
@@ -0,0 +1,87 @@
+from PySide6.QtCore import QObject, QTimer, QElapsedTimer, Signal
+from src.constants import LOAD_SLICE_MS
+from src.profiler import profiled
+
+
+class SceneLoader(QObject):
+    """
+    The SceneLoader class builds entities from saved records in time-sliced chunks on the event loop.
+    Each slice creates entities until its time budget is spent and then yields back to the event loop,
+    so the window stays interactive while a large scene is still being materialized. Records are taken
+    from an iterator as they are built, so a scene streamed from disk is never held in memory as a whole.
+
+    Attributes
+    ----------
+    records : iterator
+        The entity dictionaries that have not been built yet.
+    factory : callable
+        A function that builds an entity from a dictionary, or returns None to skip it.
+    loading : bool
+        Whether records may still be waiting to be built.
+    timer : QTimer
+        A zero-interval timer that runs one slice per event loop iteration.
+
+    Signals
+    -------
+    entitiesLoaded(list):
+        Emitted after every slice with the entities it built.
+    finished():
+        Emitted once all records have been built.
+
+    Methods
+    -------
+    start():
+        Starts building entities.
+    remainingRecords():
+        Returns the records that have not been built yet.
+    isLoading():
+        Returns whether records are still waiting to be built.
+    loadSlice():
+        Builds entities until the slice budget is spent.
+    """
+
+    entitiesLoaded = Signal(list)
+    finished = Signal()
+
+    def __init__(self, records, factory, parent=None):
+        super().__init__(parent)
+        self.records = iter(records)
+        self.factory = factory
+        self.loading = True
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.loadSlice)
+
+    def start(self):
+        self.timer.start()
+
+    def remainingRecords(self):
+        # Reads the rest of a streamed scene into memory; only needed when the scene is saved while it loads
+        remaining = list(self.records)
+        self.records = iter(remaining)
+        return remaining
+
+    def isLoading(self):
+        return self.loading
+
+    @profiled('SceneLoader.loadSlice', 'persistence')
+    def loadSlice(self):
+        elapsed = QElapsedTimer()
+        elapsed.start()
+        entities = []
+        while elapsed.elapsed() < LOAD_SLICE_MS:
+            # The iterator advances first, so a record that raises is not retried forever
+            data = next(self.records, None)
+            if data is None:
+                self.loading = False
+                break
+            entity = self.factory(data)
+            if entity is not None:
+                entities.append(entity)
+
+        if entities:
+            self.entitiesLoaded.emit(entities)
+        if not self.loading:
+            self.timer.stop()
+            self.records = iter(())
+            self.finished.emit()
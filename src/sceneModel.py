@@ -0,0 +1,238 @@
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QSortFilterProxyModel, Qt
+
+# Item data roles for the entity and its shape name
+EntityRole = Qt.UserRole
+ShapeRole = Qt.UserRole + 1
+
+
+class SceneModel(QAbstractListModel):
+    """
+    The SceneModel class lists the entities of the scene for a QListView.
+    It keeps a dictionary from entity to row, so finding the row of an entity is O(1),
+    and inserts and removes entities in batches with one model notification per contiguous range.
+    With a ThumbnailRenderer set, rows are decorated with thumbnails, which are only requested for
+    the rows a view shows and fill in as they are rendered. Edits only mark rows whose thumbnail may have
+    changed; once per frame, the rows whose thumbnail key did change are announced, one notification per
+    contiguous range.
+
+    Attributes
+    ----------
+    entities : list
+        The entities in list order.
+    rows : dict
+        A dictionary mapping each entity to its row.
+    thumbnails : ThumbnailRenderer
+        The renderer of the row decorations, or None for no decorations.
+    thumbnailKeys : dict
+        A dictionary mapping each entity whose decoration a view asked for to the thumbnail key it last got
+        or was told about.
+    staleThumbnails : set
+        The shown entities edited since the last flush, whose thumbnail key may have changed.
+    readyThumbnails : set
+        The entities whose thumbnail was rendered since the last flush.
+
+    Methods
+    -------
+    addEntities(entities):
+        Appends entities to the end of the list.
+    removeEntities(entities):
+        Removes entities from the list.
+    indexOf(entity):
+        Returns the model index of an entity, or an invalid index.
+    entityChanged(entity):
+        Notifies views that the name of an entity changed.
+    setThumbnails(thumbnails):
+        Decorates the rows with thumbnails from a ThumbnailRenderer.
+    thumbnailChanged(entity):
+        Marks an entity whose shape, proportions or color may have changed.
+    flushThumbnails():
+        Notifies views of the rows whose thumbnail changed since the last flush.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.entities = []
+        self.rows = {}
+        self.thumbnails = None
+        self.thumbnailKeys = {}
+        self.staleThumbnails = set()
+        self.readyThumbnails = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entities)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entity = self.entities[index.row()]
+        if role == Qt.DisplayRole:
+            return entity.name
+        if role == EntityRole:
+            return entity
+        if role == ShapeRole:
+            return entity.shape.value
+        if role == Qt.DecorationRole and self.thumbnails is not None:
+            # A blank icon keeps the text in place until the thumbnail is rendered
+            key, icon = self.thumbnails.entityIcon(entity)
+            self.thumbnailKeys[entity] = key
+            return self.thumbnails.placeholder if icon is None else icon
+        return None
+
+    def addEntities(self, entities):
+        if not entities:
+            return
+        first = len(self.entities)
+        self.beginInsertRows(QModelIndex(), first, first + len(entities) - 1)
+        self.entities.extend(entities)
+        for row, entity in enumerate(entities, first):
+            self.rows[entity] = row
+        self.endInsertRows()
+
+    def removeEntities(self, entities):
+        rows = sorted(self.rows.pop(entity) for entity in entities if entity in self.rows)
+        # A removed entity has no row to render, even if it was edited earlier in the frame
+        for entity in entities:
+            self.thumbnailKeys.pop(entity, None)
+            self.staleThumbnails.discard(entity)
+            self.readyThumbnails.discard(entity)
+        if not rows:
+            return
+        # Remove contiguous ranges from the back, so the rows of earlier ranges stay valid
+        end = len(rows)
+        while end > 0:
+            start = end - 1
+            while start > 0 and rows[start - 1] == rows[start] - 1:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), rows[start], rows[end - 1])
+            del self.entities[rows[start]:rows[end - 1] + 1]
+            self.endRemoveRows()
+            end = start
+
+        # Only the rows after the first removed row moved
+        for row in range(rows[0], len(self.entities)):
+            self.rows[self.entities[row]] = row
+
+    def indexOf(self, entity):
+        row = self.rows.get(entity)
+        return QModelIndex() if row is None else self.index(row)
+
+    def entityChanged(self, entity):
+        index = self.indexOf(entity)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def setThumbnails(self, thumbnails):
+        self.thumbnails = thumbnails
+        thumbnails.thumbnailReady.connect(self.onThumbnailReady)
+
+    def thumbnailChanged(self, entity):
+        # Rows never shown are skipped; a view asks for their decoration when it shows them
+        if entity in self.thumbnailKeys:
+            self.staleThumbnails.add(entity)
+
+    def onThumbnailReady(self, icon, owners):
+        # Owners that are not entities of this model, e.g. STL files of the picker, are skipped
+        self.readyThumbnails.update(owner for owner in owners if owner in self.rows)
+
+    def flushThumbnails(self):
+        if not self.staleThumbnails and not self.readyThumbnails:
+            return
+        rows = {self.rows[entity] for entity in self.readyThumbnails if entity in self.rows}
+        # Edits that leave the thumbnail as it was, e.g. of a position or undone, are not announced
+        for entity in self.staleThumbnails:
+            row = self.rows.get(entity)
+            if row is None or entity.row is None:
+                continue
+            key = self.thumbnails.entityKey(entity)
+            if key != self.thumbnailKeys.get(entity):
+                self.thumbnailKeys[entity] = key
+                rows.add(row)
+        self.staleThumbnails.clear()
+        self.readyThumbnails.clear()
+
+        # The view asks for the decorations of the rows it shows again, which requests the new thumbnails
+        rows = sorted(rows)
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end == len(rows) or rows[end] != rows[end - 1] + 1:
+                self.dataChanged.emit(self.index(rows[start]), self.index(rows[end - 1]), [Qt.DecorationRole])
+                start = end
+
+
+class SceneFilterModel(QSortFilterProxyModel):
+    """
+    The SceneFilterModel class filters the scene model by a search text matched against entity names
+    and by shape. When a filter changes, whether each row matches is computed in one pass over the
+    source entities, so filterAcceptsRow only looks the answer up; rows are accepted without being
+    looked at while neither filter is set.
+
+    Attributes
+    ----------
+    searchText : str
+        The lower-case text entity names must contain, or an empty string.
+    shape : str
+        The shape name entities must have, or None for every shape.
+    accepted : list
+        Whether each source row matches the filters, or None while no filter is set.
+
+    Methods
+    -------
+    setSearchText(text):
+        Filters by a case-insensitive part of the name.
+    setShape(shape):
+        Filters by shape name, or stops filtering by shape for None.
+    updateFilter():
+        Recomputes which rows match and refilters the view.
+    filterAcceptsRow(sourceRow, sourceParent):
+        Looks up whether a source row matches.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.searchText = ''
+        self.shape = None
+        self.accepted = None
+
+    def setSourceModel(self, model):
+        # Keep the matches in step with the source rows; connected first, so they update before the proxy refilters
+        model.rowsRemoved.connect(self.onRowsRemoved)
+        model.dataChanged.connect(self.onDataChanged)
+        super().setSourceModel(model)
+
+    def setSearchText(self, text):
+        self.searchText = text.lower()
+        self.updateFilter()
+
+    def setShape(self, shape):
+        self.shape = shape
+        self.updateFilter()
+
+    def matches(self, entities):
+        text, shape = self.searchText, self.shape
+        return [(shape is None or entity.shape.value == shape) and text in entity.name.lower()
+                for entity in entities]
+
+    def updateFilter(self):
+        if not self.searchText and self.shape is None:
+            self.accepted = None
+        else:
+            self.accepted = self.matches(self.sourceModel().entities)
+        self.invalidateFilter()
+
+    def onRowsRemoved(self, parent, first, last):
+        if self.accepted is not None:
+            del self.accepted[first:last + 1]
+
+    def onDataChanged(self, topLeft, bottomRight, roles=()):
+        # Thumbnails do not change whether a row matches
+        if self.accepted is not None and list(roles) != [Qt.DecorationRole]:
+            first, last = topLeft.row(), bottomRight.row()
+            self.accepted[first:last + 1] = self.matches(self.sourceModel().entities[first:last + 1])
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        if self.accepted is None:
+            return True
+        if sourceRow >= len(self.accepted):
+            # Rows appended since the filter was set
+            self.accepted.extend(self.matches(self.sourceModel().entities[len(self.accepted):]))
+        return self.accepted[sourceRow]
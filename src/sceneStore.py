@@ -0,0 +1,427 @@
+import numpy as np
+
+from src.constants import ShapeType
+from src.profiler import profiled
+
+# Flags marking which parts of a row still have to be pushed to its Qt objects
+DIRTY_TRANSFORM = 1
+DIRTY_COLOR = 2
+
+# Shapes are stored by index into this tuple
+SHAPES = tuple(ShapeType)
+
+
+def quaternionsToMatrices(rotations):
+    """ Converts a (N, 4) array of (w, x, y, z) quaternions into a (N, 3, 3) array of rotation matrices. """
+    norms = np.linalg.norm(rotations, axis=1, keepdims=True)
+    w, x, y, z = (rotations / np.where(norms > 0, norms, 1)).T
+    return np.stack((
+        np.stack((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)), axis=-1),
+        np.stack((2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)), axis=-1),
+        np.stack((2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)), axis=-1),
+    ), axis=1)
+
+
+def multiplyQuaternions(a, b):
+    """ Returns the (N, 4) products a * b of two (N, 4) arrays of (w, x, y, z) quaternions, b applied first. """
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b.T
+    return np.stack((aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw), axis=-1)
+
+
+def rotateVectors(rotations, vectors):
+    """ Rotates each row of a (N, 3) array by the matching (w, x, y, z) quaternion of a (N, 4) array. """
+    return np.einsum('nij,nj->ni', quaternionsToMatrices(rotations), vectors)
+
+
+class SceneStore:
+    """
+    The SceneStore class holds the authoritative state of every entity as NumPy arrays, one row per entity.
+    Entity3D objects are thin views onto a row. Writes only update the arrays and set a dirty flag;
+    flush() pushes the dirty rows to their Qt objects once per frame, so bulk edits, serialization
+    and spatial queries run as array operations instead of per-entity Qt getter and setter calls.
+    A row may have a parent row; its translation and rotation are then relative to the parent's world
+    position and rotation (the parent's scale is not inherited). World transforms are cached and only
+    recomputed for the subtrees of rows moved since, one vectorized pass per hierarchy level, so moving
+    a parent is one write however many descendants it has.
+
+    Attributes
+    ----------
+    count : int
+        The number of rows in use.
+    structureVersion : int
+        Incremented whenever a row is added or removed.
+    transformVersion : int
+        Incremented whenever a transform or mesh bounds change.
+    hierarchyVersion : int
+        Incremented whenever a row's parent changes.
+    translation : numpy.ndarray
+        A (capacity, 3) float32 array of positions, relative to the parent.
+    rotation : numpy.ndarray
+        A (capacity, 4) float32 array of (w, x, y, z) rotation quaternions, relative to the parent.
+    scale : numpy.ndarray
+        A (capacity, 3) float32 array of scale factors.
+    color : numpy.ndarray
+        A (capacity, 4) uint8 array of RGBA colors.
+    shape : numpy.ndarray
+        A (capacity,) uint8 array of indices into SHAPES.
+    dimensions : numpy.ndarray
+        A (capacity, 3) float32 array of dimensions as shown in the edit window.
+    localMin, localMax : numpy.ndarray
+        (capacity, 3) float32 arrays with the unscaled bounding box of each row's mesh.
+    dirty : numpy.ndarray
+        A (capacity,) uint8 array of dirty flags.
+    visible : numpy.ndarray
+        A (capacity,) bool array, False for rows culled because they are outside the view.
+    lod : numpy.ndarray
+        A (capacity,) uint8 array with the level of detail each row is drawn with.
+    moved : numpy.ndarray
+        A (capacity,) bool array of rows added or moved since the spatial hash last read them.
+    parent : numpy.ndarray
+        A (capacity,) int32 array with the row of each row's parent, or -1.
+    children : numpy.ndarray
+        A (capacity,) int32 array with the number of rows whose parent is each row.
+    worldTranslation, worldRotation : numpy.ndarray
+        (capacity, 3) and (capacity, 4) float32 arrays caching the world position and rotation of each row.
+    worldDirty : numpy.ndarray
+        A (capacity,) bool array of rows whose cached world transform, and their descendants', is stale.
+    frozen : numpy.ndarray
+        A (capacity,) bool array of rows drawn by a static batch instead of Qt objects of their own.
+    views : list
+        The Entity3D viewing each row.
+    names : list
+        The name of each row.
+    nameRows : dict
+        A dictionary mapping each name to the set of rows with that name.
+
+    Methods
+    -------
+    allocate(view):
+        Appends a row for an entity and returns its index.
+    release(row):
+        Removes a row by moving the last row into its place; its children become roots where they are.
+    readRow(row):
+        Returns a copy of every column of a row.
+    writeRow(row, state):
+        Restores a row from a copy made by readRow.
+    setName(row, name):
+        Renames a row, keeping nameRows in step.
+    markDirty(rows, flags):
+        Flags rows whose Qt objects are out of date.
+    flush():
+        Pushes all dirty rows to their Qt objects.
+    translate(rows, offset):
+        Moves the given rows by an offset.
+    setParent(row, parent):
+        Makes a row the child of another row, or of none with -1.
+    reparent(rows, parent):
+        Makes rows the children of another row, or of none with -1, without moving them in world space.
+    subtree(row):
+        Returns a row and its descendants, parents before their children.
+    levels():
+        Returns the rows at each depth of the hierarchy below the roots.
+    updateWorld():
+        Recomputes the cached world transforms of the moved rows and their descendants.
+    worldTransforms(rows):
+        Returns the world matrices of the given rows.
+    worldBounds(rows):
+        Returns the world-space bounding boxes of the given rows.
+    toDicts(rows):
+        Serializes the given rows to entity dictionaries.
+    """
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.structureVersion = 0
+        self.transformVersion = 0
+        self.hierarchyVersion = 0
+        self.levelsKey = None
+        self.levelRows = []
+        self.views = []
+        self.names = []
+        self.nameRows = {}
+        self.allocateArrays(capacity)
+
+    def allocateArrays(self, capacity):
+        self.translation = np.zeros((capacity, 3), np.float32)
+        self.rotation = np.zeros((capacity, 4), np.float32)
+        self.rotation[:, 0] = 1
+        self.scale = np.ones((capacity, 3), np.float32)
+        self.color = np.zeros((capacity, 4), np.uint8)
+        self.shape = np.zeros(capacity, np.uint8)
+        self.dimensions = np.zeros((capacity, 3), np.float32)
+        self.localMin = np.zeros((capacity, 3), np.float32)
+        self.localMax = np.zeros((capacity, 3), np.float32)
+        self.dirty = np.zeros(capacity, np.uint8)
+        self.visible = np.ones(capacity, bool)
+        self.lod = np.zeros(capacity, np.uint8)
+        self.moved = np.zeros(capacity, bool)
+        self.parent = np.full(capacity, -1, np.int32)
+        self.children = np.zeros(capacity, np.int32)
+        self.worldTranslation = np.zeros((capacity, 3), np.float32)
+        self.worldRotation = np.zeros((capacity, 4), np.float32)
+        self.worldRotation[:, 0] = 1
+        self.worldDirty = np.zeros(capacity, bool)
+        self.frozen = np.zeros(capacity, bool)
+
+    def columns(self):
+        return ('translation', 'rotation', 'scale', 'color', 'shape', 'dimensions', 'localMin', 'localMax',
+                'dirty', 'visible', 'lod', 'moved', 'parent', 'children', 'worldTranslation', 'worldRotation',
+                'worldDirty', 'frozen')
+
+    def grow(self):
+        # Double the capacity, so appending stays amortized O(1)
+        old = {name: getattr(self, name) for name in self.columns()}
+        self.allocateArrays(2 * len(self.dirty))
+        for name, array in old.items():
+            getattr(self, name)[:len(array)] = array
+
+    def allocate(self, view):
+        if self.count == len(self.dirty):
+            self.grow()
+        row = self.count
+        self.count += 1
+        self.structureVersion += 1
+        self.views.append(view)
+        self.names.append('')
+        self.nameRows.setdefault('', set()).add(row)
+        # Reset the row, since it may hold the values of a released entity
+        self.translation[row] = 0
+        self.rotation[row] = (1, 0, 0, 0)
+        self.scale[row] = 1
+        self.color[row] = 0
+        self.dirty[row] = 0
+        self.visible[row] = True
+        self.lod[row] = 0
+        self.moved[row] = True
+        self.parent[row] = -1
+        self.children[row] = 0
+        self.worldDirty[row] = True
+        self.frozen[row] = False
+        return row
+
+    def release(self, row):
+        # Children of a released row become roots where they are, since the row's slot is about to be reused.
+        # Deleting a parent from the UI releases its children first; this covers any other caller.
+        if self.children[row]:
+            self.reparent(np.flatnonzero(self.parent[:self.count] == row), -1)
+        if self.parent[row] >= 0:
+            self.children[self.parent[row]] -= 1
+            self.parent[row] = -1
+            self.hierarchyVersion += 1
+
+        # Move the last row into the hole, so removal is O(1) and rows stay contiguous
+        last = self.count - 1
+        self.unindexName(row)
+        if row != last:
+            for name in self.columns():
+                array = getattr(self, name)
+                array[row] = array[last]
+            self.views[row] = self.views[last]
+            self.unindexName(last)
+            self.names[row] = self.names[last]
+            self.nameRows.setdefault(self.names[row], set()).add(row)
+            self.views[row].row = row
+            self.moved[row] = True
+            if self.children[row]:
+                self.parent[:self.count][self.parent[:self.count] == last] = row
+        self.views.pop()
+        self.names.pop()
+        self.count -= 1
+        self.structureVersion += 1
+
+    def unindexName(self, row):
+        rows = self.nameRows[self.names[row]]
+        rows.discard(row)
+        if not rows:
+            del self.nameRows[self.names[row]]
+
+    def setName(self, row, name):
+        self.unindexName(row)
+        self.names[row] = name
+        self.nameRows.setdefault(name, set()).add(row)
+
+    def readRow(self, row):
+        state = {name: getattr(self, name)[row].copy() for name in self.columns()}
+        state['name'] = self.names[row]
+        return state
+
+    def writeRow(self, row, state):
+        for name in self.columns():
+            getattr(self, name)[row] = state[name]
+        self.setName(row, state['name'])
+        # Rows are renumbered while a row is out of the store, so its links are made again with setParent.
+        # A detached entity has left its static batch, so it comes back drawn on its own.
+        self.parent[row] = -1
+        self.children[row] = 0
+        self.worldDirty[row] = True
+        self.frozen[row] = False
+
+    def markDirty(self, rows, flags):
+        self.dirty[rows] |= flags
+        if flags & DIRTY_TRANSFORM:
+            self.moved[rows] = True
+            self.worldDirty[rows] = True
+            self.transformVersion += 1
+
+    @profiled('SceneStore.flush', 'frame')
+    def flush(self):
+        # Moving a parent marks its descendants dirty too
+        self.updateWorld()
+        rows = np.flatnonzero(self.dirty[:self.count])
+        if len(rows) == 0:
+            return
+        # Read the rows with one tolist per column instead of indexing NumPy scalars row by row
+        flags = self.dirty[rows].tolist()
+        translations = self.worldTranslation[rows].tolist()
+        rotations = self.worldRotation[rows].tolist()
+        scales = self.scale[rows].tolist()
+        colors = self.color[rows].tolist()
+        for index, row in enumerate(rows.tolist()):
+            self.views[row].pushToQt(flags[index], translations[index], rotations[index],
+                                     scales[index], colors[index])
+        self.dirty[rows] = 0
+
+    def translate(self, rows, offset):
+        self.translation[rows] += np.asarray(offset, np.float32)
+        self.markDirty(rows, DIRTY_TRANSFORM)
+
+    def setParent(self, row, parent):
+        old = self.parent[row]
+        if old == parent:
+            return
+        if old >= 0:
+            self.children[old] -= 1
+        if parent >= 0:
+            self.children[parent] += 1
+        self.parent[row] = parent
+        self.hierarchyVersion += 1
+        self.markDirty(row, DIRTY_TRANSFORM)
+
+    def reparent(self, rows, parent):
+        self.updateWorld()
+        rows = np.atleast_1d(rows)
+        translation = self.worldTranslation[rows]
+        rotation = self.worldRotation[rows]
+        if parent >= 0:
+            # The inverse of the parent's rotation, which need not be a unit quaternion
+            inverse = self.worldRotation[parent] * np.array((1, -1, -1, -1), np.float32)
+            inverse = np.tile(inverse / np.dot(inverse, inverse), (len(rows), 1))
+            translation = rotateVectors(inverse, translation - self.worldTranslation[parent])
+            rotation = multiplyQuaternions(inverse, rotation)
+        self.translation[rows] = translation
+        self.rotation[rows] = rotation
+        for row in rows.tolist():
+            self.setParent(row, parent)
+
+    def subtree(self, row):
+        # Walk down one level at a time; most rows have no children and return at once
+        parts = [np.array([row], np.intp)]
+        while self.children[parts[-1]].any():
+            parts.append(np.flatnonzero(np.isin(self.parent[:self.count], parts[-1])))
+        return np.concatenate(parts)
+
+    def levels(self):
+        # Cached until a row is added, removed or reparented
+        key = (self.structureVersion, self.hierarchyVersion)
+        if self.levelsKey == key:
+            return self.levelRows
+        parent = self.parent[:self.count]
+        levelRows = []
+        remaining = np.flatnonzero(parent >= 0)
+        current = parent < 0
+        while len(remaining):
+            inLevel = current[parent[remaining]]
+            if not inLevel.any():
+                # A cycle; setParent callers refuse to make one, so this only guards against a corrupt store
+                break
+            levelRows.append(remaining[inLevel])
+            current = np.zeros(len(parent), bool)
+            current[levelRows[-1]] = True
+            remaining = remaining[~inLevel]
+        self.levelsKey = key
+        self.levelRows = levelRows
+        return levelRows
+
+    @profiled('SceneStore.updateWorld', 'scene')
+    def updateWorld(self):
+        stale = self.worldDirty[:self.count]
+        if not stale.any():
+            return
+        levels = self.levels()
+        # A row is stale if any of its ancestors is; levels go from the roots down
+        for rows in levels:
+            stale[rows] |= stale[self.parent[rows]]
+        rows = np.flatnonzero(stale)
+        self.worldTranslation[rows] = self.translation[rows]
+        self.worldRotation[rows] = self.rotation[rows]
+        for level in levels:
+            level = level[stale[level]]
+            if len(level) == 0:
+                continue
+            parents = self.parent[level]
+            self.worldTranslation[level] = (rotateVectors(self.worldRotation[parents], self.translation[level])
+                                            + self.worldTranslation[parents])
+            self.worldRotation[level] = multiplyQuaternions(self.worldRotation[parents], self.rotation[level])
+        # The descendants moved with their ancestors, so they are pushed to Qt and the spatial hash too
+        self.dirty[rows] |= DIRTY_TRANSFORM
+        self.moved[rows] = True
+        stale[:] = False
+
+    def worldTransforms(self, rows=None):
+        self.updateWorld()
+        if rows is None:
+            rows = slice(0, self.count)
+        matrices = quaternionsToMatrices(self.worldRotation[rows]) * self.scale[rows][:, None, :]
+        transforms = np.zeros((len(matrices), 4, 4), np.float32)
+        transforms[:, :3, :3] = matrices
+        transforms[:, :3, 3] = self.worldTranslation[rows]
+        transforms[:, 3, 3] = 1
+        return transforms
+
+    def worldBounds(self, rows=None):
+        transforms = self.worldTransforms(rows)
+        if rows is None:
+            rows = slice(0, self.count)
+        # Transform each local box as center and half extent; the absolute matrix bounds the extent
+        center = (self.localMin[rows] + self.localMax[rows]) * 0.5
+        extent = (self.localMax[rows] - self.localMin[rows]) * 0.5
+        matrices = transforms[:, :3, :3]
+        worldCenter = np.einsum('nij,nj->ni', matrices, center) + transforms[:, :3, 3]
+        worldExtent = np.einsum('nij,nj->ni', np.abs(matrices), extent)
+        return worldCenter - worldExtent, worldCenter + worldExtent
+
+    def toDicts(self, rows=None):
+        if rows is None:
+            rows = np.arange(self.count)
+        rows = np.asarray(rows, np.intp)
+        names = [self.names[row] for row in rows.tolist()]
+        records = []
+        for row, name, color, position, orientation, dimensions, shapeIndex, parent in zip(
+                rows.tolist(), names, self.color[rows].tolist(), self.translation[rows].tolist(),
+                self.rotation[rows].tolist(), self.dimensions[rows].tolist(), self.shape[rows].tolist(),
+                self.parent[rows].tolist()):
+            shape = SHAPES[shapeIndex]
+            data = {
+                'id': self.views[row].id,
+                'name': name,
+                'color': tuple(color),
+                'position': tuple(position),
+                'orientation': tuple(orientation),
+                'dimensions': tuple(dimensions[:1] if shape == ShapeType.SPHERE else dimensions),
+                'shape': shape.value,
+            }
+            if parent >= 0:
+                # Positions and orientations are relative to the parent, which is saved by id
+                data['parent'] = self.views[parent].id
+            if shape == ShapeType.STL:
+                # Save the source file of the STL mesh and, once it is imported, its hash in the asset store
+                mesh = self.views[row].mesh
+                data['source'] = mesh.source().toLocalFile()
+                if mesh.asset is not None:
+                    data['asset'] = mesh.asset
+            records.append(data)
+        return records
@@ -0,0 +1,324 @@
+import math
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.constants import (ASSET_DIR, DEFAULT_COLOR, DEFAULT_DIMENSIONS, QUATERNION_TOLERANCE, VALIDATE_CHUNK_SIZE,
+                           ShapeType)
+from src.sceneFormat import iterScene, writeSceneChunks
+from src.stlLoader import buildMesh, parseTriangles, readCache, validateTriangles, weldPositions
+
+# This module runs in worker processes, so it must not import Qt
+
+# What happened to a record with an issue
+WARNING = 'warning'  # Reported only
+REPAIRED = 'repaired'  # Fixed in the repaired scene
+DROPPED = 'dropped'  # Left out of the repaired scene
+
+# Triangles smaller than this fraction of the squared mesh diagonal are degenerate
+DEGENERATE_AREA = 1e-12
+
+
+def finiteVector(value, length):
+    # Returns value as a tuple of floats if it is a sequence of `length` finite numbers, otherwise None
+    if not isinstance(value, (list, tuple)) or len(value) != length:
+        return None
+    try:
+        vector = tuple(float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    return vector if all(math.isfinite(v) for v in vector) else None
+
+
+def validateRecord(data):
+    """
+    Checks one entity dictionary on its own and returns the repaired dictionary, or None if it cannot be
+    repaired, and a list of (check, action, message) issues. Checks that need the whole scene, such as
+    duplicate names and STL readability, are left to the SceneValidator.
+    """
+    if not isinstance(data, dict):
+        return None, [('record', DROPPED, f"Record is a {type(data).__name__}, not an object")]
+    try:
+        shape = ShapeType[data['shape'].upper()]
+    except (KeyError, AttributeError):
+        return None, [('shape', DROPPED, f"Unknown shape {data.get('shape')!r}")]
+
+    issues = []
+    repaired = dict(data)
+    if not isinstance(data.get('name'), str) or not data['name']:
+        repaired['name'] = shape.value
+        issues.append(('name', REPAIRED, f"Name {data.get('name')!r} is not a string; renamed to {shape.value!r}"))
+    if 'id' in data and (not isinstance(data['id'], str) or not data['id']):
+        # The entity gets a new id when it is loaded
+        del repaired['id']
+        issues.append(('id', REPAIRED, f"Id {data['id']!r} is not a string; removed"))
+
+    position = finiteVector(data.get('position'), 3)
+    if position is None:
+        repaired['position'] = (0.0, 0.0, 0.0)
+        issues.append(('position', REPAIRED, f"Position {data.get('position')!r} is not 3 finite numbers; "
+                                             f"reset to the origin"))
+
+    orientation = finiteVector(data.get('orientation'), 4)
+    norm = math.sqrt(sum(v * v for v in orientation)) if orientation is not None else 0
+    if norm == 0:
+        repaired['orientation'] = (1.0, 0.0, 0.0, 0.0)
+        issues.append(('orientation', REPAIRED, f"Orientation {data.get('orientation')!r} is not a rotation "
+                                                f"quaternion; reset to the identity"))
+    elif abs(norm - 1) > QUATERNION_TOLERANCE:
+        repaired['orientation'] = tuple(v / norm for v in orientation)
+        issues.append(('orientation', REPAIRED, f"Orientation quaternion has norm {norm:.6g}; normalized"))
+
+    if 'dimensions' in data:
+        default = DEFAULT_DIMENSIONS[shape]
+        dimensions = finiteVector(data['dimensions'], len(default))
+        if dimensions is None or min(dimensions) <= 0:
+            repaired['dimensions'] = default
+            issues.append(('dimensions', REPAIRED, f"Dimensions {data['dimensions']!r} are not {len(default)} "
+                                                   f"positive finite numbers; reset to {default}"))
+
+    color = finiteVector(data.get('color'), 4)
+    if color is None:
+        repaired['color'] = DEFAULT_COLOR
+        issues.append(('color', REPAIRED, f"Color {data.get('color')!r} is not 4 numbers; reset to the default"))
+    else:
+        clamped = tuple(min(max(int(round(v)), 0), 255) for v in color)
+        if clamped != tuple(data['color']):
+            repaired['color'] = clamped
+            issues.append(('color', REPAIRED, f"Color {tuple(data['color'])} is not 4 integers from 0 to 255; "
+                                              f"clamped to {clamped}"))
+
+    # Whether the parent is in the scene is checked when the scene loads; parents may come after their children
+    parent = data.get('parent')
+    if parent is not None and (not isinstance(parent, str) or not parent or parent == data.get('id')):
+        del repaired['parent']
+        issues.append(('parent', REPAIRED, f"Parent {parent!r} is not the id of another entity; removed"))
+
+    if shape == ShapeType.STL:
+        source, asset = data.get('source'), data.get('asset')
+        if not isinstance(source, str):
+            source = None
+        if not isinstance(asset, str):
+            asset = None
+        if source is None and asset is None:
+            return None, issues + [('source', DROPPED, "STL entity has neither a source file nor an asset")]
+    return repaired, issues
+
+
+def validateChunk(records):
+    """ Validates a list of entity dictionaries in a worker process; returns a (data, issues) pair per record. """
+    return [validateRecord(data) for data in records]
+
+
+def stlKey(data):
+    # The (source, asset) pair identifying the mesh of a valid STL record, checked once per scene
+    source, asset = data.get('source'), data.get('asset')
+    return (source if isinstance(source, str) else None, asset if isinstance(asset, str) else None)
+
+
+def meshDefects(mesh):
+    """ Returns the triangle count and the degenerate triangles, open edges and non-manifold edges of a mesh. """
+    # Vertices split along hard edges are welded, so the faces on both sides share the edge
+    positions, welded = weldPositions(mesh.positions())
+    faces = welded[np.asarray(mesh.indices, np.int64)].reshape(-1, 3)
+    positions = positions.astype(np.float64)
+    corners = positions[faces]
+    areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1) / 2
+    diagonal = np.linalg.norm(positions.max(axis=0) - positions.min(axis=0))
+    degenerate = areas <= DEGENERATE_AREA * diagonal ** 2
+
+    # Count the triangles on each undirected edge; a closed manifold mesh has exactly two everywhere.
+    # Edges of triangles collapsed to a line or point are left out, since they are reported as degenerate.
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.sort(edges[edges[:, 0] != edges[:, 1]], axis=1)
+    _, counts = np.unique(edges[:, 0] * len(positions) + edges[:, 1], return_counts=True)
+    return {'triangles': len(faces), 'degenerateTriangles': int(degenerate.sum()),
+            'openEdges': int((counts == 1).sum()), 'nonManifoldEdges': int((counts > 2).sum())}
+
+
+def checkStl(source, asset, assetDir):
+    """
+    Reads an STL file in a worker process and returns its defects, or {'error': message} if it cannot be read.
+    Like the application, a file that is missing is replaced by its stored asset.
+    """
+    try:
+        if source is not None and os.path.exists(source):
+            with open(source, 'rb') as f:
+                triangles = parseTriangles(f.read())
+            validateTriangles(triangles)
+            result = meshDefects(buildMesh(triangles))
+        else:
+            mesh = readCache(assetDir, asset) if asset is not None else None
+            if mesh is None:
+                stored = f" and asset {asset} is not stored" if asset is not None else ""
+                raise FileNotFoundError(f"STL file {source} does not exist{stored}")
+            result = meshDefects(mesh)
+            result['fromAsset'] = True
+    except (OSError, ValueError) as e:
+        return {'error': str(e)}
+    return result
+
+
+class SceneValidator:
+    """
+    The SceneValidator class checks a scene file and writes a repaired copy without starting the GUI.
+    The file is streamed in chunks of records that are validated in parallel by a pool of worker processes,
+    which also read every STL file referred to once, to find unreadable files, degenerate triangles and open
+    or non-manifold edges. The main process keeps the records in file order and applies the checks that need
+    the whole scene: duplicate names and ids, and records whose STL file cannot be read. Only a few chunks per
+    worker are in flight at a time, so memory stays bounded however large the scene is.
+
+    Attributes
+    ----------
+    jobs : int
+        The number of worker processes.
+    chunkSize : int
+        The number of records validated per task.
+    assetDir : str
+        The asset directory that STL files missing from their path are looked up in.
+    names, ids : set
+        The names and ids of the records kept so far.
+    meshes : dict
+        A dictionary mapping the (source, asset) of every STL mesh to the future of its check, then its result.
+    meshRecords : Counter
+        The number of records using each STL mesh.
+    issues : list
+        The issues found, as dictionaries with the record index, id, name, check, action and message.
+    counts : Counter
+        The number of issues per (check, action).
+    records, written : int
+        The number of records read and written.
+    error : str
+        The reason the file could not be read to its end, or None.
+
+    Methods
+    -------
+    run(inputPath, outputPath):
+        Validates a scene file, writes the repaired scene and returns the report.
+    repairedChunks(inputPath, pool):
+        Yields the repaired records of each chunk of the file in order.
+    finishChunk(start, results):
+        Applies the whole-scene checks to the results of a validated chunk and returns the records to keep.
+    uniqueName(name):
+        Returns the name, or the name with the lowest free numeric suffix if it is taken.
+    addIssue(index, data, check, action, message):
+        Records an issue.
+    report():
+        Returns the issue counts, issues and STL mesh checks.
+    """
+
+    def __init__(self, jobs=None, chunkSize=VALIDATE_CHUNK_SIZE, assetDir=ASSET_DIR):
+        self.jobs = jobs or os.cpu_count()
+        self.chunkSize = chunkSize
+        self.assetDir = assetDir
+        self.names = set()
+        self.ids = set()
+        self.meshes = {}
+        self.meshRecords = Counter()
+        self.issues = []
+        self.counts = Counter()
+        self.records = 0
+        self.written = 0
+        self.error = None
+
+    def run(self, inputPath, outputPath):
+        # Raises OSError if the input cannot be opened or the output cannot be written
+        with ProcessPoolExecutor(self.jobs) as pool:
+            writeSceneChunks(self.repairedChunks(inputPath, pool), outputPath)
+        self.meshes = {key: future.result() for key, future in self.meshes.items()}
+        return self.report()
+
+    def repairedChunks(self, inputPath, pool):
+        pending = deque()
+        chunks = iterScene(inputPath, self.chunkSize)
+        while True:
+            try:
+                chunk = next(chunks, None)
+            except (EOFError, ValueError) as e:
+                # Keep the records before the point where the file is broken, e.g. after a crash mid-write
+                self.error = str(e)
+                chunk = None
+            if chunk is None:
+                break
+            # Read every STL mesh once, as soon as the first record using it is seen
+            for data in chunk:
+                if isinstance(data, dict) and str(data.get('shape')).upper() == ShapeType.STL.name:
+                    key = stlKey(data)
+                    if key != (None, None) and key not in self.meshes:
+                        self.meshes[key] = pool.submit(checkStl, *key, self.assetDir)
+            pending.append((self.records, pool.submit(validateChunk, chunk)))
+            self.records += len(chunk)
+            if len(pending) > 2 * self.jobs:
+                start, future = pending.popleft()
+                yield self.finishChunk(start, future.result())
+        while pending:
+            start, future = pending.popleft()
+            yield self.finishChunk(start, future.result())
+
+    def finishChunk(self, start, results):
+        kept = []
+        for index, (data, issues) in enumerate(results, start):
+            for check, action, message in issues:
+                self.addIssue(index, data, check, action, message)
+            if data is None:
+                continue
+
+            if data['shape'].upper() == ShapeType.STL.name:
+                key = stlKey(data)
+                mesh = self.meshes[key].result()
+                if 'error' in mesh:
+                    self.addIssue(index, data, 'stl', DROPPED, f"Could not read STL file: {mesh['error']}")
+                    continue
+                if mesh.get('fromAsset'):
+                    self.addIssue(index, data, 'source', WARNING, f"STL file {key[0]} does not exist; "
+                                                                  f"its stored asset is used")
+                self.meshRecords[key] += 1
+
+            if data.get('id') in self.ids:
+                self.addIssue(index, data, 'duplicateId', REPAIRED, f"Id {data['id']} is used by an earlier "
+                                                                    f"record; removed")
+                data = dict(data)
+                del data['id']
+            elif 'id' in data:
+                self.ids.add(data['id'])
+            name = self.uniqueName(data['name'])
+            if name != data['name']:
+                self.addIssue(index, data, 'duplicateName', REPAIRED, f"Name is used by an earlier record; "
+                                                                      f"renamed to {name!r}")
+                data = dict(data, name=name)
+            self.names.add(name)
+            kept.append(data)
+        self.written += len(kept)
+        return kept
+
+    def uniqueName(self, name):
+        if name not in self.names:
+            return name
+        suffix = 2
+        while f"{name} ({suffix})" in self.names:
+            suffix += 1
+        return f"{name} ({suffix})"
+
+    def addIssue(self, index, data, check, action, message):
+        issue = {'record': index, 'check': check, 'action': action, 'message': message}
+        if isinstance(data, dict):
+            for key in ('id', 'name'):
+                if isinstance(data.get(key), str):
+                    issue[key] = data[key]
+        self.issues.append(issue)
+        self.counts[check, action] += 1
+
+    def report(self):
+        meshes = []
+        for (source, asset), result in self.meshes.items():
+            meshes.append(dict(result, source=source, asset=asset, records=self.meshRecords[source, asset]))
+        return {
+            'records': self.records,
+            'written': self.written,
+            'error': self.error,
+            'counts': {f"{check}/{action}": count for (check, action), count in sorted(self.counts.items())},
+            'meshes': meshes,
+            'issues': self.issues,
+        }
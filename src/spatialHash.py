@@ -0,0 +1,343 @@
+import numpy as np
+
+from src.profiler import profiled
+
+# Cell coordinates are clamped to 21 bits per axis and packed into one int64 key
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+# Cell edge as a multiple of the median entity size
+CELL_FACTOR = 2
+
+# Entities spanning more cells than this along an axis are kept in a list that every query tests
+MAX_CELL_SPAN = 4
+
+# Queries covering more cells than this test the bounds of every entity instead
+MAX_QUERY_CELLS = 4096
+
+# Moved entities are inserted into an overlay; the cells are rebuilt once the overlay holds this
+# many entities or this fraction of the scene, whichever is larger
+REBUILD_MIN_ROWS = 1024
+REBUILD_FRACTION = 0.25
+
+# Boxes closer than this are touching, not overlapping
+CONTACT_EPSILON = 1e-5
+
+
+def packKeys(cells):
+    """ Packs a (N, 3) array of integer cell coordinates into (N,) int64 keys. """
+    cells = np.asarray(cells, np.int64) + KEY_OFFSET
+    return (cells[:, 0] << (2 * KEY_BITS)) | (cells[:, 1] << KEY_BITS) | cells[:, 2]
+
+
+def keysInRange(low, high):
+    """ Returns the keys of every cell from the low to the high cell coordinates, inclusive. """
+    axes = [np.arange(start, stop + 1) for start, stop in zip(low, high)]
+    return packKeys(np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3))
+
+
+def boxDistances(point, mins, maxs):
+    """ Returns the distance from a point to each box, 0 for the boxes containing it. """
+    return np.linalg.norm(np.maximum(np.maximum(mins - point, point - maxs), 0), axis=1)
+
+
+def ringOffsets(rings):
+    """ Yields (i, j) grid offsets ring by ring around (0, 0), the closest first within each ring. """
+    yield 0, 0
+    for ring in range(1, rings + 1):
+        offsets = [(i, j) for i in range(-ring, ring + 1) for j in range(-ring, ring + 1)
+                   if max(abs(i), abs(j)) == ring]
+        yield from sorted(offsets, key=lambda offset: offset[0] ** 2 + offset[1] ** 2)
+
+
+class SpatialHash:
+    """
+    The SpatialHash class indexes the world-space bounds of every store row in a uniform grid of cells,
+    for box, radius and nearest-neighbor queries whose cost depends on the entities near the query,
+    not on the size of the scene.
+    The cells are built in one vectorized pass as a sorted array of (cell, row) entries. Rows the store
+    flags as moved are marked stale there and inserted into a small overlay of cells instead, lazily on
+    the next query, so dragging an entity updates a few cells per frame. The cells are rebuilt once the
+    overlay grows large. Placement and dragging use it to keep entities from overlapping; a row never
+    collides with its own descendants, which move with it.
+
+    Attributes
+    ----------
+    store : SceneStore
+        The store holding the entity transforms and bounds.
+    cellSize : float
+        The edge of a cell, chosen from the median entity size when the cells are built.
+    cells : dict
+        The (start, stop) range of entries of every occupied cell, keyed by the packed cell coordinates.
+    entries : numpy.ndarray
+        The rows in each cell, sorted by cell.
+    stale : numpy.ndarray
+        A bool array, True for rows that moved since the cells were built; their entries are ignored.
+    overlay : dict
+        The sets of moved rows in each cell, keyed like cells.
+    rowKeys : dict
+        The overlay cells of every moved row, so they can be removed when it moves again.
+    large : set
+        The rows spanning too many cells to be inserted, tested by every query.
+    mins, maxs : numpy.ndarray
+        The world-space bounds of every row as of the last update.
+
+    Methods
+    -------
+    update():
+        Reinserts the rows that moved since the last query, or rebuilds the cells.
+    rebuild():
+        Builds the cells from the bounds of every row.
+    queryBox(low, high, exclude):
+        Returns the rows whose bounds overlap a box, except a row or array of rows to exclude.
+    queryRadius(center, radius, exclude):
+        Returns the rows whose bounds are within a distance of a point.
+    nearest(point, count, exclude):
+        Returns the rows closest to a point and their distances.
+    freePosition(row, target, axes, gap):
+        Returns the position closest to a target, on a plane, where a row overlaps nothing.
+    sweep(row, start, end):
+        Moves a row from one position towards another, stopping where it would enter another row.
+    snap(row, position, distance):
+        Moves a row at a position to touch the nearest surface within a distance.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.cellSize = 1.0
+        self.cells = {}
+        self.entries = np.zeros(0, np.intp)
+        self.stale = np.zeros(0, bool)
+        self.overlay = {}
+        self.rowKeys = {}
+        self.large = set()
+        self.mins = self.maxs = np.zeros((0, 3), np.float32)
+        self.built = False
+        self.structureVersion = None
+        self.transformVersion = None
+
+    def cellRange(self, mins, maxs):
+        # Clamp before converting, so far away or infinite bounds end up in the border cells
+        limit = KEY_OFFSET - 1
+        low = np.clip(np.floor(mins / self.cellSize), -limit, limit).astype(np.int64)
+        high = np.clip(np.floor(maxs / self.cellSize), -limit, limit).astype(np.int64)
+        return low, high
+
+    def reserve(self, capacity):
+        # Follow the store's capacity, so any row can be indexed
+        if len(self.stale) >= capacity:
+            return
+        size = len(self.stale)
+        self.stale = np.concatenate((self.stale, np.zeros(capacity - size, bool)))
+        padding = np.zeros((capacity - size, 3), self.mins.dtype)
+        self.mins = np.concatenate((self.mins, padding))
+        self.maxs = np.concatenate((self.maxs, padding))
+
+    @profiled('SpatialHash.update', 'spatial')
+    def update(self):
+        store = self.store
+        # Moving a parent flags its descendants as moved when their world transforms are brought up to date
+        store.updateWorld()
+        if (self.structureVersion == store.structureVersion
+                and self.transformVersion == store.transformVersion):
+            return
+        self.structureVersion = store.structureVersion
+        self.transformVersion = store.transformVersion
+        moved = np.flatnonzero(store.moved[:store.count])
+        if not self.built or len(self.rowKeys) + len(moved) > max(REBUILD_MIN_ROWS, REBUILD_FRACTION * store.count):
+            self.rebuild()
+            return
+        if len(moved) == 0:
+            return
+        store.moved[moved] = False
+        self.reserve(len(store.moved))
+        mins, maxs = store.worldBounds(moved)
+        self.mins[moved] = mins
+        self.maxs[moved] = maxs
+        self.stale[moved] = True
+        low, high = self.cellRange(mins, maxs)
+        for row, start, stop in zip(moved.tolist(), low, high):
+            # Take the row out of the overlay cells of its previous move
+            for key in self.rowKeys.pop(row, ()):
+                cell = self.overlay[key]
+                cell.discard(row)
+                if not cell:
+                    del self.overlay[key]
+            self.large.discard(row)
+            if np.any(stop - start >= MAX_CELL_SPAN):
+                self.large.add(row)
+                self.rowKeys[row] = ()
+                continue
+            keys = keysInRange(start, stop).tolist()
+            for key in keys:
+                self.overlay.setdefault(key, set()).add(row)
+            self.rowKeys[row] = keys
+
+    @profiled('SpatialHash.rebuild', 'spatial')
+    def rebuild(self):
+        store = self.store
+        count = store.count
+        store.moved[:] = False
+        self.stale = np.zeros(len(store.moved), bool)
+        self.mins = np.zeros((len(store.moved), 3), np.float32)
+        self.maxs = np.zeros((len(store.moved), 3), np.float32)
+        mins, maxs = store.worldBounds()
+        self.mins[:count] = mins
+        self.maxs[:count] = maxs
+
+        # Size the cells so a typical entity covers a few of them
+        sizes = (maxs - mins).max(axis=1)
+        sizes = sizes[np.isfinite(sizes) & (sizes > 0)]
+        self.cellSize = float(np.median(sizes)) * CELL_FACTOR if len(sizes) else 1.0
+
+        low, high = self.cellRange(mins, maxs)
+        spans = high - low + 1
+        large = np.any(spans > MAX_CELL_SPAN, axis=1)
+        self.large = set(np.flatnonzero(large).tolist())
+        rows = np.flatnonzero(~large)
+        spans = spans[rows]
+        counts = spans.prod(axis=1)
+
+        # One entry per row and covered cell: split each entry's index within its row's block into x, y and z
+        entryRows = np.repeat(rows, counts)
+        local = np.arange(len(entryRows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        spanY = np.repeat(spans[:, 1], counts)
+        spanZ = np.repeat(spans[:, 2], counts)
+        offsets = np.stack((local // (spanY * spanZ), local // spanZ % spanY, local % spanZ), axis=1)
+        keys = packKeys(np.repeat(low[rows], counts, axis=0) + offsets)
+
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        self.entries = entryRows[order]
+        unique, starts = np.unique(keys, return_index=True)
+        stops = np.append(starts[1:], len(keys))
+        self.cells = dict(zip(unique.tolist(), zip(starts.tolist(), stops.tolist())))
+        self.overlay = {}
+        self.rowKeys = {}
+        self.built = True
+
+    def candidates(self, low, high):
+        # The rows in the cells overlapping a box, which may not overlap the box themselves
+        count = self.store.count
+        start, stop = self.cellRange(low, high)
+        if np.prod(stop - start + 1) > MAX_QUERY_CELLS:
+            return np.arange(count)
+        keys = keysInRange(start, stop).tolist()
+        parts = []
+        extra = list(self.large)
+        for key in keys:
+            cell = self.cells.get(key)
+            if cell is not None:
+                parts.append(self.entries[cell[0]:cell[1]])
+            cell = self.overlay.get(key)
+            if cell is not None:
+                extra.extend(cell)
+        rows = np.concatenate(parts) if parts else np.zeros(0, np.intp)
+        rows = np.concatenate((rows[~self.stale[rows]], np.array(extra, np.intp)))
+        rows = np.unique(rows)
+        # Rows past the count were released since the last update
+        return rows[rows < count]
+
+    def queryBox(self, low, high, exclude=None):
+        self.update()
+        low = np.asarray(low, np.float64)
+        high = np.asarray(high, np.float64)
+        rows = self.candidates(low, high)
+        hit = np.all((self.mins[rows] <= high) & (self.maxs[rows] >= low), axis=1)
+        rows = rows[hit]
+        return rows if exclude is None else rows[~np.isin(rows, exclude)]
+
+    def queryRadius(self, center, radius, exclude=None):
+        center = np.asarray(center, np.float64)
+        rows = self.queryBox(center - radius, center + radius, exclude)
+        return rows[boxDistances(center, self.mins[rows], self.maxs[rows]) <= radius]
+
+    @profiled('SpatialHash.nearest', 'spatial')
+    def nearest(self, point, count=1, exclude=None):
+        # Search ever larger spheres until they hold enough rows, or the query tested every row
+        point = np.asarray(point, np.float64)
+        radius = self.cellSize
+        while True:
+            rows = self.queryRadius(point, radius, exclude)
+            if len(rows) >= count or (2 * radius / self.cellSize + 1) ** 3 > MAX_QUERY_CELLS:
+                break
+            radius *= 2
+        distances = boxDistances(point, self.mins[rows], self.maxs[rows])
+        order = np.argsort(distances, kind='stable')[:count]
+        return rows[order], distances[order]
+
+    def relativeBounds(self, row):
+        # The row's world bounds relative to its position; rotation and scale do not change while it moves
+        mins, maxs = self.store.worldBounds([row])
+        translation = self.store.worldTranslation[row].astype(np.float64)
+        return mins[0] - translation, maxs[0] - translation
+
+    @profiled('SpatialHash.freePosition', 'spatial')
+    def freePosition(self, row, target, axes, gap, rings=32):
+        # Try the positions of a grid on the plane spanned by axes, ring by ring around the target
+        low, high = self.relativeBounds(row)
+        exclude = self.store.subtree(row)
+        target = np.asarray(target, np.float64)
+        axes = [np.asarray(axis, np.float64) / np.linalg.norm(axis) for axis in axes]
+        steps = [np.abs(axis) @ (high - low) + gap for axis in axes]
+        for i, j in ringOffsets(rings):
+            position = target + i * steps[0] * axes[0] + j * steps[1] * axes[1]
+            margin = gap - CONTACT_EPSILON
+            if not len(self.queryBox(position + low - margin, position + high + margin, exclude)):
+                return position
+        # The plane is full around the target; overlapping there is the least surprising
+        return target
+
+    @profiled('SpatialHash.sweep', 'spatial')
+    def sweep(self, row, start, end):
+        # Move one axis at a time, stopping each axis at the first box in the way
+        low, high = self.relativeBounds(row)
+        exclude = self.store.subtree(row)
+        position = np.array(start, np.float64)
+        end = np.asarray(end, np.float64)
+        for axis in range(3):
+            delta = end[axis] - position[axis]
+            if delta == 0:
+                continue
+            boxLow, boxHigh = position + low, position + high
+            sweptLow, sweptHigh = boxLow.copy(), boxHigh.copy()
+            if delta > 0:
+                sweptHigh[axis] += delta
+            else:
+                sweptLow[axis] += delta
+            rows = self.queryBox(sweptLow, sweptHigh, exclude)
+            mins, maxs = self.mins[rows], self.maxs[rows]
+            others = [other for other in range(3) if other != axis]
+            # Boxes already overlapping the row do not block it, so overlapping entities can be pulled apart
+            inside = np.all((mins < boxHigh - CONTACT_EPSILON) & (maxs > boxLow + CONTACT_EPSILON), axis=1)
+            facing = np.all((mins[:, others] < boxHigh[others] - CONTACT_EPSILON)
+                            & (maxs[:, others] > boxLow[others] + CONTACT_EPSILON), axis=1) & ~inside
+            if delta > 0:
+                limits = mins[facing, axis] - boxHigh[axis]
+                delta = min(delta, max(limits.min(), 0)) if len(limits) else delta
+            else:
+                limits = maxs[facing, axis] - boxLow[axis]
+                delta = max(delta, min(limits.max(), 0)) if len(limits) else delta
+            position[axis] += delta
+        return position
+
+    @profiled('SpatialHash.snap', 'spatial')
+    def snap(self, row, position, distance):
+        # Close the smallest gap to a face of a neighbor in front of the row along one axis
+        low, high = self.relativeBounds(row)
+        position = np.array(position, np.float64)
+        boxLow, boxHigh = position + low, position + high
+        rows = self.queryBox(boxLow - distance, boxHigh + distance, self.store.subtree(row))
+        mins, maxs = self.mins[rows], self.maxs[rows]
+        best, offset = distance, None
+        for axis in range(3):
+            others = [other for other in range(3) if other != axis]
+            facing = np.all((mins[:, others] < boxHigh[others]) & (maxs[:, others] > boxLow[others]), axis=1)
+            for gaps, sign in ((mins[facing, axis] - boxHigh[axis], 1), (boxLow[axis] - maxs[facing, axis], -1)):
+                gaps = gaps[gaps >= -CONTACT_EPSILON]
+                if len(gaps) and gaps.min() < best:
+                    best = gaps.min()
+                    offset = (axis, sign * best)
+        if offset is not None:
+            position[offset[0]] += offset[1]
+        return position
@@ -0,0 +1,452 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PySide6.QtCore import QByteArray, QObject, QTimer, Signal
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from src.constants import STATIC_BATCH_TRIANGLES
+from src.instancing import FRAGMENT_SHADER, createShaderMaterial
+from src.picking import Bvh, rayBoxDistances, rayTriangleDistances, safeInverse
+from src.profiler import profiled
+from src.tessellation import bakeTransforms, meshData
+
+# Per-vertex floats: world position, world normal and RGBA color in 0..1
+VERTEX_FLOATS = 10
+VERTEX_STRIDE = VERTEX_FLOATS * 4
+
+# Most triangles of one member in a leaf primitive of the picking hierarchy; a BVH over single triangles
+# takes seconds to build for the millions of triangles of a large frozen scene
+PICK_PIECE_TRIANGLES = 64
+
+VERTEX_SHADER = b"""#version 150 core
+
+in vec3 vertexPosition;
+in vec3 vertexNormal;
+in vec4 vertexColor;
+
+out vec3 worldPosition;
+out vec3 worldNormal;
+out vec4 color;
+
+uniform mat4 modelMatrix;
+uniform mat3 modelNormalMatrix;
+uniform mat4 viewProjectionMatrix;
+
+void main()
+{
+    // The vertices are baked in world space; the batch entity has no transform of its own
+    worldPosition = vec3(modelMatrix * vec4(vertexPosition, 1.0));
+    worldNormal = normalize(modelNormalMatrix * vertexNormal);
+    color = vertexColor;
+    gl_Position = viewProjectionMatrix * vec4(worldPosition, 1.0);
+}
+"""
+
+
+def mortonCodes(points):
+    """ Returns the 30-bit Morton code of each (N, 3) point, from 10 bits per axis of its place in their bounds. """
+    low, high = points.min(axis=0), points.max(axis=0)
+    cells = ((points - low) / np.maximum(high - low, 1e-9) * 1023).astype(np.uint32)
+    # Spread the 10 bits of each axis two bits apart, then interleave the axes
+    cells = (cells | (cells << 16)) & 0x030000FF
+    cells = (cells | (cells << 8)) & 0x0300F00F
+    cells = (cells | (cells << 4)) & 0x030C30C3
+    cells = (cells | (cells << 2)) & 0x09249249
+    return cells[:, 0] | (cells[:, 1] << 1) | (cells[:, 2] << 2)
+
+
+def createBatchGeometry(vertices, indices, parent=None):
+    """ Creates a QGeometry from (N, VERTEX_FLOATS) vertices and uint32 indices and returns it with its index buffer. """
+    geometry = Qt3DCore.QGeometry(parent)
+    vertexBuffer = Qt3DCore.QBuffer(geometry)
+    vertexBuffer.setData(QByteArray(vertices.tobytes()))
+    indexBuffer = Qt3DCore.QBuffer(geometry)
+    indexBuffer.setData(QByteArray(indices.tobytes()))
+
+    for name, offset, size in ((Qt3DCore.QAttribute.defaultPositionAttributeName(), 0, 3),
+                               (Qt3DCore.QAttribute.defaultNormalAttributeName(), 3, 3),
+                               (Qt3DCore.QAttribute.defaultColorAttributeName(), 6, 4)):
+        attribute = Qt3DCore.QAttribute(geometry)
+        attribute.setName(name)
+        attribute.setAttributeType(Qt3DCore.QAttribute.VertexAttribute)
+        attribute.setVertexBaseType(Qt3DCore.QAttribute.Float)
+        attribute.setVertexSize(size)
+        attribute.setByteOffset(offset * 4)
+        attribute.setByteStride(VERTEX_STRIDE)
+        attribute.setCount(len(vertices))
+        attribute.setBuffer(vertexBuffer)
+        geometry.addAttribute(attribute)
+
+    indexAttribute = Qt3DCore.QAttribute(geometry)
+    indexAttribute.setAttributeType(Qt3DCore.QAttribute.IndexAttribute)
+    indexAttribute.setVertexBaseType(Qt3DCore.QAttribute.UnsignedInt)
+    indexAttribute.setCount(len(indices))
+    indexAttribute.setBuffer(indexBuffer)
+    geometry.addAttribute(indexAttribute)
+    return geometry, indexBuffer
+
+
+class BatchData:
+    """
+    The BatchData class holds the merged buffers of one static batch, built on a worker thread.
+    Every member owns a contiguous range of the vertices and of the indices.
+
+    Attributes
+    ----------
+    vertices : numpy.ndarray
+        A (N, VERTEX_FLOATS) float32 array of world-space vertices.
+    indices : numpy.ndarray
+        A (M,) uint32 array of vertex indices, three per triangle.
+    triangleMembers : numpy.ndarray
+        A (M / 3,) int32 array with the member each triangle belongs to.
+    vertexStarts, indexStarts : numpy.ndarray
+        The first vertex and index of each member, followed by the totals.
+    pieceStarts : numpy.ndarray
+        The first triangle of each piece, a run of at most PICK_PIECE_TRIANGLES triangles of one member,
+        followed by the total.
+    bvh : Bvh
+        The hierarchy over the bounds of the pieces, used for picking, or None without triangles.
+    bounds : tuple
+        The minimum and maximum corners of the vertices.
+
+    Methods
+    -------
+    closestTriangle(origin, direction, live):
+        Returns the distance to and index of the closest live triangle hit by the ray, or (inf, None).
+    """
+
+    __slots__ = ('vertices', 'indices', 'triangleMembers', 'vertexStarts', 'indexStarts', 'pieceStarts', 'bvh',
+                 'bounds')
+
+    def __init__(self, vertices, indices, triangleMembers, vertexStarts, indexStarts):
+        self.vertices = vertices
+        self.indices = indices
+        self.triangleMembers = triangleMembers
+        self.vertexStarts = vertexStarts
+        self.indexStarts = indexStarts
+        self.bvh = None
+        self.pieceStarts = np.zeros(1, np.int64)
+        self.bounds = (np.zeros(3, np.float32), np.zeros(3, np.float32))
+        if len(indices):
+            # Split the triangles of every member into pieces, which never mix members
+            memberStarts = indexStarts[:-1] // 3
+            counts = (np.diff(indexStarts) // 3 + PICK_PIECE_TRIANGLES - 1) // PICK_PIECE_TRIANGLES
+            first = np.cumsum(counts) - counts
+            starts = (np.repeat(memberStarts, counts)
+                      + (np.arange(counts.sum()) - np.repeat(first, counts)) * PICK_PIECE_TRIANGLES)
+            self.pieceStarts = np.append(starts, len(indices) // 3)
+            corners = vertices[indices, :3].reshape(-1, 3, 3)
+            self.bvh = Bvh(np.minimum.reduceat(corners.min(axis=1), starts),
+                           np.maximum.reduceat(corners.max(axis=1), starts))
+            positions = vertices[:, :3]
+            self.bounds = (positions.min(axis=0), positions.max(axis=0))
+
+    def closestTriangle(self, origin, direction, live):
+        # live is a bool per triangle, False for the triangles that are no longer drawn
+        def leafTest(pieces, maxDistance):
+            triangles = np.concatenate([np.arange(self.pieceStarts[piece], self.pieceStarts[piece + 1])
+                                        for piece in pieces.tolist()])
+            corners = self.vertices[self.indices.reshape(-1, 3)[triangles], :3]
+            distances = rayTriangleDistances(origin, direction, corners)
+            distances[~live[triangles]] = np.inf
+            closest = int(np.argmin(distances))
+            return distances[closest], triangles[closest]
+        if self.bvh is None:
+            return np.inf, None
+        return self.bvh.closestHit(origin, direction, leafTest)
+
+
+def buildBatch(meshes, meshIndices, transforms, scales, colors):
+    """
+    Bakes the world transforms and colors of a batch's members into merged buffers and returns BatchData.
+    Members are sorted by their index into meshes, so the members of each mesh are transformed together
+    with one batched matrix multiply. Runs on a worker thread.
+    """
+    vertexCounts = np.array([len(mesh.vertices) for mesh in meshes], np.int64)[meshIndices]
+    indexCounts = np.array([len(mesh.indices) for mesh in meshes], np.int64)[meshIndices]
+    vertexStarts = np.concatenate(([0], np.cumsum(vertexCounts)))
+    indexStarts = np.concatenate(([0], np.cumsum(indexCounts)))
+    vertices = np.empty((vertexStarts[-1], VERTEX_FLOATS), np.float32)
+    indices = np.empty(indexStarts[-1], np.uint32)
+
+    groupStarts = np.concatenate(([0], np.flatnonzero(np.diff(meshIndices)) + 1, [len(meshIndices)])).tolist()
+    for first, last in zip(groupStarts[:-1], groupStarts[1:]):
+        mesh = meshes[meshIndices[first]]
+        positions, normals = bakeTransforms(mesh, transforms[first:last], scales[first:last])
+
+        block = vertices[vertexStarts[first]:vertexStarts[last]].reshape(last - first, -1, VERTEX_FLOATS)
+        block[..., 0:3] = positions
+        block[..., 3:6] = normals
+        block[..., 6:10] = (colors[first:last] / np.float32(255))[:, None]
+        offsets = vertexStarts[first:last].astype(np.uint32)
+        indices[indexStarts[first]:indexStarts[last]] = (mesh.indices[None] + offsets[:, None]).ravel()
+
+    triangleMembers = np.repeat(np.arange(len(meshIndices), dtype=np.int32), indexCounts // 3)
+    return BatchData(vertices, indices, triangleMembers, vertexStarts, indexStarts)
+
+
+def compactBatch(data, live):
+    """ Returns BatchData without the vertices and triangles of the members that are not live. Runs on a worker thread. """
+    vertexKeep = np.repeat(live, np.diff(data.vertexStarts))
+    indexKeep = np.repeat(live, np.diff(data.indexStarts))
+    # Each kept vertex moves down by the number of vertices dropped before it
+    newVertices = (np.cumsum(vertexKeep) - 1).astype(np.uint32)
+    newMembers = (np.cumsum(live) - 1).astype(np.int32)
+    return BatchData(data.vertices[vertexKeep], newVertices[data.indices[indexKeep]],
+                     newMembers[data.triangleMembers[indexKeep[::3]]],
+                     np.concatenate(([0], np.cumsum(np.diff(data.vertexStarts)[live]))),
+                     np.concatenate(([0], np.cumsum(np.diff(data.indexStarts)[live]))))
+
+
+class StaticBatch:
+    """
+    The StaticBatch class draws a group of frozen entities with one merged vertex and index buffer.
+    An entity is drawn by the batch while its staticBatch is the batch. A thawed entity stays in members until
+    the batch is rebuilt without it; its triangles are collapsed at once, so it is never drawn twice.
+
+    Attributes
+    ----------
+    members : list
+        The entities in the order of the buffers on display.
+    memberIndex : dict
+        The index of each entity in members.
+    data : BatchData
+        The buffers on display, or None until the first build finishes.
+    liveTriangles : numpy.ndarray
+        A bool per triangle, False for the triangles of thawed members.
+    entity : Qt3DCore.QEntity
+        The entity drawing the buffers, or None until the first build finishes.
+    building : bool
+        Whether a build of the batch is running.
+
+    Methods
+    -------
+    install(members, data, material, rootEntity):
+        Draws newly built buffers.
+    hide(index):
+        Stops drawing and picking the triangles of a member.
+    release():
+        Deletes the batch's Qt objects.
+    """
+
+    def __init__(self, members):
+        self.members = members
+        self.memberIndex = {}
+        self.data = None
+        self.liveTriangles = None
+        self.entity = None
+        self.renderer = None
+        self.geometry = None
+        self.indexBuffer = None
+        self.building = False
+
+    def install(self, members, data, material, rootEntity):
+        if self.entity is None:
+            self.entity = Qt3DCore.QEntity(rootEntity)
+            self.renderer = Qt3DRender.QGeometryRenderer(self.entity)
+            self.entity.addComponent(self.renderer)
+            self.entity.addComponent(material)
+        geometry, self.indexBuffer = createBatchGeometry(data.vertices, data.indices, self.entity)
+        self.renderer.setGeometry(geometry)
+        if self.geometry is not None:
+            self.geometry.deleteLater()
+        self.geometry = geometry
+        self.members = members
+        self.memberIndex = {view: index for index, view in enumerate(members)}
+        self.data = data
+        self.liveTriangles = np.ones(len(data.triangleMembers), bool)
+
+    def hide(self, index):
+        start, stop = self.data.indexStarts[index:index + 2].tolist()
+        self.liveTriangles[start // 3:stop // 3] = False
+        # Zero indices make degenerate triangles, which draw nothing, until the rebuild drops them
+        self.indexBuffer.updateData(start * 4, QByteArray(bytes(4 * (stop - start))))
+
+    def release(self):
+        if self.entity is not None:
+            self.entity.setParent(None)
+            self.entity.deleteLater()
+            self.entity = None
+
+
+class StaticBatcher(QObject):
+    """
+    The StaticBatcher class draws frozen entities, which are not expected to move, from a few merged buffers.
+    Freezing bakes the world transform and color of every entity into world-space vertices, so a batch is one
+    draw call and no Qt entity, transform or material per entity. Entities are split into batches of about
+    STATIC_BATCH_TRIANGLES triangles in Morton order of their positions, so each batch covers a compact region
+    that Qt3D can cull on its own and a rebuild stays small. The buffers are built with NumPy on a worker thread;
+    the entities keep drawing on their own until their batch is ready. Picking maps the triangles of a batch back
+    to its entities through the member of each triangle. Any change to a frozen entity thaws it: the entity is
+    drawn on its own again at once, its triangles are collapsed, and its batch is rebuilt without it in the background.
+
+    Attributes
+    ----------
+    store : SceneStore
+        The store holding the transforms and colors baked into the batches.
+    rootEntity : Qt3DCore.QEntity
+        The entity the batches are added under.
+    material : Qt3DRender.QMaterial
+        The material shared by every batch, lit like instanced entities.
+    batches : list
+        The batches being built or drawn.
+    staleBatches : dict
+        The batches with thawed members, as dictionary keys, waiting to be rebuilt.
+    pool : ThreadPoolExecutor
+        The worker thread building the batches.
+
+    Signals
+    -------
+    batchBuilt(object, object, object):
+        Emitted by the worker with a batch, the members it was built from and their BatchData.
+
+    Methods
+    -------
+    freeze(views):
+        Starts building batches for the entities that are not frozen yet and returns their number.
+    remove(view):
+        Takes an entity out of its batch and schedules the batch to be rebuilt.
+    markStale(batch):
+        Schedules a batch with thawed members to be rebuilt without them.
+    rebuildStale():
+        Starts rebuilding the batches whose members were thawed.
+    onBatchBuilt(batch, members, data):
+        Draws built buffers and drops the Qt objects of the entities frozen into them.
+    pick(origin, direction, maxDistance):
+        Returns the (row, distance) of the closest frozen entity hit by the ray before maxDistance, or None.
+    stats():
+        Returns the number of batches, frozen entities and drawn triangles.
+    shutdown():
+        Stops the worker thread.
+    """
+
+    batchBuilt = Signal(object, object, object)
+
+    def __init__(self, store, rootEntity, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.rootEntity = rootEntity
+        self.material = createShaderMaterial(VERTEX_SHADER, FRAGMENT_SHADER, rootEntity)
+        self.batches = []
+        self.staleBatches = {}
+        # One worker, so builds hold the GIL from one thread at most while the GUI thread runs
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix='StaticBatcher')
+        self.batchBuilt.connect(self.onBatchBuilt)
+
+    @profiled('StaticBatcher.freeze', 'scene')
+    def freeze(self, views):
+        # Read the meshes on the GUI thread; the worker only gets NumPy arrays
+        meshes = []
+        meshIndex = {}
+        members = []
+        for view in views:
+            if view.row is None or view.staticBatch is not None:
+                continue
+            if view.mesh not in meshIndex:
+                data = meshData(view.mesh)
+                # An STL mesh that is still importing has no triangles to bake yet
+                meshIndex[view.mesh] = None if data is None or len(data.indices) == 0 else len(meshes)
+                if meshIndex[view.mesh] is not None:
+                    meshes.append(data)
+            if meshIndex[view.mesh] is not None:
+                members.append(view)
+        if not members:
+            return 0
+
+        store = self.store
+        rows = np.array([view.row for view in members], np.intp)
+        meshIndices = np.array([meshIndex[view.mesh] for view in members], np.intp)
+        transforms = store.worldTransforms(rows)
+        mins, maxs = store.worldBounds(rows)
+        scales = store.scale[rows]
+        colors = store.color[rows]
+
+        # Cut the Morton order into runs of about STATIC_BATCH_TRIANGLES; a batch ends after the member that fills it
+        order = np.argsort(mortonCodes((mins + maxs) / 2), kind='stable')
+        triangles = np.array([len(mesh.indices) // 3 for mesh in meshes], np.int64)[meshIndices[order]]
+        batchNumbers = (np.cumsum(triangles) - triangles) // STATIC_BATCH_TRIANGLES
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(batchNumbers)) + 1, [len(order)])).tolist()
+        for first, last in zip(starts[:-1], starts[1:]):
+            chosen = order[first:last]
+            chosen = chosen[np.argsort(meshIndices[chosen], kind='stable')]
+            batch = StaticBatch([members[index] for index in chosen.tolist()])
+            for view in batch.members:
+                view.staticBatch = batch
+            self.batches.append(batch)
+            batch.building = True
+            self.pool.submit(self.run, batch, batch.members, buildBatch,
+                             (meshes, meshIndices[chosen], transforms[chosen], scales[chosen], colors[chosen]))
+        return len(members)
+
+    def run(self, batch, members, function, arguments):
+        # Runs on the worker thread
+        self.batchBuilt.emit(batch, members, function(*arguments))
+
+    def remove(self, view):
+        batch = view.staticBatch
+        view.staticBatch = None
+        index = batch.memberIndex.get(view)
+        if index is not None:
+            batch.hide(index)
+        self.markStale(batch)
+
+    def markStale(self, batch):
+        # Rebuild once the event loop runs, so thawing many members of a batch rebuilds it once
+        if not self.staleBatches:
+            QTimer.singleShot(0, self.rebuildStale)
+        self.staleBatches[batch] = None
+
+    def rebuildStale(self):
+        stale, self.staleBatches = self.staleBatches, {}
+        for batch in stale:
+            # A batch that is building is checked for thawed members once the build is done
+            if batch.building or batch.data is None or batch not in self.batches:
+                continue
+            live = np.array([view.staticBatch is batch for view in batch.members])
+            if not live.any():
+                self.batches.remove(batch)
+                batch.release()
+                continue
+            batch.building = True
+            members = [view for view, alive in zip(batch.members, live.tolist()) if alive]
+            self.pool.submit(self.run, batch, members, compactBatch, (batch.data, live))
+
+    @profiled('StaticBatcher.onBatchBuilt', 'scene')
+    def onBatchBuilt(self, batch, members, data):
+        batch.building = False
+        live = [view.staticBatch is batch for view in members]
+        if not any(live):
+            # Every member was thawed or deleted while the batch was built
+            self.batches.remove(batch)
+            batch.release()
+            return
+        batch.install(members, data, self.material, self.rootEntity)
+        for index, view in enumerate(members):
+            if live[index]:
+                view.freeze()
+            else:
+                batch.hide(index)
+        if not all(live):
+            self.markStale(batch)
+
+    def pick(self, origin, direction, maxDistance):
+        inverseDirection = safeInverse(direction)
+        best, bestRow = maxDistance, None
+        for batch in self.batches:
+            if batch.data is None or batch.data.bvh is None:
+                continue
+            low, high = batch.data.bounds
+            if rayBoxDistances(origin, inverseDirection, low[None], high[None])[0] >= best:
+                continue
+            distance, triangle = batch.data.closestTriangle(origin, direction, batch.liveTriangles)
+            if distance < best:
+                best, bestRow = distance, batch.members[batch.data.triangleMembers[triangle]].row
+        return None if bestRow is None else (bestRow, best)
+
+    def stats(self):
+        return {'batches': len(self.batches),
+                'frozen': int(self.store.frozen[:self.store.count].sum()),
+                'triangles': sum(int(batch.liveTriangles.sum()) for batch in self.batches if batch.data is not None)}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
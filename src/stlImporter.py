@@ -0,0 +1,195 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PySide6.QtCore import QCoreApplication, QObject, QUrl, Signal
+from src.constants import STL_IMPORT_WORKERS
+from src.profiler import profiled
+
+# The stages reported for every file, in order; a file already in the asset store skips to 'lods'
+STAGES = ('read', 'parse', 'index', 'lods')
+
+
+class ImportCancelled(Exception):
+    """ Raised inside a worker to stop an import that was cancelled. """
+
+
+class StlImport:
+    # One file being imported into one mesh
+    __slots__ = ('path', 'asset', 'mesh', 'future', 'cancelled', 'stages')
+
+    def __init__(self, path, asset, mesh):
+        self.path = path
+        self.asset = asset
+        self.mesh = mesh
+        self.future = None
+        self.cancelled = threading.Event()
+        self.stages = 0
+
+
+class StlImporter(QObject):
+    """
+    The StlImporter class loads STL files into StlMesh objects on a pool of worker threads.
+    A worker imports a file into the asset store, where it is read, hashed, parsed, validated and indexed
+    and its normals, bounds and levels of detail are computed, unless the same content is stored already,
+    and then loads the processed mesh from the store. The workers only hand back NumPy arrays:
+    Qt objects are touched on the GUI thread alone, where queued signals deliver the bounds of a file
+    as soon as they are known, to size the placeholder box of its mesh, and the finished arrays, to
+    build the geometry. Most of the parsing and indexing time is spent in NumPy, which releases the GIL
+    for much of it, so the event loop keeps running while large files load.
+
+    Attributes
+    ----------
+    assets : AssetStore
+        The store that files are imported into and meshes are loaded from.
+    pool : ThreadPoolExecutor
+        The worker threads.
+    imports : dict
+        A dictionary mapping each mesh still being loaded to its StlImport.
+    finished : int
+        The number of files loaded since the importer was last idle, counted in the progress.
+
+    Signals
+    -------
+    progressChanged(int, int):
+        Emitted with the stages finished and the total stages of the files imported since the importer was
+        last idle; both are 0 once it is idle again.
+    meshLoaded(object):
+        Emitted with a mesh once its data is set.
+    importFailed(object, str, str):
+        Emitted with a mesh, its file and the error when the file cannot be loaded. The mesh keeps its placeholder.
+    importsCancelled(list):
+        Emitted with the meshes whose imports were cancelled. The meshes keep their placeholders.
+
+    Methods
+    -------
+    load(mesh, path, asset):
+        Starts loading an asset, or the STL file if the asset is not stored, into a mesh that shows its
+        placeholder until then.
+    isImporting():
+        Returns whether files are still being loaded.
+    cancel():
+        Cancels every import in progress.
+    drop(mesh):
+        Stops loading a mesh that is being deleted, without reporting it as cancelled.
+    wait():
+        Blocks until every import in progress has finished and its mesh is updated.
+    shutdown():
+        Stops every import and the worker threads, without reporting the imports as cancelled.
+    run(job):
+        Loads one file on a worker thread.
+    onStageFinished(job, stage, bounds):
+        Counts a finished stage and sizes the placeholder box once the bounds are known.
+    onImportDone(job, asset, data, lods, error):
+        Sets the data of a loaded mesh or reports the error.
+    emitProgress():
+        Emits the progress of the files imported since the importer was last idle.
+    """
+
+    progressChanged = Signal(int, int)
+    meshLoaded = Signal(object)
+    importFailed = Signal(object, str, str)
+    importsCancelled = Signal(list)
+
+    # Emitted by the workers; the connections are queued, so the slots run on the GUI thread
+    stageFinished = Signal(object, str, object)
+    importDone = Signal(object, str, object, object, str)
+
+    def __init__(self, assets, parent=None):
+        super().__init__(parent)
+        self.assets = assets
+        self.pool = ThreadPoolExecutor(STL_IMPORT_WORKERS, thread_name_prefix='StlImporter')
+        self.imports = {}
+        self.finished = 0
+        self.stageFinished.connect(self.onStageFinished)
+        self.importDone.connect(self.onImportDone)
+
+    def load(self, mesh, path, asset=None):
+        job = StlImport(path, asset, mesh)
+        self.imports[mesh] = job
+        job.future = self.pool.submit(self.run, job)
+        self.emitProgress()
+
+    def isImporting(self):
+        return bool(self.imports)
+
+    def cancel(self):
+        jobs = list(self.imports.values())
+        if not jobs:
+            return
+        # Queued files never start; running ones stop at the end of their current stage
+        for job in jobs:
+            job.cancelled.set()
+            job.future.cancel()
+        self.imports.clear()
+        self.emitProgress()
+        self.importsCancelled.emit([job.mesh for job in jobs])
+
+    def drop(self, mesh):
+        # The mesh is about to be deleted, so stop loading it without reporting a cancellation
+        job = self.imports.pop(mesh, None)
+        if job is not None:
+            job.cancelled.set()
+            job.future.cancel()
+            self.emitProgress()
+
+    def wait(self):
+        wait([job.future for job in self.imports.values()])
+        # Deliver the queued results now instead of on the next event loop iteration
+        QCoreApplication.sendPostedEvents(self)
+
+    def shutdown(self):
+        # The entities keep their placeholders, so nothing is reported as cancelled
+        for job in self.imports.values():
+            job.cancelled.set()
+        self.imports.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, job):
+        # Runs on a worker thread
+        def progress(stage, bounds=None):
+            if job.cancelled.is_set():
+                raise ImportCancelled()
+            self.stageFinished.emit(job, stage, bounds)
+
+        try:
+            asset = job.asset
+            if asset is None or not self.assets.contains(asset):
+                asset = self.assets.importFile(job.path, progress)
+            data, lods = self.assets.load(asset)
+            progress('lods')
+        except ImportCancelled:
+            return
+        except (OSError, ValueError) as e:
+            self.importDone.emit(job, '', None, None, str(e))
+            return
+        self.importDone.emit(job, asset, data, lods, '')
+
+    def onStageFinished(self, job, stage, bounds):
+        if self.imports.get(job.mesh) is not job:
+            return
+        job.stages = STAGES.index(stage) + 1
+        if bounds is not None and not job.mesh.loaded:
+            job.mesh.setPlaceholder(*bounds)
+        self.emitProgress()
+
+    @profiled('StlImporter.onImportDone', 'scene')
+    def onImportDone(self, job, asset, data, lods, error):
+        if self.imports.get(job.mesh) is not job:
+            # Cancelled after the worker finished
+            return
+        del self.imports[job.mesh]
+        self.finished += 1
+        self.emitProgress()
+        if data is None:
+            self.importFailed.emit(job.mesh, job.path, error)
+            return
+        job.mesh.setData(QUrl.fromLocalFile(job.path), asset, data, lods)
+        self.meshLoaded.emit(job.mesh)
+
+    def emitProgress(self):
+        if not self.imports:
+            self.finished = 0
+            self.progressChanged.emit(0, 0)
+            return
+        done = self.finished * len(STAGES) + sum(job.stages for job in self.imports.values())
+        self.progressChanged.emit(done, (self.finished + len(self.imports)) * len(STAGES))
@@ -0,0 +1,329 @@
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy as np
+
+# Bump this whenever the cached array layout changes so stale caches are ignored
+CACHE_VERSION = 1
+
+# Faces meeting at a larger angle than this, in degrees, get separate vertices so the edge between them shades hard
+CREASE_ANGLE = 30
+NORMAL_CHUNK = 1 << 18  # Pairs of corners at one position compared at a time, which bounds the memory of large meshes
+
+# A binary STL is an 80 byte header, a uint32 triangle count, then 50 bytes per triangle
+BINARY_HEADER_SIZE = 84
+BINARY_TRIANGLE = np.dtype([('normal', '<f4', (3,)),
+                            ('vertices', '<f4', (3, 3)),
+                            ('attribute', '<u2')])
+
+VERTEX_PATTERN = re.compile(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)')
+
+
+class StlData:
+    """
+    The StlData class holds the indexed triangle mesh decoded from an STL file.
+
+    Attributes
+    ----------
+    vertices : numpy.ndarray
+        A (N, 6) float32 array of interleaved vertex positions and normals.
+    indices : numpy.ndarray
+        A (M,) uint32 array of vertex indices, three per triangle.
+
+    Methods
+    -------
+    positions():
+        Returns a (N, 3) view of the vertex positions.
+    normals():
+        Returns a (N, 3) view of the vertex normals.
+    triangles():
+        Returns a (M / 3, 3, 3) array of triangle corner positions.
+    bounds():
+        Returns the minimum and maximum corners of the mesh.
+    """
+
+    def __init__(self, vertices, indices):
+        self.vertices = vertices
+        self.indices = indices
+
+    def positions(self):
+        return self.vertices[:, :3]
+
+    def normals(self):
+        return self.vertices[:, 3:]
+
+    def triangles(self):
+        return self.positions()[self.indices.reshape(-1, 3)]
+
+    def bounds(self):
+        positions = self.positions()
+        if len(positions) == 0:
+            return np.zeros(3, np.float32), np.zeros(3, np.float32)
+        return positions.min(axis=0), positions.max(axis=0)
+
+
+def isBinaryStl(data):
+    # Binary files are identified by their size; some exporters write "solid" into the binary header
+    if len(data) < BINARY_HEADER_SIZE:
+        return False
+    count = int(np.frombuffer(data, '<u4', 1, 80)[0])
+    return len(data) == BINARY_HEADER_SIZE + count * BINARY_TRIANGLE.itemsize
+
+
+def parseTriangles(data):
+    """ Decodes the raw bytes of a binary or ASCII STL file into a (T, 3, 3) float32 array. """
+    if isBinaryStl(data):
+        records = np.frombuffer(data, BINARY_TRIANGLE, offset=BINARY_HEADER_SIZE)
+        return np.ascontiguousarray(records['vertices'])
+    if data.lstrip()[:5].lower() == b'solid':
+        corners = np.array(VERTEX_PATTERN.findall(data), dtype=np.float32)
+        if len(corners) % 3 != 0:
+            raise ValueError("ASCII STL has a facet without exactly three vertices")
+        return corners.reshape(-1, 3, 3)
+    raise ValueError("Data is neither a binary nor an ASCII STL file")
+
+
+def validateTriangles(triangles):
+    """ Raises ValueError unless the decoded triangles form a mesh that can be drawn. """
+    if len(triangles) == 0:
+        raise ValueError("STL file has no triangles")
+    if not np.isfinite(triangles).all():
+        raise ValueError("STL file has coordinates that are not finite numbers")
+
+
+def weldPositions(corners):
+    """ Merges equal rows of an (N, 3) float32 array; returns the unique rows and the row each one became. """
+    # Adding zero turns -0.0 into 0.0, which compare equal but differ as bytes
+    corners = np.ascontiguousarray(corners + np.float32(0), dtype=np.float32)
+    # View each 12 byte row as one opaque value so np.unique can deduplicate the rows in a single sort
+    rows = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return corners[first], inverse.ravel()
+
+
+def buildMesh(triangles):
+    """ Builds an indexed mesh from a triangle soup, merging corners that share a position and a normal. """
+    positions, inverse = weldPositions(triangles.reshape(-1, 3))
+    return indexedMesh(positions, inverse.astype(np.uint32))
+
+
+def cornerPairs(counts, starts):
+    """
+    Pairs every corner of a mesh, sorted by position, with each corner at the same position, itself included.
+    counts and starts give the number of corners at the position of each corner and the first of them. Yields
+    chunks of about NORMAL_CHUNK pairs as the first and last corner of the chunk, the index of each corner's
+    first pair within the chunk and the other corner of every pair.
+    """
+    ends = np.cumsum(counts)
+    first = 0
+    while first < len(counts):
+        # As many corners as fit NORMAL_CHUNK pairs, and at least one
+        last = max(int(np.searchsorted(ends, ends[first] - counts[first] + NORMAL_CHUNK, 'right')), first + 1)
+        chunkCounts = counts[first:last]
+        pairStarts = np.cumsum(chunkCounts) - chunkCounts
+        others = np.arange(pairStarts[-1] + chunkCounts[-1]) + np.repeat(starts[first:last] - pairStarts, chunkCounts)
+        yield first, last, pairStarts, others
+        first = last
+
+
+def indexedMesh(positions, indices, creaseAngle=CREASE_ANGLE):
+    """
+    Builds StlData from vertex positions and triangle indices, computing vertex normals. The normal of each
+    corner averages the faces around its position that meet its own face at less than creaseAngle degrees,
+    so curved surfaces shade smoothly and hard edges stay sharp. Corners with the same position and normal
+    share a vertex.
+    """
+    # Recompute normals from the winding order; the normals stored in STL files are often zero or wrong.
+    # The unnormalized cross product weights each face's contribution by its area.
+    faces = indices.reshape(-1, 3)
+    faceNormals = np.cross(positions[faces[:, 1]] - positions[faces[:, 0]],
+                           positions[faces[:, 2]] - positions[faces[:, 0]]).astype(np.float32)
+    lengths = np.linalg.norm(faceNormals, axis=1, keepdims=True)
+    unitNormals = np.divide(faceNormals, lengths, out=np.zeros_like(faceNormals), where=lengths > 0)
+    minimumCosine = np.float32(np.cos(np.radians(creaseAngle)))
+
+    # Sort the corners by position, so the corners at each position are contiguous
+    cornerPositions = np.asarray(indices, np.int64)
+    order = np.argsort(cornerPositions, kind='stable')
+    groupCounts = np.bincount(cornerPositions, minlength=len(positions))
+    counts = groupCounts[cornerPositions[order]]
+    starts = (np.cumsum(groupCounts) - groupCounts)[cornerPositions[order]]
+    # Gathering single components is several times faster than gathering rows
+    sortedFaces = order // 3
+    faceNormals = [np.ascontiguousarray(faceNormals[sortedFaces, axis]) for axis in range(3)]
+    unitNormals = [np.ascontiguousarray(unitNormals[sortedFaces, axis]) for axis in range(3)]
+
+    # Degenerate faces have no direction and are smoothed with nothing, not even themselves; they cover no pixels.
+    # Corners with the same faces around them add the same normals in the same order, so they match exactly.
+    normals = np.empty((len(order), 3), np.float32)
+    for first, last, pairStarts, others in cornerPairs(counts, starts):
+        chunkCounts = counts[first:last]
+        cosines = sum(np.repeat(unit[first:last], chunkCounts) * unit[others] for unit in unitNormals)
+        smooth = cosines >= minimumCosine
+        for axis in range(3):
+            normals[first:last, axis] = np.add.reduceat(np.where(smooth, faceNormals[axis][others], 0), pairStarts)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    normals += np.float32(0)
+
+    # Each corner uses the vertex of the first corner at its position with the same normal
+    components = [np.ascontiguousarray(normals[:, axis]) for axis in range(3)]
+    representatives = np.empty(len(order), np.int64)
+    for first, last, pairStarts, others in cornerPairs(counts, starts):
+        chunkCounts = counts[first:last]
+        same = np.repeat(components[0][first:last], chunkCounts) == components[0][others]
+        for component in components[1:]:
+            same &= np.repeat(component[first:last], chunkCounts) == component[others]
+        representatives[first:last] = np.minimum.reduceat(np.where(same, others, len(order)), pairStarts)
+    isVertex = representatives == np.arange(len(order))
+    vertexIds = np.cumsum(isVertex) - 1
+    newIndices = np.empty(len(order), np.uint32)
+    newIndices[order] = vertexIds[representatives]
+
+    vertices = np.hstack((positions[cornerPositions[order[isVertex]]], normals[isVertex])).astype(np.float32)
+    return StlData(vertices, newIndices)
+
+
+def rowKeys(rows, dims):
+    """
+    Returns one int64 per row of non-negative integers below dims, ordered like the rows, so np.unique
+    can sort plain integers. Row-wise np.unique is several times slower and holds the GIL throughout,
+    which stalls the GUI thread while a worker decimates. Rows whose keys would overflow are viewed as
+    opaque bytes instead, which are unique per row but not ordered like it.
+    """
+    if np.prod(dims, dtype=np.float64) >= 2 ** 62:
+        rows = np.ascontiguousarray(rows)
+        return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    return np.ravel_multi_index(tuple(rows.T), dims)
+
+
+def decimate(mesh, cellSize):
+    """ Simplifies a mesh by vertex clustering: all vertices in one grid cell merge into their mean. """
+    positions = np.asarray(mesh.positions(), np.float64)
+    if len(positions) == 0 or cellSize <= 0:
+        return mesh
+    cells = np.floor((positions - positions.min(axis=0)) / cellSize).astype(np.int64)
+    _, cluster = np.unique(rowKeys(cells, cells.max(axis=0) + 1), return_inverse=True)
+    cluster = cluster.ravel()
+    counts = np.bincount(cluster)
+    clustered = np.stack([np.bincount(cluster, positions[:, axis]) for axis in range(3)], axis=1)
+    clustered /= counts[:, None]
+
+    # Drop triangles that collapsed into a line or point, and triangles that now duplicate another
+    faces = cluster[mesh.indices.reshape(-1, 3)]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if len(faces):
+        _, first = np.unique(rowKeys(np.sort(faces, axis=1), (len(counts),) * 3), return_index=True)
+        faces = faces[np.sort(first)]
+
+    # Keep only the clusters that are still referenced
+    used, indices = np.unique(faces, return_inverse=True)
+    return indexedMesh(clustered[used].astype(np.float32), indices.astype(np.uint32).ravel())
+
+
+def cacheKey(path):
+    # Any change to the file moves its mtime or size, which produces a new key
+    stat = os.stat(path)
+    key = f"{CACHE_VERSION}|{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def saveArray(array, filename):
+    # Write to a temporary file first so a crash never leaves a half-written cache entry
+    directory = os.path.dirname(filename)
+    fd, tmpPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmpPath, filename)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+
+
+def readCache(cacheDir, key):
+    verticesPath = os.path.join(cacheDir, key + '.vertices.npy')
+    indicesPath = os.path.join(cacheDir, key + '.indices.npy')
+    if not (os.path.exists(verticesPath) and os.path.exists(indicesPath)):
+        return None
+    try:
+        return StlData(np.load(verticesPath, mmap_mode='r'),
+                       np.load(indicesPath, mmap_mode='r'))
+    except (OSError, ValueError):
+        # A corrupt entry is treated as a cache miss and rewritten
+        return None
+
+
+def writeCache(cacheDir, key, mesh):
+    os.makedirs(cacheDir, exist_ok=True)
+    saveArray(mesh.indices, os.path.join(cacheDir, key + '.indices.npy'))
+    saveArray(mesh.vertices, os.path.join(cacheDir, key + '.vertices.npy'))
+
+
+def decodeStl(data, progress=None):
+    """ Decodes the raw bytes of an STL file into a validated StlData mesh, reporting progress like loadStl. """
+    triangles = parseTriangles(data)
+    validateTriangles(triangles)
+    if progress is not None:
+        corners = triangles.reshape(-1, 3)
+        progress('parse', (corners.min(axis=0), corners.max(axis=0)))
+    mesh = buildMesh(triangles)
+    if progress is not None:
+        progress('index')
+    return mesh
+
+
+def loadStl(path, cacheDir=None, progress=None):
+    """
+    Loads an STL file into an indexed StlData mesh.
+
+    When cacheDir is given, the decoded arrays are stored there keyed by path, mtime and size,
+    and later loads of the unchanged file are memory-mapped from the cache instead of parsed.
+    When progress is given, it is called after each of the 'read', 'parse' and 'index' stages with
+    the stage name and, once they are known, the minimum and maximum corners of the mesh. A cache hit
+    finishes every stage at once. The callback may raise to abort the load.
+    """
+    key = cacheKey(path)
+    if cacheDir is not None:
+        mesh = readCache(cacheDir, key)
+        if mesh is not None:
+            if progress is not None:
+                progress('index', mesh.bounds())
+            return mesh
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if progress is not None:
+        progress('read')
+    mesh = decodeStl(data, progress)
+
+    if cacheDir is not None:
+        try:
+            writeCache(cacheDir, key, mesh)
+        except OSError as e:
+            print(f"Warning: could not cache STL file {path}: {e}")
+    return mesh
+
+
+def loadLods(key, mesh, cellFractions, cacheDir=None):
+    """
+    Returns simplified versions of a loaded STL mesh, one per cell size given as a fraction of its bounding diagonal.
+    When cacheDir is given, the results are cached there next to the mesh cached under key.
+    """
+    low, high = mesh.bounds()
+    diagonal = float(np.linalg.norm(np.asarray(high, np.float64) - low))
+    lods = []
+    for fraction in cellFractions:
+        lodKey = f"{key}.lod{fraction:g}"
+        lod = readCache(cacheDir, lodKey) if cacheDir is not None else None
+        if lod is None:
+            lod = decimate(mesh, fraction * diagonal)
+            if cacheDir is not None:
+                try:
+                    writeCache(cacheDir, lodKey, lod)
+                except OSError as e:
+                    print(f"Warning: could not cache simplified mesh {lodKey}: {e}")
+        lods.append(lod)
+    return lods
@@ -0,0 +1,167 @@
+import numpy as np
+from PySide6.QtCore import QByteArray, QUrl, Signal
+from PySide6.Qt3DCore import Qt3DCore
+from PySide6.Qt3DRender import Qt3DRender
+from src.constants import LOD_CELL_FRACTIONS, STL_PLACEHOLDER_SIZE
+
+# The twelve edges of a box, as pairs of indices into the corners built by boxVertices
+BOX_EDGES = np.array([0, 1, 2, 3, 4, 5, 6, 7,
+                      0, 2, 1, 3, 4, 6, 5, 7,
+                      0, 4, 1, 5, 2, 6, 3, 7], np.uint32)
+
+
+def createGeometry(vertices, indices, parent=None):
+    """ Creates a QGeometry from interleaved (N, 6) position/normal vertices and uint32 triangle indices. """
+    geometry = Qt3DCore.QGeometry(parent)
+    stride = 6 * 4
+
+    vertexBuffer = Qt3DCore.QBuffer(geometry)
+    vertexBuffer.setData(QByteArray(vertices.tobytes()))
+    indexBuffer = Qt3DCore.QBuffer(geometry)
+    indexBuffer.setData(QByteArray(indices.tobytes()))
+
+    # Positions and normals share one buffer, so both attributes read it with the same stride
+    for name, offset in ((Qt3DCore.QAttribute.defaultPositionAttributeName(), 0),
+                         (Qt3DCore.QAttribute.defaultNormalAttributeName(), 3 * 4)):
+        attribute = Qt3DCore.QAttribute(geometry)
+        attribute.setName(name)
+        attribute.setAttributeType(Qt3DCore.QAttribute.VertexAttribute)
+        attribute.setVertexBaseType(Qt3DCore.QAttribute.Float)
+        attribute.setVertexSize(3)
+        attribute.setByteOffset(offset)
+        attribute.setByteStride(stride)
+        attribute.setCount(len(vertices))
+        attribute.setBuffer(vertexBuffer)
+        geometry.addAttribute(attribute)
+
+    indexAttribute = Qt3DCore.QAttribute(geometry)
+    indexAttribute.setAttributeType(Qt3DCore.QAttribute.IndexAttribute)
+    indexAttribute.setVertexBaseType(Qt3DCore.QAttribute.UnsignedInt)
+    indexAttribute.setCount(len(indices))
+    indexAttribute.setBuffer(indexBuffer)
+    geometry.addAttribute(indexAttribute)
+
+    return geometry
+
+
+def boxVertices(low, high):
+    """ Returns the eight corners of a box as (8, 6) position/normal vertices, normals pointing outwards. """
+    low = np.asarray(low, np.float32)
+    high = np.asarray(high, np.float32)
+    # Corner i takes the high coordinate on the axes whose bit is set in i
+    bits = (np.arange(8)[:, None] >> np.arange(3)) & 1
+    positions = np.where(bits, high, low)
+    normals = (2 * bits - 1) / np.sqrt(3)
+    return np.hstack((positions, normals)).astype(np.float32)
+
+
+class StlMesh(Qt3DRender.QGeometryRenderer):
+    """
+    The StlMesh class renders an STL file through a custom QGeometry built from NumPy buffers.
+    It mirrors the source()/setSource() API of Qt3DRender.QMesh, so it can be used in its place.
+    Until its data is set, the mesh draws the edges of a placeholder box, so an STL file that is still
+    being imported in the background already shows where it will appear. The mesh does not keep the
+    decoded arrays itself: they are read through the asset store, whose cache limits the memory they use.
+
+    Attributes
+    ----------
+    assets : AssetStore
+        The store holding the processed mesh.
+    sourceUrl : QUrl
+        The URL of the STL file the mesh was imported from.
+    asset : str
+        The hash of the mesh in the asset store, or None before it is known.
+    loaded : bool
+        Whether the data is set.
+    data : StlData
+        The decoded vertex and index arrays, or None before the data is set.
+    placeholderBounds : tuple
+        The minimum and maximum corners of the placeholder box.
+    meshBounds : tuple
+        The minimum and maximum corners of the loaded mesh, or None before the data is set.
+    lods : list
+        The renderers for each level of detail, starting with this full-detail mesh.
+        Every level is shared by all entities using the mesh, and the renderers are kept when the data
+        arrives, so entities never have to swap them.
+
+    Signals
+    -------
+    boundsChanged():
+        Emitted when the placeholder box changes or the data is set.
+
+    Methods
+    -------
+    source():
+        Returns the URL of the loaded STL file.
+    setSource(url):
+        Imports the STL file at the given URL and rebuilds the geometry and its levels of detail.
+    setPlaceholder(low, high):
+        Draws a box with the given corners until the data is set.
+    setData(url, asset, data, lods):
+        Replaces the placeholder with a loaded mesh and its levels of detail.
+    replaceGeometries(geometries):
+        Sets the (geometry, primitive type) of every level and deletes the geometries they replace.
+    bounds():
+        Returns the minimum and maximum corners of the mesh, or of the placeholder box.
+    """
+
+    boundsChanged = Signal()
+
+    def __init__(self, assets, parent=None):
+        super().__init__(parent)
+        self.assets = assets
+        self.sourceUrl = QUrl()
+        self.asset = None
+        self.loaded = False
+        self.meshBounds = None
+        self.lods = [self]
+        for _ in LOD_CELL_FRACTIONS:
+            self.lods.append(Qt3DRender.QGeometryRenderer(self))
+        half = STL_PLACEHOLDER_SIZE / 2
+        self.setPlaceholder((-half, -half, -half), (half, half, half))
+
+    @property
+    def data(self):
+        return self.assets.load(self.asset)[0] if self.loaded else None
+
+    def source(self):
+        return self.sourceUrl
+
+    def setSource(self, url):
+        # Raises OSError or ValueError if the file cannot be read as an STL
+        asset = self.assets.importFile(url.toLocalFile())
+        self.setData(url, asset, *self.assets.load(asset))
+
+    def setPlaceholder(self, low, high):
+        self.placeholderBounds = (np.asarray(low, np.float32), np.asarray(high, np.float32))
+        geometry = createGeometry(boxVertices(low, high), BOX_EDGES, self)
+        self.replaceGeometries([(geometry, Qt3DRender.QGeometryRenderer.Lines)] * len(self.lods))
+        self.boundsChanged.emit()
+
+    def setData(self, url, asset, data, lods):
+        self.sourceUrl = QUrl(url)
+        self.asset = asset
+        self.loaded = True
+        self.meshBounds = data.bounds()
+        geometries = [(createGeometry(data.vertices, data.indices, self), Qt3DRender.QGeometryRenderer.Triangles)]
+        for renderer, lod in zip(self.lods[1:], lods):
+            if len(lod.indices) == 0:
+                # The mesh collapsed completely, so keep drawing the previous level
+                geometries.append(geometries[-1])
+            else:
+                geometries.append((createGeometry(lod.vertices, lod.indices, renderer),
+                                   Qt3DRender.QGeometryRenderer.Triangles))
+        self.replaceGeometries(geometries)
+        self.boundsChanged.emit()
+
+    def replaceGeometries(self, geometries):
+        # Levels may share a geometry, so delete the previous ones only once every level has moved on
+        previous = {id(renderer.geometry()): renderer.geometry() for renderer in self.lods if renderer.geometry()}
+        for renderer, (geometry, primitiveType) in zip(self.lods, geometries):
+            renderer.setPrimitiveType(primitiveType)
+            renderer.setGeometry(geometry)
+        for geometry in previous.values():
+            geometry.deleteLater()
+
+    def bounds(self):
+        return self.meshBounds if self.loaded else self.placeholderBounds
@@ -0,0 +1,107 @@
+import os
+
+from PySide6.QtCore import QSize, Qt
+from PySide6.QtWidgets import (QDialog, QDialogButtonBox, QFileDialog, QHBoxLayout, QLabel, QListView, QListWidget,
+                               QListWidgetItem, QPushButton, QVBoxLayout)
+
+
+class StlPicker(QDialog):
+    """
+    The StlPicker class is a dialog that shows the STL files of a folder with their thumbnails, so files can be
+    chosen by how they look without loading them into the scene. Thumbnails are requested from a
+    ThumbnailRenderer for every file of the folder and fill in as they are rendered.
+
+    Attributes
+    ----------
+    thumbnails : ThumbnailRenderer
+        The renderer of the file thumbnails.
+    directory : str
+        The folder whose files are listed.
+    items : dict
+        A dictionary mapping the path of each listed file to its list item.
+    directoryLabel : QLabel
+        Shows the folder.
+    fileList : QListWidget
+        The files, as thumbnails with their names.
+
+    Methods
+    -------
+    setDirectory(directory):
+        Lists the STL files of a folder and requests their thumbnails.
+    chooseDirectory():
+        Asks for another folder to list.
+    selectedPaths():
+        Returns the paths of the selected files.
+    onThumbnailReady(icon, owners):
+        Shows a rendered thumbnail on the items of the files it belongs to.
+    """
+
+    def __init__(self, thumbnails, directory, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Import STL")
+        self.thumbnails = thumbnails
+        self.directory = None
+        self.items = {}
+
+        self.directoryLabel = QLabel()
+        folderButton = QPushButton("Folder...")
+        folderButton.clicked.connect(self.chooseDirectory)
+        header = QHBoxLayout()
+        header.addWidget(self.directoryLabel, 1)
+        header.addWidget(folderButton)
+
+        self.fileList = QListWidget()
+        self.fileList.setViewMode(QListView.IconMode)
+        self.fileList.setIconSize(QSize(thumbnails.size, thumbnails.size))
+        self.fileList.setResizeMode(QListView.Adjust)
+        self.fileList.setMovement(QListView.Static)
+        self.fileList.setUniformItemSizes(True)
+        self.fileList.setSelectionMode(QListWidget.ExtendedSelection)
+        self.fileList.itemDoubleClicked.connect(self.accept)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Open | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(header)
+        layout.addWidget(self.fileList)
+        layout.addWidget(buttons)
+        self.resize(640, 480)
+
+        thumbnails.thumbnailReady.connect(self.onThumbnailReady)
+        self.setDirectory(directory)
+
+    def setDirectory(self, directory):
+        self.directory = directory
+        self.directoryLabel.setText(os.path.abspath(directory))
+        self.fileList.clear()
+        self.items = {}
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.lower().endswith('.stl'))
+        except OSError as e:
+            self.directoryLabel.setText(f"Error: could not list {directory}: {e}")
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            item = QListWidgetItem(name, self.fileList)
+            item.setData(Qt.UserRole, path)
+            item.setToolTip(path)
+            self.items[path] = item
+            icon = self.thumbnails.fileIcon(path, path)
+            item.setIcon(self.thumbnails.placeholder if icon is None else icon)
+
+    def chooseDirectory(self):
+        directory = QFileDialog.getExistingDirectory(self, "Choose a folder of STL files", self.directory)
+        if directory:
+            self.setDirectory(directory)
+
+    def selectedPaths(self):
+        return [item.data(Qt.UserRole) for item in self.fileList.selectedItems()]
+
+    def onThumbnailReady(self, icon, owners):
+        # Owners that are not listed files, e.g. entities of the object list, are skipped
+        for owner in owners:
+            item = self.items.get(owner)
+            if item is not None and icon is not None:
+                item.setIcon(icon)
@@ -0,0 +1,71 @@
+import numpy as np
+from PySide6.Qt3DExtras import Qt3DExtras
+from src.stlLoader import StlData
+from src.stlMesh import StlMesh
+
+# The outward normal and the two in-plane axes of each face of a box, in the order the corners wind
+BOX_FACES = np.array([((1, 0, 0), (0, 1, 0), (0, 0, 1)), ((-1, 0, 0), (0, 0, 1), (0, 1, 0)),
+                      ((0, 1, 0), (0, 0, 1), (1, 0, 0)), ((0, -1, 0), (1, 0, 0), (0, 0, 1)),
+                      ((0, 0, 1), (1, 0, 0), (0, 1, 0)), ((0, 0, -1), (0, 1, 0), (1, 0, 0))], np.float32)
+
+
+def cuboidMesh(low, high):
+    """ Returns StlData for a box with the given corners, with four vertices and flat normals per face. """
+    low = np.asarray(low, np.float32)
+    high = np.asarray(high, np.float32)
+    center = (low + high) / 2
+    half = (high - low) / 2
+    normals, uAxes, vAxes = BOX_FACES[:, 0], BOX_FACES[:, 1], BOX_FACES[:, 2]
+    # Corners go counter-clockwise seen from outside, so triangles (0, 1, 2) and (0, 2, 3) face outwards
+    signs = np.array(((-1, -1), (1, -1), (1, 1), (-1, 1)), np.float32)
+    offsets = normals[:, None] + signs[None, :, :1] * uAxes[:, None] + signs[None, :, 1:] * vAxes[:, None]
+    positions = (center + offsets * half).reshape(-1, 3)
+    vertices = np.hstack((positions, np.repeat(normals, 4, axis=0))).astype(np.float32)
+    indices = (np.array((0, 1, 2, 0, 2, 3), np.uint32) + 4 * np.arange(6, dtype=np.uint32)[:, None]).ravel()
+    return StlData(vertices, indices)
+
+
+def sphereMesh(radius, rings=16, slices=16):
+    """ Returns StlData for a sphere tessellated like QSphereMesh, in rings of latitude and slices of longitude. """
+    latitudes = np.linspace(-np.pi / 2, np.pi / 2, rings + 1, dtype=np.float32)
+    longitudes = np.linspace(0, 2 * np.pi, slices + 1, dtype=np.float32)
+    latitude, longitude = np.meshgrid(latitudes, longitudes, indexing='ij')
+    normals = np.stack((np.cos(latitude) * np.cos(longitude), np.sin(latitude),
+                        -np.cos(latitude) * np.sin(longitude)), axis=-1).reshape(-1, 3)
+    vertices = np.hstack((normals * radius, normals)).astype(np.float32)
+    # Two triangles per quad between neighbouring rings; the quads at the poles collapse to one triangle
+    ring = np.arange(rings, dtype=np.uint32)[:, None] * (slices + 1)
+    corner = ring + np.arange(slices, dtype=np.uint32)
+    above = corner + slices + 1
+    indices = np.stack((corner, corner + 1, above + 1, corner, above + 1, above), axis=-1).ravel()
+    return StlData(vertices, indices.astype(np.uint32))
+
+
+def bakeTransforms(mesh, transforms, scales):
+    """
+    Returns the (K, N, 3) world positions and unit normals of the vertices of one mesh under K (K, 4, 4)
+    transforms, with one batched matrix multiply. scales are the (K, 3) scales included in the transforms.
+    """
+    matrices = transforms[:, :3, :3]
+    positions = np.einsum('kij,vj->kvi', matrices, mesh.positions()) + transforms[:, None, :3, 3]
+    # Normals take the inverse transpose, which for a rotation times a scale is the rotation over the scale
+    squares = scales ** 2
+    normals = np.einsum('kij,vj->kvi', matrices / np.where(squares == 0, 1, squares)[:, None, :], mesh.normals())
+    lengths = np.linalg.norm(normals, axis=2, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return positions, normals
+
+
+def meshData(mesh):
+    """
+    Returns the vertices and indices of a shared mesh as StlData, in the mesh's local space, or None for an
+    STL mesh that is still importing. Reads the Qt mesh, so call it on the GUI thread.
+    """
+    if isinstance(mesh, Qt3DExtras.QCuboidMesh):
+        half = np.array((mesh.xExtent(), mesh.yExtent(), mesh.zExtent()), np.float32) / 2
+        return cuboidMesh(-half, half)
+    if isinstance(mesh, Qt3DExtras.QSphereMesh):
+        return sphereMesh(mesh.radius(), mesh.rings(), mesh.slices())
+    if isinstance(mesh, StlMesh):
+        return mesh.data
+    return None
@@ -0,0 +1,412 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PySide6.QtCore import QObject, Qt, Signal
+from PySide6.QtGui import QIcon, QImage, QPixmap
+from src.assetStore import AssetStore
+from src.constants import (DEFAULT_COLOR, STL_SCALE, THUMBNAIL_DIR, THUMBNAIL_MEMORY_ICONS, THUMBNAIL_SIZE,
+                           THUMBNAIL_WORKERS, ShapeType)
+from src.profiler import profiled
+from src.stlLoader import parseTriangles, validateTriangles
+from src.tessellation import cuboidMesh, sphereMesh
+
+# Bumped whenever the renderer draws differently, so cached thumbnails of older versions are not used
+THUMBNAIL_VERSION = 1
+# The view every thumbnail is drawn from: turned about the vertical axis, then tilted towards the camera, in degrees
+VIEW_YAW = 35
+VIEW_PITCH = 25
+SUPERSAMPLING = 2  # Pixels rendered along each side of a thumbnail pixel, averaged to smooth the edges
+MARGIN = 0.06  # Space left around the mesh, as a fraction of the thumbnail size
+AMBIENT = 0.3  # Brightness of faces turned away from the light
+LIGHT = np.array((-0.3, 0.5, 1.0)) / np.linalg.norm((-0.3, 0.5, 1.0))  # Towards the light, in view space
+RASTER_CHUNK = 1 << 20  # Candidate pixels tested at a time, which bounds the memory of large meshes
+
+
+def viewRotation(yaw=VIEW_YAW, pitch=VIEW_PITCH):
+    # Rotates the Y-up scene so the camera looks down -Z at the mesh from above and to the side
+    yaw, pitch = np.radians(yaw), np.radians(pitch)
+    turn = np.array(((np.cos(yaw), 0, np.sin(yaw)), (0, 1, 0), (-np.sin(yaw), 0, np.cos(yaw))))
+    tilt = np.array(((1, 0, 0), (0, np.cos(pitch), -np.sin(pitch)), (0, np.sin(pitch), np.cos(pitch))))
+    return tilt @ turn
+
+
+def rasterize(corners, shades, size):
+    """
+    Draws triangles given by (T, 3, 3) corners in pixel coordinates, with the depth towards the camera as the
+    third coordinate, into a size by size image. Returns the (size, size) shade of the nearest triangle at each
+    pixel center and a mask of the pixels that any triangle covers.
+    """
+    depthBuffer = np.full(size * size, -np.inf)
+    shadeBuffer = np.zeros(size * size)
+    # The pixel centers inside each triangle's bounding box are the candidates
+    low = np.ceil(corners[:, :, :2].min(axis=1) - 0.5).astype(np.int64)
+    high = np.floor(corners[:, :, :2].max(axis=1) - 0.5).astype(np.int64)
+    low = np.maximum(low, 0)
+    high = np.minimum(high, size - 1)
+    widths = np.maximum(high[:, 0] - low[:, 0] + 1, 0)
+    counts = widths * np.maximum(high[:, 1] - low[:, 1] + 1, 0)
+    ends = np.cumsum(counts)
+
+    first = 0
+    while first < len(corners):
+        # As many triangles as fit RASTER_CHUNK candidates, and at least one
+        last = max(int(np.searchsorted(ends, ends[first] - counts[first] + RASTER_CHUNK, 'right')), first + 1)
+        chunk = slice(first, last)
+        first = last
+        chunkCounts = counts[chunk]
+        if not chunkCounts.any():
+            continue
+        triangle = np.repeat(np.arange(chunk.start, chunk.stop), chunkCounts)
+        offset = np.arange(len(triangle)) - np.repeat(np.cumsum(chunkCounts) - chunkCounts, chunkCounts)
+        x = low[triangle, 0] + offset % widths[triangle]
+        y = low[triangle, 1] + offset // widths[triangle]
+
+        # Edge functions of the pixel center against each side; inside when all agree with the triangle's area
+        a, b, c = (corners[triangle, i] for i in range(3))
+        px, py = x + 0.5, y + 0.5
+        w0 = (c[:, 0] - b[:, 0]) * (py - b[:, 1]) - (c[:, 1] - b[:, 1]) * (px - b[:, 0])
+        w1 = (a[:, 0] - c[:, 0]) * (py - c[:, 1]) - (a[:, 1] - c[:, 1]) * (px - c[:, 0])
+        w2 = (b[:, 0] - a[:, 0]) * (py - a[:, 1]) - (b[:, 1] - a[:, 1]) * (px - a[:, 0])
+        area = w0 + w1 + w2
+        inside = (area != 0) & (w0 * area >= 0) & (w1 * area >= 0) & (w2 * area >= 0)
+        if not inside.any():
+            continue
+        triangle, area = triangle[inside], area[inside]
+        depth = (w0[inside] * a[inside, 2] + w1[inside] * b[inside, 2] + w2[inside] * c[inside, 2]) / area
+        pixel = y[inside] * size + x[inside]
+
+        # Keep the nearest candidate of each pixel, then only where it is nearer than what is drawn already
+        order = np.lexsort((-depth, pixel))
+        pixel, depth, triangle = pixel[order], depth[order], triangle[order]
+        nearest = np.ones(len(pixel), bool)
+        nearest[1:] = pixel[1:] != pixel[:-1]
+        pixel, depth, triangle = pixel[nearest], depth[nearest], triangle[nearest]
+        closer = depth > depthBuffer[pixel]
+        depthBuffer[pixel[closer]] = depth[closer]
+        shadeBuffer[pixel[closer]] = shades[triangle[closer]]
+
+    return shadeBuffer.reshape(size, size), np.isfinite(depthBuffer).reshape(size, size)
+
+
+@profiled('renderThumbnail', 'ui')
+def renderThumbnail(triangles, color=DEFAULT_COLOR, size=THUMBNAIL_SIZE):
+    """
+    Renders a (T, 3, 3) array of triangle corners, fitted to the image, into a (size, size, 4) uint8 array of
+    premultiplied RGBA pixels with a transparent background. Faces are shaded flat by one directional light,
+    on both sides, so meshes with inconsistent winding still look solid.
+    """
+    image = size * SUPERSAMPLING
+    corners = np.asarray(triangles, np.float64).reshape(-1, 3, 3) @ viewRotation().T
+    if len(corners) == 0:
+        return np.zeros((size, size, 4), np.uint8)
+    low, high = corners.reshape(-1, 3).min(axis=0), corners.reshape(-1, 3).max(axis=0)
+    extent = max(high[0] - low[0], high[1] - low[1])
+    scale = image * (1 - 2 * MARGIN) / extent if extent > 0 else 1.0
+    center = (low + high) / 2
+    # Pixel rows go down, so Y is flipped
+    pixels = np.empty_like(corners)
+    pixels[..., 0] = (corners[..., 0] - center[0]) * scale + image / 2
+    pixels[..., 1] = (center[1] - corners[..., 1]) * scale + image / 2
+    pixels[..., 2] = corners[..., 2]
+
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    np.divide(normals, lengths[:, None], out=normals, where=lengths[:, None] > 0)
+    shades = AMBIENT + (1 - AMBIENT) * np.abs(normals @ LIGHT)
+
+    shade, covered = rasterize(pixels, shades, image)
+    rgba = np.empty((image, image, 4))
+    rgba[..., :3] = shade[..., None] * (np.asarray(color[:3]) / 255)
+    rgba[..., 3] = 1
+    rgba *= covered[..., None] * (color[3] / 255 if len(color) > 3 else 1)
+    # Average each block of samples into one premultiplied pixel
+    rgba = rgba.reshape(size, SUPERSAMPLING, size, SUPERSAMPLING, 4).mean(axis=(1, 3))
+    return np.round(rgba * 255).astype(np.uint8)
+
+
+def toImage(pixels):
+    # Copied, so the image does not refer to the array's memory
+    size = pixels.shape[0]
+    return QImage(np.ascontiguousarray(pixels).tobytes(), size, size, 4 * size,
+                  QImage.Format_RGBA8888_Premultiplied).copy()
+
+
+def proportions(extents):
+    # Meshes are fitted to the thumbnail, so only the ratios between the extents change the picture
+    extents = np.abs(np.asarray(extents, np.float64))
+    largest = extents.max()
+    return np.round(extents / largest, 3) if largest > 0 else np.ones(len(extents))
+
+
+def stlContent(assetHash, ratios=(1, 1, 1)):
+    # An unscaled STL entity and its file share one thumbnail
+    return f"stl:{assetHash}:{','.join(f'{r:g}' for r in ratios)}"
+
+
+def thumbnailKey(content, color, size):
+    """ Returns the cache key of a thumbnail of some content, e.g. an STL file's hash, drawn in a color and size. """
+    settings = f"{THUMBNAIL_VERSION}|{content}|{tuple(color)}|{size}|{VIEW_YAW}|{VIEW_PITCH}|{SUPERSAMPLING}"
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+
+class ThumbnailCache:
+    """
+    The ThumbnailCache class keeps rendered thumbnails as PNG files in a directory, named by their thumbnail key,
+    so they survive restarts and are shared by the GUI and thumbnails.py. Several threads and processes may use
+    one directory at the same time.
+
+    Attributes
+    ----------
+    directory : str
+        The thumbnail directory.
+
+    Methods
+    -------
+    path(key):
+        Returns the file of a thumbnail.
+    load(key):
+        Returns a cached thumbnail as a QImage, or None.
+    save(key, image):
+        Stores a thumbnail.
+    """
+
+    def __init__(self, directory=THUMBNAIL_DIR):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def load(self, key):
+        image = QImage(self.path(key))
+        return None if image.isNull() else image
+
+    def save(self, key, image):
+        # Written to a temporary file first so a crash never leaves a half-written thumbnail
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix='.png')
+        os.close(fd)
+        try:
+            if not image.save(tmpPath, 'PNG'):
+                raise OSError(f"could not write {tmpPath}")
+            os.replace(tmpPath, self.path(key))
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+
+
+def fileThumbnail(path, cache, size=THUMBNAIL_SIZE, assets=None):
+    """
+    Returns the key and image of the thumbnail of an STL file and whether it was cached, rendering and caching
+    it on a miss. The file is not read if assets knows its hash and either the thumbnail or the mesh is stored.
+    Raises OSError or ValueError if the file cannot be read.
+    """
+    data = None
+    assetHash = assets.knownHash(path) if assets is not None else None
+    if assetHash is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        assetHash = hashlib.sha256(data).hexdigest()
+    key = thumbnailKey(stlContent(assetHash), DEFAULT_COLOR, size)
+    image = cache.load(key)
+    if image is not None:
+        return key, image, True
+
+    if data is None and assets.contains(assetHash):
+        triangles = assets.load(assetHash)[0].triangles()
+    else:
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        triangles = parseTriangles(data)
+        validateTriangles(triangles)
+    image = toImage(renderThumbnail(triangles, DEFAULT_COLOR, size))
+    try:
+        cache.save(key, image)
+    except OSError as e:
+        print(f"Warning: could not store the thumbnail of {path} in {cache.directory}: {e}")
+    return key, image, False
+
+
+class ThumbnailRenderer(QObject):
+    """
+    The ThumbnailRenderer class renders small pictures of entities and STL files on worker threads for the
+    object list and the STL picker. Thumbnails are drawn by a NumPy rasterizer rather than Qt3D, which only
+    renders on the GUI thread and needs an OpenGL context, and are kept in a ThumbnailCache keyed by the
+    content and the render settings, so each one is rendered once across sessions. The most recently used
+    thumbnails are also kept in memory as icons. A request for a thumbnail that is not in memory returns None
+    and queues it; thumbnailReady is emitted with the owners that asked for it once it is loaded or rendered.
+    The workers only hand back QImages; icons are made on the GUI thread.
+
+    Attributes
+    ----------
+    assets : AssetStore
+        The store the meshes of STL entities are read from.
+    cache : ThumbnailCache
+        The thumbnails on disk.
+    size : int
+        The width and height of the thumbnails in pixels.
+    pool : ThreadPoolExecutor
+        The worker threads.
+    icons : OrderedDict
+        A dictionary mapping thumbnail keys to icons, least recently used first.
+    waiting : dict
+        A dictionary mapping each request being rendered, a thumbnail key or the AssetStore.fileKey of an STL
+        file, to a dictionary whose keys are the owners waiting for it.
+    fileKeys : dict
+        A dictionary mapping the AssetStore.fileKey of each STL file rendered to its thumbnail key.
+    failed : set
+        The requests that could not be rendered, which are not tried again.
+    placeholder : QIcon
+        A transparent icon of the thumbnail size, shown until a thumbnail is ready.
+
+    Signals
+    -------
+    thumbnailReady(object, list):
+        Emitted with the QIcon, or None if it could not be rendered, and the owners that requested it.
+
+    Methods
+    -------
+    icon(key, color, load, owner):
+        Returns the icon of a thumbnail key, or None and queues it; load returns the triangles on a worker thread.
+    entitySource(entity):
+        Returns the thumbnail key, color and triangle loader of an entity, or None while its mesh loads.
+    entityKey(entity):
+        Returns the thumbnail key of an entity in its current shape, proportions and color, or None.
+    entityIcon(entity):
+        Returns the thumbnail key of an entity with its icon, or None for the icon and queues it.
+    fileIcon(path, owner):
+        Returns the icon of an STL file, or None and queues it.
+    shutdown():
+        Stops the worker threads, dropping queued thumbnails.
+    """
+
+    thumbnailReady = Signal(object, list)
+
+    # Emitted by the workers; the connection is queued, so the slot runs on the GUI thread
+    rendered = Signal(object, str, object)
+
+    def __init__(self, assets, directory=THUMBNAIL_DIR, size=THUMBNAIL_SIZE, parent=None):
+        super().__init__(parent)
+        self.assets = assets
+        self.cache = ThumbnailCache(directory)
+        self.size = size
+        self.pool = ThreadPoolExecutor(THUMBNAIL_WORKERS, thread_name_prefix='Thumbnails')
+        self.icons = OrderedDict()
+        self.waiting = {}
+        self.fileKeys = {}
+        self.failed = set()
+        blank = QPixmap(size, size)
+        blank.fill(Qt.transparent)
+        self.placeholder = QIcon(blank)
+        self.rendered.connect(self.onRendered)
+
+    def cachedIcon(self, key):
+        icon = self.icons.get(key)
+        if icon is not None:
+            self.icons.move_to_end(key)
+        return icon
+
+    def enqueue(self, request, owner, job, *args):
+        # Returns whether the request was new; later owners of a queued request just wait for it too
+        if request in self.failed:
+            return False
+        owners = self.waiting.get(request)
+        if owners is None:
+            self.waiting[request] = owners = {}
+            self.pool.submit(job, request, *args)
+        if owner is not None:
+            owners[owner] = None
+        return True
+
+    def icon(self, key, color, load, owner=None):
+        icon = self.cachedIcon(key)
+        if icon is None:
+            self.enqueue(key, owner, self.run, color, load)
+        return icon
+
+    def entitySource(self, entity):
+        # Only NumPy values are captured, so load never touches the entity on the worker thread
+        store, row = entity.store, entity.row
+        color = tuple(store.color[row].tolist())
+        if entity.shape == ShapeType.SPHERE:
+            content, load = 'sphere', lambda: sphereMesh(1).triangles()
+        elif entity.shape == ShapeType.CUBE:
+            ratios = proportions(store.dimensions[row])
+            content = f"cube:{','.join(f'{r:g}' for r in ratios)}"
+            load = lambda: cuboidMesh(-ratios / 2, ratios / 2).triangles()
+        elif not entity.mesh.loaded:
+            # The thumbnail is requested again when the model hears that the mesh loaded
+            return None
+        else:
+            asset, assets = entity.mesh.asset, self.assets
+            ratios = proportions(store.scale[row] / STL_SCALE)
+            content, load = stlContent(asset, ratios), lambda: assets.load(asset)[0].triangles() * ratios
+        return thumbnailKey(content, color, self.size), color, load
+
+    def entityKey(self, entity):
+        source = self.entitySource(entity)
+        return None if source is None else source[0]
+
+    def entityIcon(self, entity):
+        source = self.entitySource(entity)
+        if source is None:
+            return None, None
+        key, color, load = source
+        return key, self.icon(key, color, load, entity)
+
+    def fileIcon(self, path, owner=None):
+        try:
+            fileKey = AssetStore.fileKey(path)
+        except OSError:
+            return None
+        key = self.fileKeys.get(fileKey)
+        icon = self.cachedIcon(key) if key is not None else None
+        if icon is None:
+            self.enqueue(fileKey, owner, self.runFile, path)
+        return icon
+
+    def shutdown(self):
+        self.waiting.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, key, color, load):
+        # Runs on a worker thread
+        try:
+            image = self.cache.load(key)
+            if image is None:
+                image = toImage(renderThumbnail(load(), color, self.size))
+                self.cache.save(key, image)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not render thumbnail {key}: {e}")
+            image = None
+        self.rendered.emit(key, key, image)
+
+    def runFile(self, fileKey, path):
+        # Runs on a worker thread
+        try:
+            key, image, _ = fileThumbnail(path, self.cache, self.size, self.assets)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not render a thumbnail of {path}: {e}")
+            key, image = '', None
+        self.rendered.emit(fileKey, key, image)
+
+    def onRendered(self, request, key, image):
+        owners = self.waiting.pop(request, None)
+        if owners is None:
+            # Shut down meanwhile
+            return
+        if image is None:
+            self.failed.add(request)
+            self.thumbnailReady.emit(None, list(owners))
+            return
+        if request != key:
+            self.fileKeys[request] = key
+        icon = QIcon(QPixmap.fromImage(image))
+        self.icons[key] = icon
+        if len(self.icons) > THUMBNAIL_MEMORY_ICONS:
+            self.icons.popitem(last=False)
+        self.thumbnailReady.emit(icon, list(owners))
@@ -1,7 +1,8 @@
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
-                               QPushButton, QListWidget, QLabel, QListWidgetItem, QComboBox,
-                               QLineEdit, QColorDialog, QFormLayout, QDialog)
-from PySide6.QtCore import Qt
+                               QPushButton, QListView, QLabel, QComboBox,
+                               QLineEdit, QColorDialog, QFormLayout, QDialog, QProgressBar, QCheckBox)
+from PySide6.QtCore import QItemSelectionModel, QSize
+from src.sceneModel import EntityRole, SceneFilterModel, SceneModel
 
 class UIWidget(QWidget):
     """ 
@@ -12,25 +13,69 @@ class UIWidget(QWidget):
     ----------
     layout : QVBoxLayout
         a vertical layout for the list and buttons
-    entityWidgetList : QListWidget
-        a list widget to keep track of the objects
+    sceneModel : SceneModel
+        a model listing the objects, with an index from object to row
+    filterModel : SceneFilterModel
+        a proxy model filtering the objects by name and shape
+    searchEdit : QLineEdit
+        an input field for searching objects by name
+    shapeFilterComboBox : QComboBox
+        a combo box for showing only objects of one shape
+    entityListView : QListView
+        a view of the filtered objects
     shapeLabel : QLabel
         a label for the shape selection combo box
     shapeComboBox : QComboBox
         a combo box for selecting the shape to add
     addButton : QPushButton
         a button to add shapes
+    importButton : QPushButton
+        a button to pick STL files to import
+    importProgressBar : QProgressBar
+        a progress bar shown while STL files are imported
+    cancelImportButton : QPushButton
+        a button to cancel the STL imports in progress
+    statusLabel : QLabel
+        a label showing the last error or status message
     deleteButton : QPushButton
         a button to delete entities
+    exportButton : QPushButton
+        a button to export the scene to an STL, OBJ or glTF file
+    snapCheckBox : QCheckBox
+        a check box making dragged entities stop at and snap to other entities instead of passing through them
+    instancedCheckBox : QCheckBox
+        a check box drawing the entities that share a mesh with one instanced draw call
+    freezeButton : QPushButton
+        a button baking the listed objects into static batches
+    thawButton : QPushButton
+        a button drawing every frozen object on its own again
     undoButton : QPushButton
         a button to undo the last change
     redoButton : QPushButton
         a button to redo the last undone change
+    profilerButton : QPushButton
+        a toggle button showing the profiler panel
 
     Methods
     -------
     addToList(entity):
-        Adds an entity to the list
+        Adds an entity to the list and selects it
+    addEntitiesToList(entities):
+        Adds several entities to the list at once
+    removeFromList(entities):
+        Removes entities from the list
+    currentEntity():
+        Returns the selected entity, or None
+    listedEntities():
+        Returns the entities the search and shape filters show
+    selectEntity(entity):
+        Selects an entity in the list
+    applyShapeFilter(text):
+        Filters the list by the shape chosen in the shape filter
+    showImportProgress(done, total):
+        Shows the progress of the STL imports, or hides it once they are done
+    showStatus(message):
+        Shows a status or error message
     """
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -38,9 +83,32 @@ class UIWidget(QWidget):
         # Create a vertical layout for the list and buttons
         self.layout = QVBoxLayout(self)
 
+        # Create inputs for searching the objects by name and filtering them by shape
+        self.searchEdit = QLineEdit()
+        self.searchEdit.setPlaceholderText("Search objects")
+        self.layout.addWidget(self.searchEdit)
+        self.shapeFilterComboBox = QComboBox()
+        self.shapeFilterComboBox.addItem("All shapes")
+        self.shapeFilterComboBox.addItem("Cube")
+        self.shapeFilterComboBox.addItem("Sphere")
+        self.shapeFilterComboBox.addItem("STL")
+        self.layout.addWidget(self.shapeFilterComboBox)
+
         # Create a list to keep track of the objects
-        self.entityWidgetList = QListWidget()
-        self.layout.addWidget(self.entityWidgetList)
+        self.sceneModel = SceneModel(self)
+        self.filterModel = SceneFilterModel(self)
+        self.filterModel.setSourceModel(self.sceneModel)
+        self.entityListView = QListView()
+        self.entityListView.setModel(self.filterModel)
+        # Every row has the same height, so the view never measures rows it does not show
+        self.entityListView.setUniformItemSizes(True)
+        self.entityListView.setLayoutMode(QListView.Batched)
+        # Thumbnails are rendered at THUMBNAIL_SIZE and shown smaller, so the list stays compact
+        self.entityListView.setIconSize(QSize(32, 32))
+        self.layout.addWidget(self.entityListView)
+
+        self.searchEdit.textChanged.connect(self.filterModel.setSearchText)
+        self.shapeFilterComboBox.currentTextChanged.connect(self.applyShapeFilter)
 
         # Create a label for the combo box
         self.shapeLabel = QLabel("Select shape to add:")
@@ -57,10 +125,39 @@ class UIWidget(QWidget):
         self.addButton = QPushButton("Add object")
         self.layout.addWidget(self.addButton)
 
+        # Create a button to import STL files, with a progress bar and a cancel button shown while they load
+        self.importButton = QPushButton("Import STL...")
+        self.layout.addWidget(self.importButton)
+        self.importProgressBar = QProgressBar()
+        self.importProgressBar.hide()
+        self.layout.addWidget(self.importProgressBar)
+        self.cancelImportButton = QPushButton("Cancel import")
+        self.cancelImportButton.hide()
+        self.layout.addWidget(self.cancelImportButton)
+
         # Create a button to delete entities
         self.deleteButton = QPushButton("Delete object")
         self.layout.addWidget(self.deleteButton)
 
+        # Create a button to export the scene as one mesh file
+        self.exportButton = QPushButton("Export scene...")
+        self.layout.addWidget(self.exportButton)
+
+        # Create a check box for snapping dragged objects to their neighbors
+        self.snapCheckBox = QCheckBox("Snap to objects")
+        self.snapCheckBox.setChecked(True)
+        self.layout.addWidget(self.snapCheckBox)
+
+        # Create a check box for drawing entities with instancing
+        self.instancedCheckBox = QCheckBox("Instanced rendering")
+        self.layout.addWidget(self.instancedCheckBox)
+
+        # Create buttons for baking the listed objects into static batches and undoing that
+        self.freezeButton = QPushButton("Freeze listed objects")
+        self.layout.addWidget(self.freezeButton)
+        self.thawButton = QPushButton("Thaw all objects")
+        self.layout.addWidget(self.thawButton)
+
         # Create undo and redo buttons
         """ TODO: Buttons should be disabled when there is nothing to undo or redo """
         self.undoButton = QPushButton("Undo")
@@ -69,10 +166,60 @@ class UIWidget(QWidget):
         self.redoButton = QPushButton("Redo")
         self.layout.addWidget(self.redoButton)
 
+        # Create a toggle button for the profiler panel
+        self.profilerButton = QPushButton("Profiler")
+        self.profilerButton.setCheckable(True)
+        self.layout.addWidget(self.profilerButton)
+
+        # Create a label for errors and status messages
+        self.statusLabel = QLabel()
+        self.statusLabel.setWordWrap(True)
+        self.layout.addWidget(self.statusLabel)
+
     def addToList(self, entity):
         # Add an entity to the list
-        entityItem = QListWidgetItem(entity.name)
-        entityItem.setData(Qt.UserRole, entity)
-        self.entityWidgetList.addItem(entityItem)
-        self.entityWidgetList.setCurrentItem(entityItem)
-        
\ No newline at end of file
+        self.sceneModel.addEntities([entity])
+        self.selectEntity(entity)
+
+    def addEntitiesToList(self, entities):
+        # Add several entities with a single model update
+        self.sceneModel.addEntities(entities)
+
+    def removeFromList(self, entities):
+        # Remove entities from the list
+        self.sceneModel.removeEntities(entities)
+
+    def currentEntity(self):
+        index = self.entityListView.currentIndex()
+        return index.data(EntityRole) if index.isValid() else None
+
+    def listedEntities(self):
+        # Read the filter's matches directly instead of mapping every proxy row
+        entities = self.sceneModel.entities
+        if self.filterModel.accepted is None:
+            return list(entities)
+        return [entity for entity, accepted in zip(entities, self.filterModel.accepted) if accepted]
+
+    def selectEntity(self, entity):
+        index = self.filterModel.mapFromSource(self.sceneModel.indexOf(entity))
+        if not index.isValid():
+            # The entity is hidden by the filters, so clear them to show it
+            self.searchEdit.clear()
+            self.shapeFilterComboBox.setCurrentIndex(0)
+            index = self.filterModel.mapFromSource(self.sceneModel.indexOf(entity))
+        self.entityListView.selectionModel().setCurrentIndex(index, QItemSelectionModel.ClearAndSelect)
+        self.entityListView.scrollTo(index)
+
+    def applyShapeFilter(self, text):
+        self.filterModel.setShape(None if self.shapeFilterComboBox.currentIndex() == 0 else text)
+
+    def showImportProgress(self, done, total):
+        importing = total > 0
+        self.importProgressBar.setVisible(importing)
+        self.cancelImportButton.setVisible(importing)
+        if importing:
+            self.importProgressBar.setRange(0, total)
+            self.importProgressBar.setValue(done)
+
+    def showStatus(self, message):
+        self.statusLabel.setText(message)
@@ -0,0 +1,143 @@
+"""
+Tests of the scene-wide undo history and which entities it deletes. Run from the root directory:
+    python -m pytest tests
+"""
+from src.commandStack import AddEntitiesCommand, CommandStack, DeleteEntitiesCommand
+
+
+class FakeEntity:
+    """ Stands in for Entity3D: a row while in the scene, and a mesh until it is removed for good. """
+
+    def __init__(self):
+        self.row = 0
+        self.mesh = object()
+
+    def toDict(self):
+        return {'name': 'entity'}
+
+    def remove(self):
+        self.row = None
+        self.mesh = None
+
+
+class FakeWindow:
+    """ Stands in for MainWindow, refusing to bring back an entity that was removed for good. """
+
+    def __init__(self):
+        self.entities = {}
+
+    def add(self, stack, count=1):
+        entities = [FakeEntity() for _ in range(count)]
+        self.entities.update(dict.fromkeys(entities))
+        stack.push(AddEntitiesCommand(self, entities))
+        return entities
+
+    def delete(self, stack, entities):
+        command = DeleteEntitiesCommand(self, entities)
+        command.execute()
+        stack.push(command)
+
+    def attachEntities(self, entities):
+        for entity in entities:
+            assert entity.mesh is not None, "a removed entity was attached again"
+            entity.row = 0
+            self.entities[entity] = None
+
+    def detachEntities(self, entities):
+        for entity in entities:
+            entity.row = None
+            del self.entities[entity]
+
+
+def test_undoRedoAddAndDelete():
+    window, stack = FakeWindow(), CommandStack()
+    entity, = window.add(stack)
+    window.delete(stack, [entity])
+    assert entity.row is None
+
+    stack.undo()
+    assert entity in window.entities
+    stack.undo()
+    assert entity not in window.entities
+    assert stack.undo() is None
+
+    stack.redo()
+    assert entity in window.entities
+    stack.redo()
+    assert entity not in window.entities
+    assert stack.redo() is None
+    assert entity.mesh is not None
+
+
+def test_evictedAddKeepsEntitiesOfDelete():
+    # The add command leaves the history while the delete command can still bring the cube back
+    window, stack = FakeWindow(), CommandStack(maxEntries=4)
+    cube, = window.add(stack)
+    window.delete(stack, [cube])
+    for _ in range(3):
+        window.add(stack)
+    assert stack.evicted == 1
+    assert cube.mesh is not None
+
+    while stack.undo() is not None:
+        pass
+    assert list(window.entities) == [cube]
+
+
+def test_evictedDeleteRemovesEntities():
+    window, stack = FakeWindow(), CommandStack(maxEntries=2)
+    cube, = window.add(stack)
+    window.delete(stack, [cube])
+    window.add(stack)
+    window.add(stack)
+    assert stack.evicted == 2
+    assert cube.mesh is None
+
+
+def test_evictionAtMaxEntries():
+    window, stack = FakeWindow(), CommandStack(maxEntries=3)
+    added = [window.add(stack)[0] for _ in range(5)]
+    assert len(stack) == 3
+    assert stack.index == 2
+    assert stack.evicted == 2
+    # Executed adds leave their entities in the scene
+    assert all(entity.mesh is not None for entity in added)
+    while stack.undo() is not None:
+        pass
+    assert list(window.entities) == added[:2]
+
+
+def test_evictionAtMaxBytes():
+    window, stack = FakeWindow(), CommandStack()
+    window.add(stack)
+    stack.maxBytes = stack.bytes * 2
+    for _ in range(3):
+        window.add(stack)
+    assert len(stack) == 2
+    assert stack.bytes <= stack.maxBytes
+    assert stack.bytes == sum(command.size for command in stack.commands)
+
+    # The command just added is kept even when it alone is over the budget
+    stack.maxBytes = 0
+    window.add(stack)
+    assert len(stack) == 1
+
+
+def test_redoTailRemovesOnlyUnreferencedEntities():
+    window, stack = FakeWindow(), CommandStack()
+    kept, = window.add(stack)
+    undoneAdd, = window.add(stack)
+    window.delete(stack, [kept])
+    stack.undo()
+    stack.undo()
+    assert kept in window.entities and undoneAdd not in window.entities
+
+    # The undone delete and the undone add are cut off; only the entity of the undone add is unreachable
+    window.add(stack)
+    assert len(stack) == 2
+    assert undoneAdd.mesh is None
+    assert kept.mesh is not None and kept in window.entities
+    stack.undo()
+    stack.undo()
+    stack.redo()
+    assert kept in window.entities
@@ -0,0 +1,103 @@
+"""
+Tests of replaying the scene journal after a crash and after compaction. Run from the root directory:
+    python -m pytest tests
+"""
+import os
+
+from src.sceneJournal import SceneJournal
+
+
+class FakeEntity:
+    """ Stands in for Entity3D, which the journal only asks for its id and dictionary. """
+
+    def __init__(self, id, x):
+        self.id = id
+        self.data = {'id': id, 'name': f'Cube{id}', 'shape': 'Cube', 'position': (x, 0.0, 0.0),
+                     'orientation': (1.0, 0.0, 0.0, 0.0), 'color': (255, 255, 255, 255), 'dimensions': (1, 1, 1)}
+
+    def toDict(self):
+        return dict(self.data)
+
+
+class Scene:
+    """ The entities a journal records, in the order a snapshot lists them. """
+
+    def __init__(self):
+        self.entities = {}
+
+    def snapshot(self):
+        return [entity.toDict() for entity in self.entities.values()]
+
+
+def normalized(records):
+    # JSON gives lists where a binary snapshot gives tuples
+    return {data['id']: {key: tuple(value) if isinstance(value, list) else value for key, value in data.items()}
+            for data in records}
+
+
+def crash(journal):
+    # Write what a flush would have written, then stop without the final snapshot of close
+    journal.writePending()
+    journal.file.close()
+    journal.file = None
+    if journal.compactor is not None:
+        journal.compactor.join()
+
+
+def edit(journal, scene, ids):
+    # Create, move and delete entities, leaving the even ones moved and the odd ones deleted
+    for id in ids:
+        entity = FakeEntity(str(id), float(id))
+        scene.entities[entity.id] = entity
+        journal.recordCreate(entity)
+    for id in ids:
+        entity = scene.entities[str(id)]
+        if id % 2:
+            del scene.entities[entity.id]
+            journal.recordDelete(entity)
+        else:
+            entity.data['position'] = (float(id), 2.5, 0.0)
+            journal.recordUpdate(entity, {'position': entity.data['position']})
+
+
+def replayed(path):
+    journal = SceneJournal(path, lambda: [])
+    records = list(journal.load())
+    journal.file.close()
+    return normalized(records)
+
+
+def test_replayStopsAtTruncatedRecord(tmp_path):
+    path = str(tmp_path / 'entities.scene')
+    scene = Scene()
+    journal = SceneJournal(path, scene.snapshot)
+    list(journal.load())
+    edit(journal, scene, range(4))
+    crash(journal)
+
+    # A crash in the middle of a write leaves the last line cut short
+    with open(journal.journalPath, 'a', encoding='utf-8') as f:
+        f.write('{"op": "create", "id": "9", "data": {"na')
+    assert replayed(path) == normalized(scene.snapshot())
+
+
+def test_replayAfterCompactionMatchesFullLog(tmp_path):
+    fullPath = str(tmp_path / 'full' / 'entities.scene')
+    compactedPath = str(tmp_path / 'compacted' / 'entities.scene')
+    os.makedirs(os.path.dirname(fullPath))
+    os.makedirs(os.path.dirname(compactedPath))
+
+    results = []
+    for path, threshold in ((fullPath, 10 ** 6), (compactedPath, 5)):
+        scene = Scene()
+        journal = SceneJournal(path, scene.snapshot, compactThreshold=threshold)
+        list(journal.load())
+        for start in range(0, 40, 8):
+            edit(journal, scene, range(start, start + 8))
+            journal.flush()
+        crash(journal)
+        results.append(replayed(path))
+
+    assert os.path.exists(compactedPath)
+    assert not os.path.exists(fullPath)
+    assert results[0] == results[1] == normalized(scene.snapshot())
@@ -0,0 +1,105 @@
+"""
+Tests of the parent/child hierarchy of the scene store. Run from the root directory:
+    python -m pytest tests
+"""
+import math
+
+import numpy as np
+
+from src.sceneStore import SceneStore
+
+
+class View:
+    """ Stands in for Entity3D, which the store only tells its row, with the parent links Entity3D keeps. """
+
+    def __init__(self, store, translation=(0, 0, 0), rotation=(1, 0, 0, 0), parent=None):
+        self.store = store
+        self.row = store.allocate(self)
+        self.state = None
+        self.parent = parent
+        self.children = []
+        store.translation[self.row] = translation
+        store.rotation[self.row] = rotation
+        if parent is not None:
+            parent.children.append(self)
+            store.setParent(self.row, parent.row)
+
+    def detach(self):
+        self.state = self.store.readRow(self.row)
+        self.store.release(self.row)
+        self.row = None
+
+    def attach(self):
+        # The same links Entity3D.attach makes again
+        self.row = self.store.allocate(self)
+        self.store.writeRow(self.row, self.state)
+        if self.parent is not None and self.parent.row is not None:
+            self.store.setParent(self.row, self.parent.row)
+        for child in self.children:
+            if child.row is not None:
+                self.store.reparent(child.row, self.row)
+
+
+def world(view):
+    view.store.updateWorld()
+    return (view.store.worldTranslation[view.row].copy(), view.store.worldRotation[view.row].copy())
+
+
+def buildScene():
+    # A parent turned a quarter turn about Z, a child and grandchild under it, and rows after them that move
+    # into the released slots
+    store = SceneStore()
+    quarter = (math.cos(math.pi / 4), 0, 0, math.sin(math.pi / 4))
+    before = View(store, (-3, 0, 0))
+    parent = View(store, (5, 0, 0), quarter)
+    child = View(store, (1, 0, 0), quarter, parent)
+    grandchild = View(store, (0, 2, 0), parent=child)
+    after = [View(store, (0, 0, i)) for i in range(3)]
+    return store, [before, parent, child, grandchild] + after
+
+
+def assertSameWorld(views, worlds):
+    for view, (translation, rotation) in zip(views, worlds):
+        actual = world(view)
+        np.testing.assert_allclose(actual[0], translation, atol=1e-5)
+        np.testing.assert_allclose(actual[1], rotation, atol=1e-5)
+
+
+def test_deleteParentAndUndo():
+    store, views = buildScene()
+    parent, child, grandchild = views[1:4]
+    worlds = [world(view) for view in views]
+    np.testing.assert_allclose(worlds[2][0], (5, 1, 0), atol=1e-5)
+
+    # Only the parent leaves; its children stay where they are, at the top of the hierarchy
+    parent.detach()
+    remaining = [view for view in views if view is not parent]
+    assertSameWorld(remaining, [worlds[views.index(view)] for view in remaining])
+    assert store.parent[child.row] == -1
+    assert store.parent[grandchild.row] == child.row
+    assert store.children[:store.count].sum() == 1
+
+    parent.attach()
+    assertSameWorld(views, worlds)
+    assert store.parent[child.row] == parent.row
+    np.testing.assert_allclose(store.translation[child.row], (1, 0, 0), atol=1e-5)
+
+
+def test_deleteSubtreeAndUndo():
+    # The way deleteEntity does it: children are released first and attached after their parent
+    store, views = buildScene()
+    parent, child, grandchild = views[1:4]
+    worlds = [world(view) for view in views]
+    subtree = [store.views[row] for row in store.subtree(parent.row)]
+    assert subtree == [parent, child, grandchild]
+
+    for view in reversed(subtree):
+        view.detach()
+    assert store.count == len(views) - 3
+    assert not store.children[:store.count].any()
+
+    for view in subtree:
+        view.attach()
+    assertSameWorld(views, worlds)
+    assert store.parent[grandchild.row] == child.row
+    np.testing.assert_allclose(store.translation[grandchild.row], (0, 2, 0), atol=1e-5)
@@ -0,0 +1,72 @@
+"""
+Tests of the STL mesh processing. Run from the root directory:
+    python -m pytest tests
+"""
+import os
+
+import numpy as np
+
+from src.sceneValidator import meshDefects
+from src.stlLoader import BINARY_TRIANGLE, buildMesh, loadStl, weldPositions
+
+# The corners of a unit cube, two counterclockwise triangles per face seen from outside
+CUBE = np.array([
+    [(1, 0, 0), (1, 1, 0), (1, 1, 1)], [(1, 0, 0), (1, 1, 1), (1, 0, 1)],
+    [(0, 0, 0), (0, 0, 1), (0, 1, 1)], [(0, 0, 0), (0, 1, 1), (0, 1, 0)],
+    [(0, 1, 0), (0, 1, 1), (1, 1, 1)], [(0, 1, 0), (1, 1, 1), (1, 1, 0)],
+    [(0, 0, 0), (1, 0, 0), (1, 0, 1)], [(0, 0, 0), (1, 0, 1), (0, 0, 1)],
+    [(0, 0, 1), (1, 0, 1), (1, 1, 1)], [(0, 0, 1), (1, 1, 1), (0, 1, 1)],
+    [(0, 0, 0), (0, 1, 0), (1, 1, 0)], [(0, 0, 0), (1, 1, 0), (1, 0, 0)],
+], np.float32)
+
+
+def writeBinaryStl(path, triangles):
+    records = np.zeros(len(triangles), BINARY_TRIANGLE)
+    records['vertices'] = triangles
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 80 + np.uint32(len(triangles)).tobytes() + records.tobytes())
+
+
+def checkCube(mesh):
+    assert len(mesh.vertices) == 24
+    assert len(mesh.indices) == 36
+    np.testing.assert_array_equal(mesh.triangles(), CUBE)
+    # Every normal is a unit axis, and the three corners of each triangle face the same way
+    normals = mesh.normals()
+    np.testing.assert_array_equal(np.sort(np.abs(normals), axis=1), np.tile((0, 0, 1), (24, 1)))
+    corners = normals[mesh.indices.reshape(-1, 3)]
+    np.testing.assert_array_equal(corners[:, 0], corners[:, 1])
+    np.testing.assert_array_equal(corners[:, 0], corners[:, 2])
+
+
+def test_cubeKeepsHardEdges(tmp_path):
+    path = os.path.join(tmp_path, 'cube.stl')
+    writeBinaryStl(path, CUBE)
+    checkCube(loadStl(path))
+
+
+def test_signedZerosAreMerged():
+    # -0.0 and 0.0 are the same position
+    triangles = CUBE.copy()
+    triangles[::2][triangles[::2] == 0] = -0.0
+    checkCube(buildMesh(triangles))
+    positions, _ = weldPositions(triangles.reshape(-1, 3))
+    assert len(positions) == 8
+
+
+def test_shallowSurfaceIsSmooth():
+    # A low hexagonal pyramid, whose faces meet at less than the crease angle, shares its apex
+    angles = np.radians(np.arange(0, 360, 60))
+    rim = np.stack((np.cos(angles), np.sin(angles), np.zeros(6)), axis=1)
+    apex = np.array((0, 0, 0.1))
+    triangles = np.array([(apex, rim[i], rim[(i + 1) % 6]) for i in range(6)], np.float32)
+    mesh = buildMesh(triangles)
+    apexNormals = mesh.normals()[np.all(mesh.positions() == apex.astype(np.float32), axis=1)]
+    assert len(apexNormals) == 1
+    np.testing.assert_allclose(apexNormals[0], (0, 0, 1), atol=1e-6)
+
+
+def test_meshDefectsWeldSplitVertices():
+    result = meshDefects(buildMesh(CUBE))
+    assert result == {'triangles': 12, 'degenerateTriangles': 0, 'openEdges': 0, 'nonManifoldEdges': 0}
+
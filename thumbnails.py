@@ -0,0 +1,70 @@
+"""
+Renders thumbnails of the STL files in a directory into the thumbnail cache, without starting the GUI.
+
+Run from the root directory:
+    python thumbnails.py stl [--output thumbnails] [--size 64] [--jobs 4] [--recursive]
+
+Files are rendered in parallel by worker processes. Thumbnails are named by the SHA-256 of the file and the
+render settings, like the ones the GUI renders for the STL picker and the object list, so running this before
+opening a folder in the picker fills it in at once; files whose thumbnail is cached already are only hashed.
+Each file is printed with its thumbnail. The exit status is 0 if every file was thumbnailed and 1 otherwise.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from src.constants import THUMBNAIL_DIR, THUMBNAIL_SIZE
+from src.thumbnails import ThumbnailCache, fileThumbnail
+
+
+def stlFiles(directory, recursive):
+    if not recursive:
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.lower().endswith('.stl'))
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                  for name in names if name.lower().endswith('.stl'))
+
+
+def thumbnail(path, directory, size):
+    # Runs in a worker process; only strings cross the process boundary
+    cache = ThumbnailCache(directory)
+    try:
+        key, _, cached = fileThumbnail(path, cache, size)
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+    return path, cache.path(key), 'cached' if cached else 'rendered'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--output', default=THUMBNAIL_DIR, help="the thumbnail cache directory")
+    parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--recursive', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        paths = stlFiles(args.directory, args.recursive)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    failed = 0
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = [pool.submit(thumbnail, path, args.output, args.size) for path in paths]
+        for future in futures:
+            path, thumbnailPath, status = future.result()
+            if thumbnailPath is None:
+                failed += 1
+                print(f"Error: could not thumbnail {path}: {status}")
+            else:
+                print(f"{path} -> {thumbnailPath} ({status})")
+    print(f"{len(paths) - failed} of {len(paths)} files thumbnailed into {args.output}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
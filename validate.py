@@ -0,0 +1,72 @@
+"""
+Checks a .scene or .json scene file and writes a repaired copy and a report, without starting the GUI.
+
+Run from the root directory:
+    python validate.py entities.json [--output repaired.json] [--report report.json] [--jobs 4]
+
+JSON scenes may be compressed as .json.gz or .json.zst. Records are validated in parallel by worker processes.
+Unknown shapes, STL entities whose file cannot be read and records that are not objects are dropped. Missing or
+non-finite positions, orientations, dimensions and colors are reset, orientations that are not unit quaternions
+are normalized, and duplicate names and ids are made unique. STL files are also checked for degenerate triangles
+and open or non-manifold edges, which are reported but kept. The exit status is 0 if nothing had to be repaired,
+1 if records were repaired or dropped and 2 if the scene could not be read or the repaired copy could not be
+written.
+"""
+import argparse
+import json
+import os
+import sys
+
+from src.constants import ASSET_DIR, VALIDATE_CHUNK_SIZE
+from src.sceneFormat import GZIP_EXTENSION, ZSTD_EXTENSION
+from src.sceneValidator import WARNING, SceneValidator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scene')
+    parser.add_argument('--output', help="the repaired scene; defaults to <scene>.repaired.<extension>")
+    parser.add_argument('--report', help="the JSON report; defaults to <scene>.report.json")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=VALIDATE_CHUNK_SIZE)
+    parser.add_argument('--assets', default=ASSET_DIR)
+    args = parser.parse_args()
+
+    stem, extension = os.path.splitext(args.scene)
+    if extension in (GZIP_EXTENSION, ZSTD_EXTENSION):
+        # Keep the format of a compressed scene, e.g. entities.repaired.json.gz
+        stem, inner = os.path.splitext(stem)
+        extension = inner + extension
+    output = args.output or f"{stem}.repaired{extension}"
+    reportPath = args.report or f"{stem}.report.json"
+
+    validator = SceneValidator(args.jobs, args.chunk_size, args.assets)
+    try:
+        report = validator.run(args.scene, output)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+    report = dict(scene=args.scene, output=output, **report)
+    with open(reportPath, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{report['records']} records read, {report['written']} written to {output}")
+    for key, count in report['counts'].items():
+        print(f"{count:>8}  {key}")
+    for mesh in report['meshes']:
+        defects = ', '.join(f"{mesh[key]} {key}" for key in ('degenerateTriangles', 'openEdges', 'nonManifoldEdges')
+                            if mesh.get(key))
+        if 'error' in mesh or defects:
+            print(f"STL {mesh['source'] or mesh['asset']}: {mesh.get('error', defects)}")
+    if report['error']:
+        print(f"Error: {report['error']}; the records after it are missing from {output}")
+    print(f"Report written to {reportPath}")
+
+    if report['error']:
+        sys.exit(2)
+    if any(issue['action'] != WARNING for issue in report['issues']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()